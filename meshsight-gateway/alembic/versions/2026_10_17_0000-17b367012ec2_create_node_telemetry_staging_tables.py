@@ -0,0 +1,42 @@
+"""create node_telemetry staging tables
+
+Revision ID: 17b367012ec2
+Revises: 2856929c53a1
+Create Date: 2026-10-17 00:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '17b367012ec2'
+down_revision: Union[str, None] = '2856929c53a1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 以 COPY 寫入遙測資料的暫存資料表，定時合併至正式資料表
+TABLES = [
+    "node_telemetry_air_quality",
+    "node_telemetry_device",
+    "node_telemetry_environment",
+    "node_telemetry_power",
+]
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        # UNLOGGED 不寫入 WAL，資料庫異常關閉時暫存資料會被清空；
+        # 不含主鍵與外鍵，重複的資料於合併時處理
+        op.execute(f"""
+            CREATE UNLOGGED TABLE {table}_staging
+            (LIKE {table} INCLUDING DEFAULTS);
+        """)
+    pass
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.drop_table(f"{table}_staging")
+    pass
@@ -0,0 +1,96 @@
+"""create node_telemetry_local_stats and node_telemetry_health tables
+
+Revision ID: b78a3ab6f508
+Revises: 17b367012ec2
+Create Date: 2026-10-17 00:01:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b78a3ab6f508'
+down_revision: Union[str, None] = '17b367012ec2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def telemetry_columns() -> list:
+    return [
+        sa.Column("uuid", sa.UUID(as_uuid=True), default=uuid.uuid4),
+        sa.Column(
+            "node_id",
+            sa.BigInteger,
+            sa.ForeignKey("node.id", ondelete="CASCADE"),
+            nullable=False,
+            primary_key=True,
+        ),
+    ]
+
+
+def timestamp_columns() -> list:
+    return [
+        sa.Column(
+            "create_at",
+            sa.DateTime(timezone=True),
+            nullable=False,
+            primary_key=True,
+        ),
+        sa.Column(
+            "update_at",
+            sa.DateTime(timezone=True),
+            nullable=False,
+            default=sa.func.now(),
+        ),
+        sa.Column("topic", sa.String(512), nullable=False),
+    ]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "node_telemetry_local_stats",
+        *telemetry_columns(),
+        # uint32 的計數與位元組數超過 Integer（int32）的範圍
+        sa.Column("uptime_seconds", sa.BigInteger, nullable=True),
+        sa.Column("channel_utilization", sa.Float, nullable=True),
+        sa.Column("air_util_tx", sa.Float, nullable=True),
+        sa.Column("num_packets_tx", sa.BigInteger, nullable=True),
+        sa.Column("num_packets_rx", sa.BigInteger, nullable=True),
+        sa.Column("num_packets_rx_bad", sa.BigInteger, nullable=True),
+        sa.Column("num_online_nodes", sa.BigInteger, nullable=True),
+        sa.Column("num_total_nodes", sa.BigInteger, nullable=True),
+        sa.Column("num_rx_dupe", sa.BigInteger, nullable=True),
+        sa.Column("num_tx_relay", sa.BigInteger, nullable=True),
+        sa.Column("num_tx_relay_canceled", sa.BigInteger, nullable=True),
+        sa.Column("heap_total_bytes", sa.BigInteger, nullable=True),
+        sa.Column("heap_free_bytes", sa.BigInteger, nullable=True),
+        sa.Column("num_tx_dropped", sa.BigInteger, nullable=True),
+        sa.Column("noise_floor", sa.Integer, nullable=True),
+        *timestamp_columns(),
+    )
+    op.create_table(
+        "node_telemetry_health",
+        *telemetry_columns(),
+        sa.Column("heart_bpm", sa.Integer, nullable=True),
+        sa.Column("spo2", sa.Integer, nullable=True),
+        sa.Column("temperature", sa.Float, nullable=True),
+        *timestamp_columns(),
+    )
+    # 與其他遙測資料表相同，建立以 COPY 寫入的暫存資料表
+    for table in ["node_telemetry_local_stats", "node_telemetry_health"]:
+        op.execute(f"""
+            CREATE UNLOGGED TABLE {table}_staging
+            (LIKE {table} INCLUDING DEFAULTS);
+        """)
+    pass
+
+
+def downgrade() -> None:
+    for table in ["node_telemetry_local_stats", "node_telemetry_health"]:
+        op.drop_table(f"{table}_staging")
+        op.drop_table(table)
+    pass
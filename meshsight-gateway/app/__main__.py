@@ -1,7 +1,9 @@
 import asyncio
 import logging
 import os
+import sys
 from app.main import main
+from app.replay import replay
 from app.utils.ConfigUtil import ConfigUtil
 from fastapi.logger import logger as fastapi_logger
 
@@ -50,6 +52,10 @@ def configure_gunicorn_logging():
 
 if __name__ == "__main__":
     configure_logging()
-    asyncio.run(main())
+    if sys.argv[1:2] == ["replay"]:
+        # 重新匯入原始封包: python -m app replay --help
+        asyncio.run(replay(sys.argv[2:]))
+    else:
+        asyncio.run(main())
 else:
     configure_gunicorn_logging()
@@ -1,11 +1,13 @@
 import asyncio
 import logging
 import os
+import signal
 from alembic.config import Config
 from alembic import command
 from app.configs.Scheduler import start_scheduler, shutdown_scheduler
 from app.routers import routers
 from app.services.SystemSchedulerService import SystemSchedulerService
+from app.services.IngestShardService import IngestShardService
 from app.services.MqttListenerService import MqttListenerService
 from app.utils.ConfigUtil import ConfigUtil
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -59,7 +61,12 @@ async def start_api():
 
 async def start_mqtt_listener():
     logger.info("MQTT Linstener 正在啟動...")
-    task_job = asyncio.create_task(MqttListenerService().start())
+    ingest_shard_service = IngestShardService()
+    if ingest_shard_service.shards > 1:
+        # 以多個 process 接收，各自維護快取與批次寫入
+        task_job = asyncio.create_task(ingest_shard_service.start())
+    else:
+        task_job = asyncio.create_task(MqttListenerService().start())
     logger.info("MQTT Linstener 已啟動")
 
 
@@ -82,6 +89,10 @@ def start_scheduler_job():
 
 async def main():
     logger.info("meshsight-gateway is running...")
+    # 收到 SIGTERM 時取消主任務，讓子服務有機會完成收尾（例如寫入緩衝資料）
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
     # 等待 5 秒以確保服務啟動
     await asyncio.sleep(5)
     logger.info("正在初始化資料模型屬性...")
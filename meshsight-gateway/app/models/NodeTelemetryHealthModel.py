@@ -0,0 +1,28 @@
+import sqlalchemy as sa
+import uuid
+from app.models.BaseModel import EntityMeta
+
+
+class NodeTelemetryHealth(EntityMeta):
+    __tablename__ = "node_telemetry_health"
+
+    uuid = sa.Column(sa.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    node_id = sa.Column(
+        sa.BigInteger,
+        sa.ForeignKey("node.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    heart_bpm = sa.Column(sa.Integer, nullable=True)
+    spo2 = sa.Column(sa.Integer, nullable=True)
+    temperature = sa.Column(sa.Float, nullable=True)
+    create_at = sa.Column(
+        sa.DateTime(timezone=True),
+        nullable=False,
+        primary_key=True,
+    )
+    update_at = sa.Column(
+        sa.DateTime(timezone=True),
+        nullable=False,
+        default=sa.func.now(),
+    )
+    topic = sa.Column(sa.String(512), nullable=False)
@@ -0,0 +1,41 @@
+import sqlalchemy as sa
+import uuid
+from app.models.BaseModel import EntityMeta
+
+
+class NodeTelemetryLocalStats(EntityMeta):
+    __tablename__ = "node_telemetry_local_stats"
+
+    uuid = sa.Column(sa.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    node_id = sa.Column(
+        sa.BigInteger,
+        sa.ForeignKey("node.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    # uint32 的計數與位元組數超過 Integer（int32）的範圍，使用 BigInteger
+    uptime_seconds = sa.Column(sa.BigInteger, nullable=True)
+    channel_utilization = sa.Column(sa.Float, nullable=True)
+    air_util_tx = sa.Column(sa.Float, nullable=True)
+    num_packets_tx = sa.Column(sa.BigInteger, nullable=True)
+    num_packets_rx = sa.Column(sa.BigInteger, nullable=True)
+    num_packets_rx_bad = sa.Column(sa.BigInteger, nullable=True)
+    num_online_nodes = sa.Column(sa.BigInteger, nullable=True)
+    num_total_nodes = sa.Column(sa.BigInteger, nullable=True)
+    num_rx_dupe = sa.Column(sa.BigInteger, nullable=True)
+    num_tx_relay = sa.Column(sa.BigInteger, nullable=True)
+    num_tx_relay_canceled = sa.Column(sa.BigInteger, nullable=True)
+    heap_total_bytes = sa.Column(sa.BigInteger, nullable=True)
+    heap_free_bytes = sa.Column(sa.BigInteger, nullable=True)
+    num_tx_dropped = sa.Column(sa.BigInteger, nullable=True)
+    noise_floor = sa.Column(sa.Integer, nullable=True)
+    create_at = sa.Column(
+        sa.DateTime(timezone=True),
+        nullable=False,
+        primary_key=True,
+    )
+    update_at = sa.Column(
+        sa.DateTime(timezone=True),
+        nullable=False,
+        default=sa.func.now(),
+    )
+    topic = sa.Column(sa.String(512), nullable=False)
@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from app.services.MqttListenerService import MqttListenerService
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.PacketArchiveUtil import PacketArchiveUtil
+from app.utils.PcapUtil import PcapUtil
+
+# 設定檔讀取
+config = ConfigUtil().read_config()
+
+logger = logging.getLogger(__name__)
+logger.setLevel(config.get("log", {}).get("level", "INFO").upper())
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m app replay",
+        description="將保存的原始封包或 MQTT 的 pcap 檔案重新匯入，解碼與寫入流程與即時接收相同",
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--archive",
+        help="原始封包保存路徑，預設為 ingest.archive.path",
+    )
+    source.add_argument("--pcap", help="MQTT 的 pcap 檔案")
+    parser.add_argument(
+        "--port", type=int, default=1883, help="pcap 中 MQTT broker 的 port"
+    )
+    parser.add_argument(
+        "--start", type=datetime.fromisoformat, help="開始時間（ISO 8601）"
+    )
+    parser.add_argument("--end", type=datetime.fromisoformat, help="結束時間（ISO 8601）")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="重播速度倍率，例如 10 為 10 倍速；0 為不等待，以資料庫可處理的最快速度匯入",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=10,
+        help="進度輸出間隔，單位為 second",
+    )
+    return parser.parse_args(argv)
+
+
+# 依序回傳 (received_at, broker, topic, payload)
+def read_records(args: argparse.Namespace):
+    start = args.start.timestamp() if args.start else None
+    end = args.end.timestamp() if args.end else None
+    if args.pcap:
+        for record in PcapUtil.read_mqtt_publishes(args.pcap, args.port):
+            if start is not None and record[0] < start:
+                continue
+            if end is not None and record[0] > end:
+                break
+            yield record
+        return
+    path = args.archive or config.get("ingest", {}).get("archive", {}).get(
+        "path", "archive"
+    )
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"找不到原始封包保存路徑: {path}")
+    yield from PacketArchiveUtil.read_archive(path, start, end)
+
+
+async def replay(argv: list):
+    args = parse_args(argv)
+    # 重新匯入時不再保存原始封包，也不依即時流量捨棄訊息，避免大量補入的資料被捨棄
+    listener = MqttListenerService(archive=False, load_shedding=False)
+    await listener.start_pipeline()
+    count = 0
+    started_at = time.monotonic()
+    reported_at = started_at
+    first_received_at = None
+    try:
+        for received_at, broker, topic, payload in read_records(args):
+            if args.speed > 0:
+                # 依原始收到的時間間隔等待
+                if first_received_at is None:
+                    first_received_at = received_at
+                delay = (received_at - first_received_at) / args.speed - (
+                    time.monotonic() - started_at
+                )
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await listener.receive(broker, topic, payload, received_at)
+            count += 1
+            now = time.monotonic()
+            if now - reported_at >= args.progress_interval:
+                reported_at = now
+                logger.info(
+                    f"已匯入 {count} 筆，{count / (now - started_at):.1f} 筆/秒，"
+                    f"目前時間 {datetime.fromtimestamp(received_at).isoformat()}"
+                )
+            # 讓出執行權給 worker 與定時寫入
+            if count % 100 == 0:
+                await asyncio.sleep(0)
+    finally:
+        # 等待佇列與緩衝寫入完成後才計算耗時
+        await listener.stop_pipeline()
+    elapsed = time.monotonic() - started_at
+    logger.info(
+        f"匯入完成: {count} 筆，耗時 {elapsed:.1f} 秒，"
+        f"{count / elapsed if elapsed > 0 else 0:.1f} 筆/秒"
+    )
+    logger.info(f"統計資訊: {listener.collect_stats()}")
@@ -0,0 +1,351 @@
+import contextlib
+import logging
+import asyncpg
+from datetime import datetime, timezone
+from sqlalchemy.dialects import postgresql
+from app.models.NodeModel import Node
+from app.models.NodeNeighborEdgeModel import NodeNeighborEdge
+from app.services.DurabilityService import DurabilityService
+from app.services.NodeRegistryService import NodeRegistryService
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.MeshtasticUtil import MeshtasticUtil
+from app.utils.NeighborEdgeUtil import NeighborEdgeUtil
+from app.utils.UpsertUtil import UpsertUtil
+
+
+# 延後開始的交易，第一次執行 SQL 時才取得連線並開始交易，
+# 封包的資料全部由批次或 staging 寫入時不佔用連線，也不執行空的 BEGIN/COMMIT
+class IngestTransaction:
+    def __init__(self, pool) -> None:
+        self.pool = pool
+        self.connection = None
+        self.transaction = None
+
+    # 取得連線並開始交易
+    async def begin(self):
+        if self.connection is None:
+            connection = await self.pool.acquire()
+            try:
+                transaction = connection.transaction()
+                await transaction.start()
+            except Exception as e:
+                await self.pool.release(connection)
+                raise e
+            self.connection = connection
+            self.transaction = transaction
+        return self.connection
+
+    async def execute(self, *args):
+        return await (await self.begin()).execute(*args)
+
+    async def executemany(self, *args):
+        return await (await self.begin()).executemany(*args)
+
+    async def fetch(self, *args):
+        return await (await self.begin()).fetch(*args)
+
+    async def fetchrow(self, *args):
+        return await (await self.begin()).fetchrow(*args)
+
+    async def commit(self) -> None:
+        if self.transaction is not None:
+            await self.transaction.commit()
+
+    async def rollback(self) -> None:
+        if self.transaction is not None:
+            await self.transaction.rollback()
+
+    # 歸還連線
+    async def release(self) -> None:
+        if self.connection is not None:
+            connection, self.connection, self.transaction = self.connection, None, None
+            await self.pool.release(connection)
+
+
+# 接收封包寫入用的資料存取，不經過 SQLAlchemy ORM，直接以 asyncpg 執行
+# asyncpg 會快取每個連線已 prepare 的語句，相同的 SQL 只會在第一次執行時 prepare
+class IngestRepository:
+    def __init__(
+        self,
+        node_registry_service: NodeRegistryService,
+        durability_service: DurabilityService,
+    ) -> None:
+        self.config = ConfigUtil().read_config()
+        self.node_registry_service = node_registry_service
+        self.durability_service = durability_service
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        ingest_config = self.config.get("ingest", {})
+        native_config = ingest_config.get("nativeWriter", {})
+        workers = int(ingest_config.get("queue", {}).get("workers", 4))
+        self.min_size = int(native_config.get("minSize", 1))
+        self.max_size = int(native_config.get("maxSize", workers + 1))
+        self.statement_cache_size = int(
+            native_config.get("statementCacheSize", 256)
+        )
+        self.pool = None
+        # 依 (model, 有值的欄位) 快取產生的 SQL
+        self.statements = {}
+        # 各連線目前交易中新建立、尚未 commit 的節點 ID
+        self.pending_node_ids = {}
+        # 各連線目前交易中寫入的資料表
+        self.written_tables = {}
+
+    # 建立專用的連線池
+    async def start(self):
+        if self.pool is not None:
+            return
+        db_config = self.config["postgres"]
+        self.pool = await asyncpg.create_pool(
+            host=db_config["host"],
+            port=int(db_config["port"]),
+            user=db_config["username"],
+            password=db_config["password"],
+            database=db_config["database"],
+            min_size=self.min_size,
+            max_size=self.max_size,
+            statement_cache_size=self.statement_cache_size,
+        )
+
+    async def stop(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    # 開始交易（第一次寫入時才取得連線），commit 後將交易中建立的節點記入已知節點
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        connection = IngestTransaction(self.pool)
+        self.pending_node_ids[connection] = set()
+        self.written_tables[connection] = set()
+        try:
+            try:
+                yield connection
+                if connection.connection is not None:
+                    await self.durability_service.apply_connection(
+                        connection, self.written_tables[connection]
+                    )
+            except BaseException as e:
+                await connection.rollback()
+                raise e
+            await connection.commit()
+            self.node_registry_service.mark_known(self.pending_node_ids[connection])
+        finally:
+            await connection.release()
+            self.pending_node_ids.pop(connection, None)
+            self.written_tables.pop(connection, None)
+
+    # 確保多個節點存在
+    async def ensure_nodes(
+        self, connection, node_ids: list[int], last_heard_at: datetime = None
+    ) -> None:
+        pending_node_ids = self.pending_node_ids.setdefault(connection, set())
+        # 依 ID 排序寫入，只有同一次呼叫中的節點鎖定順序一致；
+        # 交易中之後再建立其他節點仍可能與其他 worker 死結，呼叫端需一次傳入所有節點
+        unknown_node_ids = sorted(
+            node_id
+            for node_id in set(node_ids)
+            if node_id is not None
+            and not self.node_registry_service.is_known(node_id)
+            and node_id not in pending_node_ids
+        )
+        if not unknown_node_ids:
+            return
+        if last_heard_at is None:
+            last_heard_at = datetime.now(timezone.utc)
+        await connection.executemany(
+            "INSERT INTO node (id, id_hex, last_heard_at) VALUES ($1, $2, $3) "
+            "ON CONFLICT (id) DO NOTHING",
+            [
+                (
+                    node_id,
+                    MeshtasticUtil.convert_node_id_from_int_to_hex(node_id),
+                    last_heard_at,
+                )
+                for node_id in unknown_node_ids
+            ],
+        )
+        pending_node_ids.update(unknown_node_ids)
+        self.mark(connection, Node.__tablename__)
+
+    # 新增或更新一筆資料，規則與 UpsertUtil.build_upsert 相同
+    # 以 RETURNING 回傳資料庫中的資料（與 ORM 寫入相同），
+    # 資料庫中的資料較新而未更新時，查詢並回傳現有的資料
+    async def upsert(self, connection, entity):
+        model = type(entity)
+        row = UpsertUtil.entity_to_row(entity)
+        await self.prepare_rows(connection, model, [row])
+        sql, parameter_columns = self.build_upsert(model, tuple(sorted(row)))
+        record = await connection.fetchrow(
+            sql + " RETURNING *", *self.parameters(model, parameter_columns, row)
+        )
+        if record is None:
+            keys = UpsertUtil.CONFLICT_KEYS[model]
+            record = await connection.fetchrow(
+                f"SELECT * FROM {model.__tablename__} WHERE "
+                + " AND ".join(f"{key} = ${i + 1}" for i, key in enumerate(keys)),
+                *(row[key] for key in keys),
+            )
+        return model(**dict(record)) if record is not None else entity
+
+    # 以 executemany 新增或更新多筆資料，依有值的欄位組合分組
+    async def upsert_rows(self, connection, model, rows: list[dict]) -> None:
+        await self.prepare_rows(connection, model, rows)
+        shapes = {}
+        for row in rows:
+            shapes.setdefault(tuple(sorted(row)), []).append(row)
+        for columns, shape_rows in shapes.items():
+            sql, parameter_columns = self.build_upsert(model, columns)
+            await connection.executemany(
+                sql,
+                [
+                    self.parameters(model, parameter_columns, row)
+                    for row in shape_rows
+                ],
+            )
+
+    # 確保外鍵參照的 Node 存在，並記錄寫入的資料表
+    async def prepare_rows(self, connection, model, rows: list[dict]) -> None:
+        if model is Node:
+            # 寫入的節點於同一個交易中不需再確保存在
+            self.pending_node_ids.setdefault(connection, set()).update(
+                row["id"] for row in rows
+            )
+        else:
+            node_ids = [
+                row[column.name]
+                for column in model.__table__.columns
+                if any(fk.target_fullname == "node.id" for fk in column.foreign_keys)
+                for row in rows
+                if column.name in row
+            ]
+            await self.ensure_nodes(
+                connection, node_ids, rows[0].get("update_at") if rows else None
+            )
+        self.mark(connection, model.__tablename__)
+
+    # build_upsert 的參數，未提供的欄位使用 Python 端預設值
+    def parameters(self, model, parameter_columns: list, row: dict) -> tuple:
+        return tuple(
+            self.default_value(model, column) if column not in row else row[column]
+            for column in parameter_columns
+        )
+
+    # 以新的鄰居清單更新多個節點的 NodeNeighborEdge，只寫入有差異的資料
+    # neighbor_edges: {node_id: [{"edge_node_id", "snr"}, ...]}
+    async def sync_neighbor_edges(self, connection, neighbor_edges: dict) -> dict:
+        await self.ensure_nodes(
+            connection,
+            list(neighbor_edges.keys())
+            + [
+                edge["edge_node_id"]
+                for edges in neighbor_edges.values()
+                for edge in edges
+            ],
+        )
+        self.mark(connection, NodeNeighborEdge.__tablename__)
+        existing = {node_id: [] for node_id in neighbor_edges}
+        for record in await connection.fetch(
+            "SELECT node_id, uuid, edge_node_id, snr FROM node_neighbor_edge "
+            "WHERE node_id = ANY($1::bigint[]) ORDER BY node_id, uuid",
+            list(neighbor_edges.keys()),
+        ):
+            existing[record["node_id"]].append(
+                (record["uuid"], record["edge_node_id"], record["snr"])
+            )
+        inserts = []
+        updates = []
+        deletes = []
+        for node_id, edges in neighbor_edges.items():
+            node_inserts, node_updates, node_deletes = NeighborEdgeUtil.diff_edges(
+                existing[node_id], edges
+            )
+            inserts += [
+                (
+                    self.default_value(NodeNeighborEdge, "uuid"),
+                    node_id,
+                    edge["edge_node_id"],
+                    edge.get("snr"),
+                )
+                for edge in node_inserts
+            ]
+            updates += node_updates
+            deletes += node_deletes
+        if deletes:
+            await connection.execute(
+                "DELETE FROM node_neighbor_edge WHERE uuid = ANY($1::uuid[])", deletes
+            )
+        if updates:
+            await connection.executemany(
+                "UPDATE node_neighbor_edge SET snr = $2 WHERE uuid = $1", updates
+            )
+        if inserts:
+            await connection.executemany(
+                "INSERT INTO node_neighbor_edge (uuid, node_id, edge_node_id, snr) "
+                "VALUES ($1, $2, $3, $4)",
+                inserts,
+            )
+        return {
+            "inserted": len(inserts),
+            "updated": len(updates),
+            "deleted": len(deletes),
+        }
+
+    # 記錄連線交易中寫入的資料表
+    def mark(self, connection, table: str) -> None:
+        self.written_tables.setdefault(connection, set()).add(table)
+
+    # 產生 INSERT ... ON CONFLICT DO UPDATE 的 SQL，回傳 (SQL, 參數對應的欄位)
+    # 只更新有值的欄位；未提供但有預設值的欄位於新增時寫入預設值
+    def build_upsert(self, model, columns: tuple) -> tuple:
+        statement = self.statements.get((model, columns))
+        if statement is not None:
+            return statement
+        keys = UpsertUtil.CONFLICT_KEYS[model]
+        table = model.__table__
+        insert_columns = []
+        values = []
+        parameter_columns = []
+        for column in table.columns:
+            default = column.default
+            if column.name not in columns and default is None:
+                continue
+            insert_columns.append(column.name)
+            if column.name not in columns and default.is_clause_element:
+                # SQL 函數的預設值，例如 now()
+                values.append(
+                    str(default.arg.compile(dialect=postgresql.dialect()))
+                )
+                continue
+            parameter_columns.append(column.name)
+            values.append(f"${len(parameter_columns)}")
+        set_list = []
+        for column in columns:
+            if column in keys or column == "uuid":
+                continue
+            if model is Node and column == "last_heard_at":
+                set_list.append(
+                    "last_heard_at = GREATEST(t.last_heard_at, EXCLUDED.last_heard_at)"
+                )
+            else:
+                set_list.append(f"{column} = EXCLUDED.{column}")
+        sql = (
+            f"INSERT INTO {table.name} AS t ({', '.join(insert_columns)}) "
+            f"VALUES ({', '.join(values)}) ON CONFLICT ({', '.join(keys)}) "
+        )
+        if not set_list:
+            sql += "DO NOTHING"
+        else:
+            sql += f"DO UPDATE SET {', '.join(set_list)}"
+            if "update_at" in columns:
+                sql += " WHERE t.update_at <= EXCLUDED.update_at"
+        statement = (sql, parameter_columns)
+        self.statements[(model, columns)] = statement
+        return statement
+
+    # 未提供欄位的 Python 端預設值
+    def default_value(self, model, column: str):
+        default = model.__table__.columns[column].default
+        if default.is_callable:
+            return default.arg(None)
+        return default.arg
@@ -0,0 +1,277 @@
+import copy
+import math
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.internal.type_checkers import ToShortestFloat
+
+try:
+    from meshtastic.protobuf import mesh_pb2, mqtt_pb2, telemetry_pb2
+except ImportError:
+    from meshtastic import mesh_pb2, mqtt_pb2, telemetry_pb2
+
+
+# float32 欄位值轉為最短的十進位表示，與 MessageToJson 相同（25.3 而非 25.2999992...）
+def float_value(value: float):
+    return None if math.isnan(value) else ToShortestFloat(value)
+
+
+# protobuf 欄位值轉為紀錄的值：enum 轉為名稱，NaN 浮點數視為未設定
+def field_value(field, value):
+    if field.type == FieldDescriptor.TYPE_ENUM:
+        enum_value = field.enum_type.values_by_number.get(value)
+        return enum_value.name if enum_value is not None else value
+    if field.type == FieldDescriptor.TYPE_FLOAT:
+        return float_value(value)
+    if field.type == FieldDescriptor.TYPE_DOUBLE:
+        return None if math.isnan(value) else value
+    if field.type in (FieldDescriptor.TYPE_MESSAGE, FieldDescriptor.TYPE_BYTES):
+        # 子訊息由各紀錄類型自行轉換，bytes 欄位不需要
+        return None
+    return value
+
+
+# 解碼後的封包，各 portnum 一個子類別，以 __slots__ 儲存欄位，不另外建立 dict
+# payload 欄位名稱與 protobuf 欄位名稱相同，未設定的欄位為 None
+class PacketRecord:
+    # 訊息類型，與 /2/json/ 主題的 type 相同
+    TYPE = "unknown"
+    # protobuf 訊息類別，None 表示不解析 payload
+    MESSAGE = None
+    # 封包共用的欄位，received_at 為 gateway 收到訊息的時間（replay 時為原始收到的時間）
+    HEADER = (
+        "id",
+        "channel",
+        "from_id",
+        "to",
+        "portnum",
+        "timestamp",
+        "topic",
+        "type",
+        "received_at",
+    )
+    # payload 中使用的欄位
+    FIELDS = ()
+    # 與封包欄位同名的 payload 欄位改用的名稱
+    ALIASES = {}
+    __slots__ = HEADER
+
+    def __init__(
+        self,
+        id: int = None,
+        channel: int = None,
+        from_id: int = None,
+        to: int = None,
+        portnum: int = None,
+        timestamp: float = None,
+        topic: str = None,
+        type: str = None,
+        received_at: float = None,
+    ) -> None:
+        self.id = id
+        self.channel = channel
+        self.from_id = from_id
+        self.to = to
+        self.portnum = portnum
+        self.timestamp = timestamp
+        self.topic = topic
+        self.type = type if type is not None else self.TYPE
+        self.received_at = received_at
+        for name in self.FIELDS:
+            setattr(self, name, None)
+
+    # 解析 Data.payload
+    @classmethod
+    def from_payload_bytes(cls, payload: bytes):
+        message = cls.MESSAGE()
+        message.ParseFromString(payload)
+        record = cls()
+        record.load_message(message)
+        return record
+
+    # 由 dict 建立紀錄，包含 /2/json/ 主題或舊版 spool 的 message_json，
+    # 以及 to_dict 的結果
+    @classmethod
+    def from_json(cls, data: dict):
+        record_class = RECORD_TYPES.get(data.get("type"), PacketRecord)
+        record = record_class(type=data.get("type"))
+        if "payload" in data:
+            record.id = data.get("id")
+            record.channel = data.get("channel")
+            record.from_id = data.get("from")
+            record.to = data.get("to")
+            record.portnum = data.get("portnum")
+            record.timestamp = data.get("timestamp")
+            record.topic = data.get("topic")
+            # 文字訊息等類型的 payload 不是 dict，不需載入
+            if isinstance(data.get("payload"), dict):
+                record.load_payload(data.get("payload"))
+            return record
+        for name in record.HEADER + record.FIELDS:
+            setattr(record, name, data.get(name))
+        return record
+
+    # 載入 protobuf 訊息中已設定的欄位
+    def load_message(self, message) -> None:
+        for field, value in message.ListFields():
+            name = self.ALIASES.get(field.name, field.name)
+            if name in self.FIELDS:
+                setattr(self, name, field_value(field, value))
+
+    # 載入 dict 形式的 payload
+    def load_payload(self, payload: dict) -> None:
+        for key, value in payload.items():
+            name = self.ALIASES.get(key, key)
+            if name in self.FIELDS:
+                setattr(self, name, value)
+
+    # 轉為可寫入 spool 的 dict，可由 from_json 還原
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.HEADER + self.FIELDS}
+
+    # 以新的 topic 複製紀錄（同一封包經由其他 gateway 收到）
+    def with_topic(self, topic: str):
+        record = copy.copy(self)
+        record.topic = topic
+        return record
+
+
+class MapReportRecord(PacketRecord):
+    TYPE = "mapreport"
+    MESSAGE = mqtt_pb2.MapReport
+    FIELDS = (
+        "long_name",
+        "short_name",
+        "role",
+        "hw_model",
+        "firmware_version",
+        "region",
+        "modem_preset",
+        "has_default_channel",
+        "latitude_i",
+        "longitude_i",
+        "altitude",
+        "position_precision",
+        "num_online_local_nodes",
+    )
+    __slots__ = FIELDS
+
+
+class NeighborInfoRecord(PacketRecord):
+    TYPE = "neighborinfo"
+    MESSAGE = mesh_pb2.NeighborInfo
+    # neighbors: [(node_id, snr), ...]
+    FIELDS = ("node_id", "last_sent_by_id", "node_broadcast_interval_secs", "neighbors")
+    __slots__ = FIELDS
+
+    def load_message(self, message) -> None:
+        super().load_message(message)
+        # 未設定（為 0）或 NaN 的值視為 None
+        self.neighbors = [
+            (
+                neighbor.node_id or None,
+                float_value(neighbor.snr) or None,
+            )
+            for neighbor in message.neighbors
+        ]
+
+    def load_payload(self, payload: dict) -> None:
+        super().load_payload(payload)
+        self.neighbors = [
+            (neighbor.get("node_id"), neighbor.get("snr"))
+            for neighbor in payload.get("neighbors", [])
+        ]
+
+
+class NodeInfoRecord(PacketRecord):
+    TYPE = "nodeinfo"
+    MESSAGE = mesh_pb2.User
+    # User.id 為 "!" 開頭的節點 ID 字串，與封包 ID 區分改為 user_id
+    ALIASES = {"id": "user_id"}
+    FIELDS = (
+        "user_id",
+        "long_name",
+        "short_name",
+        "hw_model",
+        "is_licensed",
+        "role",
+        "modem_preset",
+    )
+    __slots__ = FIELDS
+
+
+class PositionRecord(PacketRecord):
+    TYPE = "position"
+    MESSAGE = mesh_pb2.Position
+    FIELDS = (
+        "latitude_i",
+        "longitude_i",
+        "altitude",
+        "precision_bits",
+        "sats_in_view",
+    )
+    __slots__ = FIELDS
+
+
+class TelemetryRecord(PacketRecord):
+    TYPE = "telemetry"
+    MESSAGE = telemetry_pb2.Telemetry
+    # 各 oneof variant 的欄位，依 protobuf 定義的順序
+    VARIANT_FIELDS = {
+        field.name: tuple(
+            variant_field.name for variant_field in field.message_type.fields
+        )
+        for field in telemetry_pb2.Telemetry.DESCRIPTOR.oneofs_by_name[
+            "variant"
+        ].fields
+    }
+    VARIANT_INDEXES = {
+        variant: {name: index for index, name in enumerate(fields)}
+        for variant, fields in VARIANT_FIELDS.items()
+    }
+    # variant: 已設定的 oneof variant 名稱
+    # values: 依 VARIANT_FIELDS 順序排列的 variant 欄位值，未設定為 None
+    FIELDS = ("time", "variant", "values")
+    __slots__ = FIELDS
+
+    def load_message(self, message) -> None:
+        if message.time:
+            self.time = message.time
+        self.variant = message.WhichOneof("variant")
+        if self.variant is None:
+            return
+        indexes = self.VARIANT_INDEXES[self.variant]
+        self.values = [None] * len(indexes)
+        for field, value in getattr(message, self.variant).ListFields():
+            self.values[indexes[field.name]] = field_value(field, value)
+
+    def load_payload(self, payload: dict) -> None:
+        self.time = payload.get("time")
+        for variant, fields in self.VARIANT_FIELDS.items():
+            metrics = payload.get(variant)
+            if metrics:
+                self.variant = variant
+                self.values = [metrics.get(name) for name in fields]
+                return
+
+    # variant 是否有已設定的欄位
+    def has_metrics(self) -> bool:
+        return self.variant is not None and any(
+            value is not None for value in self.values or ()
+        )
+
+    # 取得 variant 中的欄位值
+    def metric(self, name: str):
+        index = self.VARIANT_INDEXES[self.variant].get(name)
+        return self.values[index] if index is not None and self.values else None
+
+
+# 訊息類型對應的紀錄類別
+RECORD_TYPES = {
+    record_class.TYPE: record_class
+    for record_class in (
+        MapReportRecord,
+        NeighborInfoRecord,
+        NodeInfoRecord,
+        PositionRecord,
+        TelemetryRecord,
+    )
+}
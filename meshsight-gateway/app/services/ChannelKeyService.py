@@ -0,0 +1,100 @@
+import logging
+import os
+import time
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.MeshtasticDecodeUtil import MeshtasticDecodeUtil
+
+
+class ChannelKeyService:
+    def __init__(self) -> None:
+        self.config_util = ConfigUtil()
+        self.config = self.config_util.read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        key_config = self.config.get("ingest", {}).get("channelKeys", {})
+        self.reload_interval = float(key_config.get("reloadInterval", 5))
+        self.failure_threshold = max(1, int(key_config.get("failureThreshold", 20)))
+        self.negative_ttl = float(key_config.get("negativeTtl", 600))
+        # 以頻道名稱與頻道雜湊查詢的金鑰（MeshtasticDecodeUtil.compile_channel_keys）
+        self.channel_keys = MeshtasticDecodeUtil.compile_channel_keys([])
+        self.config_mtime = None
+        self.checked_at = None
+        # 各金鑰 (頻道名稱, 頻道雜湊) 連續解密失敗次數，以及暫停解密至何時
+        # 只暫停失敗的金鑰，同一頻道其他金鑰的封包仍會解密；金鑰變更時一併清除
+        self.failures: dict[tuple, int] = {}
+        self.skip_until: dict[tuple, float] = {}
+        self.decrypted = 0
+        self.failed = 0
+        self.skipped = 0
+        self.no_key = 0
+
+    # 取得頻道金鑰，設定檔變更時重新載入
+    def keys(self) -> dict:
+        now = time.monotonic()
+        if self.checked_at is None or now - self.checked_at >= self.reload_interval:
+            self.checked_at = now
+            self.reload_if_changed()
+        return self.channel_keys
+
+    def reload_if_changed(self) -> None:
+        try:
+            mtime = os.stat(self.config_util.config_path).st_mtime_ns
+        except OSError as e:
+            self.logger.error(f"無法讀取設定檔狀態: {e}")
+            return
+        if mtime == self.config_mtime:
+            return
+        self.config_mtime = mtime
+        self.channel_keys = MeshtasticDecodeUtil.compile_channel_keys(
+            self.config_util.get_config("meshtastic.channels", [])
+        )
+        self.failures.clear()
+        self.skip_until.clear()
+        self.logger.info(f"已載入 {len(self.channel_keys['by_name'])} 個頻道金鑰")
+
+    # 暫停解密的金鑰 (頻道名稱, 頻道雜湊)
+    def skip_keys(self) -> frozenset:
+        now = time.monotonic()
+        for key in [k for k, until in self.skip_until.items() if until <= now]:
+            del self.skip_until[key]
+        return frozenset(self.skip_until)
+
+    # 記錄解密結果，同一金鑰連續失敗達門檻時暫停以該金鑰解密一段時間
+    # key: decode_mesh_packet 回傳的 (頻道名稱, 頻道雜湊)
+    def record(self, key: tuple, decrypt_result: str) -> None:
+        if decrypt_result is None:
+            return
+        if decrypt_result == MeshtasticDecodeUtil.DECRYPT_OK:
+            self.decrypted += 1
+            self.failures.pop(key, None)
+        elif decrypt_result == MeshtasticDecodeUtil.DECRYPT_SKIPPED:
+            self.skipped += 1
+        elif decrypt_result == MeshtasticDecodeUtil.DECRYPT_NO_KEY:
+            # 頻道雜湊不符合任何金鑰，未嘗試解密，不列入連續失敗次數
+            self.no_key += 1
+        else:
+            self.failed += 1
+            failures = self.failures.get(key, 0) + 1
+            if failures < self.failure_threshold:
+                self.failures[key] = failures
+                return
+            self.failures.pop(key, None)
+            self.skip_until[key] = time.monotonic() + self.negative_ttl
+            channel, hash_value = key
+            self.logger.info(
+                f"頻道 '{channel}'（雜湊 {hash_value}）連續 {failures} 次解密失敗，"
+                f"暫停解密 {self.negative_ttl} 秒"
+            )
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self.channel_keys["by_name"]),
+            "decrypted": self.decrypted,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "noKey": self.no_key,
+            "skippedKeys": [
+                f"{channel}/{hash_value}"
+                for channel, hash_value in sorted(self.skip_keys())
+            ],
+        }
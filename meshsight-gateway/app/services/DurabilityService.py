@@ -0,0 +1,61 @@
+import logging
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.utils.ConfigUtil import ConfigUtil
+
+
+class DurabilityService:
+    # session.info 中暫存交易寫入的資料表
+    WRITTEN_KEY = "written_tables"
+    SYNCHRONOUS_COMMIT_OFF = "SET LOCAL synchronous_commit = off"
+
+    def __init__(self) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        durability_config = self.config.get("ingest", {}).get("durability", {})
+        self.enabled = bool(durability_config.get("enabled", False))
+        # 可接受資料庫異常關閉時遺失最後幾秒資料的資料表
+        self.relaxed_tables = set(durability_config.get("relaxedTables", []))
+        self.relaxed = 0
+        self.full = 0
+
+    # 記錄 session 交易中寫入的資料表
+    def mark(self, session: AsyncSession, table: str) -> None:
+        session.info.setdefault(self.WRITTEN_KEY, set()).add(table)
+
+    # 取出 session 交易中寫入的資料表
+    def pop_written(self, session: AsyncSession) -> set:
+        return session.info.pop(self.WRITTEN_KEY, set())
+
+    # 交易只寫入可放寬的資料表時，commit 不等待 WAL 寫入磁碟
+    # 只要寫入任何一張需完整保存的資料表（例如新建立的 node），整個交易維持完整保存
+    def is_relaxed(self, tables: set) -> bool:
+        return (
+            self.enabled
+            and bool(tables)
+            and all(table in self.relaxed_tables for table in tables)
+        )
+
+    # 於 commit 前呼叫，依寫入的資料表設定 session 交易的 synchronous_commit
+    async def apply_session(self, session: AsyncSession, tables: set) -> None:
+        if self.count(tables):
+            await session.execute(text(self.SYNCHRONOUS_COMMIT_OFF))
+
+    # 於 commit 前呼叫，依寫入的資料表設定 asyncpg 交易的 synchronous_commit
+    async def apply_connection(self, connection, tables: set) -> None:
+        if self.count(tables):
+            await connection.execute(self.SYNCHRONOUS_COMMIT_OFF)
+
+    def count(self, tables: set) -> bool:
+        if not tables:
+            return False
+        relaxed = self.is_relaxed(tables)
+        if relaxed:
+            self.relaxed += 1
+        else:
+            self.full += 1
+        return relaxed
+
+    def stats(self) -> dict:
+        return {"relaxed": self.relaxed, "full": self.full}
@@ -0,0 +1,97 @@
+import asyncio
+import inspect
+import logging
+from app.utils.ConfigUtil import ConfigUtil
+
+
+class IngestQueueService:
+    def __init__(self, handler) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        queue_config = self.config.get("ingest", {}).get("queue", {})
+        self.worker_count = max(1, int(queue_config.get("workers", 4)))
+        self.queue_size = max(1, int(queue_config.get("queueSize", 2000)))
+        self.drain_timeout = float(queue_config.get("drainTimeout", 10))
+        # 處理函數，每個 worker 依序以此處理佇列中的訊息
+        self.handler = handler
+        # 依節點 ID 分配至固定的 worker，確保同一節點的訊息依序處理
+        self.queues = [
+            asyncio.Queue(maxsize=max(1, self.queue_size // self.worker_count))
+            for _ in range(self.worker_count)
+        ]
+        self.workers = []
+        self.processed = 0
+        self.failed = 0
+        self.backpressure = 0
+
+    async def start(self):
+        if not self.workers:
+            self.workers = [
+                asyncio.create_task(self.work(queue)) for queue in self.queues
+            ]
+
+    # 停止 worker，停止前盡量處理完佇列中的訊息
+    async def stop(self):
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self.queues)),
+                timeout=self.drain_timeout,
+            )
+        except asyncio.TimeoutError:
+            self.logger.error(f"等待佇列處理逾時，剩餘 {self.depth()} 筆訊息未處理")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    # 放入佇列，佇列已滿時等待（背壓會傳遞到 MQTT 接收迴圈）
+    async def put(self, key: int, item) -> None:
+        queue = self.queues[hash(key) % self.worker_count]
+        if queue.full():
+            self.backpressure += 1
+        await queue.put(item)
+
+    # 等待目前已放入佇列的訊息處理完成（不等待之後放入的訊息）
+    # 每個 worker 佇列放入一個 future，worker 依序處理到此時即完成
+    async def flush(self) -> None:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for queue in self.queues:
+            future = loop.create_future()
+            await queue.put(future)
+            futures.append(future)
+        await asyncio.gather(*futures)
+
+    async def work(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            try:
+                if isinstance(item, asyncio.Future):
+                    item.set_result(None)
+                    continue
+                await self.handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+            finally:
+                queue.task_done()
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    # 佇列使用比例（0-1），以最滿的 worker 佇列計算
+    def load(self) -> float:
+        return max(queue.qsize() / queue.maxsize for queue in self.queues)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "maxDepth": max(queue.qsize() for queue in self.queues),
+            "capacity": sum(queue.maxsize for queue in self.queues),
+            "workers": self.worker_count,
+            "processed": self.processed,
+            "failed": self.failed,
+            "backpressure": self.backpressure,
+        }
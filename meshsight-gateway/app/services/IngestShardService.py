@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import multiprocessing
+from app.shard import run_shard
+from app.utils.ConfigUtil import ConfigUtil
+
+
+# 以多個 process 接收 MQTT 訊息，每個 process 各自執行完整的解碼與寫入流程，
+# 並維護自己的快取與批次寫入；主 process 只負責啟動、監控與重新啟動
+class IngestShardService:
+    # 檢查接收 process 是否仍在執行的間隔，單位為 second
+    CHECK_INTERVAL = 5
+    # 關閉時等待接收 process 完成收尾的最長時間，單位為 second
+    STOP_TIMEOUT = 30
+
+    def __init__(self) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        # process 數量為各 broker 設定的 shards 最大值
+        self.shards = max(
+            [
+                int(client_config.get("shards", 1))
+                for client_config in self.config["mqtt"]["client"]
+            ]
+            + [1]
+        )
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = {}
+        self.restarts = 0
+
+    async def start(self):
+        try:
+            for shard in range(self.shards):
+                self.spawn(shard)
+            while True:
+                await asyncio.sleep(self.CHECK_INTERVAL)
+                for shard, process in list(self.processes.items()):
+                    if process.is_alive():
+                        continue
+                    self.logger.error(
+                        f"接收 process {shard + 1}/{self.shards} 已結束"
+                        f"（exitcode {process.exitcode}），正在重新啟動..."
+                    )
+                    self.restarts += 1
+                    self.spawn(shard)
+        finally:
+            await self.stop()
+
+    def spawn(self, shard: int) -> None:
+        # 接收 process 可能再建立解碼用的 process pool，因此不可為 daemon
+        process = self.context.Process(
+            target=run_shard,
+            args=(shard, self.shards),
+            name=f"meshsight-gateway-shard-{shard}",
+        )
+        process.start()
+        self.processes[shard] = process
+        self.logger.info(
+            f"已啟動接收 process {shard + 1}/{self.shards}（pid {process.pid}）"
+        )
+
+    # 通知所有接收 process 停止，等待收尾後結束，逾時則強制結束
+    async def stop(self):
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for shard, process in self.processes.items():
+            await asyncio.to_thread(process.join, self.STOP_TIMEOUT)
+            if process.is_alive():
+                self.logger.error(
+                    f"接收 process {shard + 1}/{self.shards} 收尾逾時，強制結束"
+                )
+                process.kill()
+                await asyncio.to_thread(process.join)
+        self.processes = {}
@@ -0,0 +1,141 @@
+import heapq
+import logging
+import time
+from collections import OrderedDict
+from app.schemas.packet.PacketSchema import PacketRecord
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.MeshtasticUtil import MeshtasticUtil
+
+
+class LoadShedService:
+    # 捨棄原因
+    REASON_NODE = "nodeLimit"
+    REASON_PORT = "portLimit"
+    REASON_OVERLOAD = "overload"
+    # 統計資訊中列出的節點數
+    TOP_NODES = 10
+
+    # queue_load: 回傳寫入佇列使用比例（0-1）的函數，未使用佇列時為 None
+    def __init__(self, queue_load=None) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        shed_config = self.config.get("ingest", {}).get("loadShedding", {})
+        self.enabled = bool(shed_config.get("enabled", False))
+        self.node_rate = float(shed_config.get("nodeRate", 0.1))
+        self.node_burst = float(shed_config.get("nodeBurst", 60))
+        self.max_nodes = int(shed_config.get("maxNodes", 100000))
+        # 各訊息類型的優先等級，數字越小越優先，未列出的類型為最低等級
+        self.priorities = {
+            message_type: int(priority)
+            for message_type, priority in shed_config.get("priorities", {}).items()
+        }
+        self.lowest_priority = max(self.priorities.values(), default=0) + 1
+        # 各等級開始捨棄的寫入佇列使用比例，未列出的等級不因負載捨棄
+        self.overload_thresholds = {
+            int(priority): float(threshold)
+            for priority, threshold in shed_config.get(
+                "overloadThresholds", {}
+            ).items()
+        }
+        # 未列出類型的等級最低，未設定門檻時使用最低的門檻，不晚於其他等級捨棄
+        if self.overload_thresholds:
+            self.overload_thresholds.setdefault(
+                self.lowest_priority, min(self.overload_thresholds.values())
+            )
+        # 各訊息類型的 token bucket 設定，未列出的類型不限制
+        self.port_limits = {
+            message_type: (float(limit["rate"]), float(limit["burst"]))
+            for message_type, limit in shed_config.get("portLimits", {}).items()
+        }
+        self.queue_load = queue_load
+        # 訊息類型對應的 bucket：[剩餘 token, 更新時間]
+        self.port_buckets = {
+            message_type: [burst, time.monotonic()]
+            for message_type, (rate, burst) in self.port_limits.items()
+        }
+        # (節點 ID, 訊息類型) 對應的 bucket，依使用順序排列以便淘汰
+        self.node_buckets: OrderedDict = OrderedDict()
+        # 各等級與原因的捨棄數量
+        self.shed = {}
+        # 各節點的捨棄數量，與 node_buckets 一同淘汰
+        self.node_shed = {}
+        self.accepted = 0
+
+    def priority(self, message_type: str) -> int:
+        return self.priorities.get(message_type, self.lowest_priority)
+
+    # 判斷訊息是否接收，不接收時記錄捨棄原因
+    # 依序檢查：負載過高時捨棄低優先等級、單一節點的流量、單一訊息類型的流量
+    def admit(self, record: PacketRecord) -> bool:
+        if not self.enabled:
+            return True
+        message_type = record.type
+        node_id = record.from_id
+        priority = self.priority(message_type)
+        now = time.monotonic()
+        reason = None
+        threshold = self.overload_thresholds.get(priority)
+        if (
+            threshold is not None
+            and self.queue_load is not None
+            and self.queue_load() >= threshold
+        ):
+            reason = self.REASON_OVERLOAD
+        elif node_id is not None and not self.take_node(node_id, message_type, now):
+            reason = self.REASON_NODE
+        elif message_type in self.port_buckets and not self.take(
+            self.port_buckets[message_type], *self.port_limits[message_type], now
+        ):
+            reason = self.REASON_PORT
+        if reason is None:
+            self.accepted += 1
+            return True
+        counts = self.shed.setdefault(priority, {})
+        counts[reason] = counts.get(reason, 0) + 1
+        if node_id is not None:
+            self.node_shed[node_id] = self.node_shed.get(node_id, 0) + 1
+        return False
+
+    # 從節點的 bucket 取出一個 token，各訊息類型分開計算，
+    # 避免大量遙測資料的節點同時影響自己的 nodeinfo 與位置
+    def take_node(self, node_id: int, message_type: str, now: float) -> bool:
+        key = (node_id, message_type)
+        bucket = self.node_buckets.get(key)
+        if bucket is None:
+            bucket = [self.node_burst, now]
+            self.node_buckets[key] = bucket
+            # 超過上限時淘汰最久未使用的 bucket
+            while len(self.node_buckets) > self.max_nodes:
+                (evicted_node_id, _), _ = self.node_buckets.popitem(last=False)
+                self.node_shed.pop(evicted_node_id, None)
+        else:
+            self.node_buckets.move_to_end(key)
+        return self.take(bucket, self.node_rate, self.node_burst, now)
+
+    # token bucket：依經過時間補充 token，有 token 時取出一個
+    def take(self, bucket: list, rate: float, burst: float, now: float) -> bool:
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def stats(self) -> dict:
+        shed = sum(sum(counts.values()) for counts in self.shed.values())
+        total = self.accepted + shed
+        return {
+            "accepted": self.accepted,
+            "shed": shed,
+            "shedRate": round(shed / total, 4) if total else 0,
+            "byClass": {
+                priority: dict(counts) for priority, counts in sorted(self.shed.items())
+            },
+            "topNodes": {
+                MeshtasticUtil.convert_node_id_from_int_to_hex(node_id): count
+                for node_id, count in heapq.nlargest(
+                    self.TOP_NODES, self.node_shed.items(), key=lambda item: item[1]
+                )
+            },
+        }
@@ -1,65 +1,315 @@
-import base64
 from datetime import datetime, timezone
-import json
-import math
 import numbers
 import aiomqtt
 import asyncio
 import inspect
 import logging
+import time
 from app.configs.Database import (
     get_db_connection_async
 )
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
-from google.protobuf.json_format import MessageToJson, Parse
-
-try:
-    from meshtastic.protobuf import mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2
-    from meshtastic import BROADCAST_NUM
-except ImportError:
-    from meshtastic import (
-        mesh_pb2,
-        mqtt_pb2,
-        portnums_pb2,
-        telemetry_pb2,
-        BROADCAST_NUM,
-    )
 from app.models.NodeInfoModel import NodeInfo
 from app.models.NodeModel import Node
 from app.models.NodeNeighborEdgeModel import NodeNeighborEdge
 from app.models.NodeNeighborInfoModel import NodeNeighborInfo
 from app.models.NodePositionModel import NodePosition
-from app.models.NodeTelemetryAirQualityModel import NodeTelemetryAirQuality
-from app.models.NodeTelemetryDeviceModel import NodeTelemetryDevice
-from app.models.NodeTelemetryEnvironmentModel import NodeTelemetryEnvironment
-from app.models.NodeTelemetryPowerModel import NodeTelemetryPower
-from sqlalchemy import delete, update
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from app.repositories.IngestRepository import IngestRepository
+from app.services.ChannelKeyService import ChannelKeyService
+from app.services.DurabilityService import DurabilityService
+from app.services.IngestQueueService import IngestQueueService
+from app.services.LoadShedService import LoadShedService
+from app.services.NodePresenceService import NodePresenceService
+from app.services.NodeRegistryService import NodeRegistryService
+from app.services.PacketArchiveService import PacketArchiveService
+from app.services.PacketDecodeService import PacketDecodeService
+from app.services.PacketDedupService import PacketDedupService
+from app.services.PositionFilterService import PositionFilterService
+from app.services.SpoolService import SpoolService
+from app.services.TelemetryFilterService import TelemetryFilterService
+from app.services.TelemetryStagingService import TelemetryStagingService
+from app.services.TopicPlannerService import TopicPlannerService
+from app.services.WriteBehindService import WriteBehindService
 from app.utils.ConfigUtil import ConfigUtil
+from app.utils.MeshtasticDecodeUtil import MeshtasticDecodeUtil
 from app.utils.MeshtasticUtil import MeshtasticUtil
+from app.utils.MqttTopicUtil import MqttTopicUtil
+from app.utils.NeighborEdgeUtil import NeighborEdgeUtil
+from app.utils.TelemetryRegistryUtil import TelemetryRegistryUtil
+from app.utils.UpsertUtil import UpsertUtil
+from app.schemas.packet.PacketSchema import (
+    MapReportRecord,
+    NeighborInfoRecord,
+    NodeInfoRecord,
+    PacketRecord,
+    PositionRecord,
+    TelemetryRecord,
+)
 
 
 class MqttListenerService:
-    def __init__(self) -> None:
+    # archive: 是否保存原始封包，重新匯入（replay）時不需再保存
+    # shard、shards: 多個接收 process 時，此 process 的編號與 process 數量
+    # load_shedding: 是否依流量捨棄訊息，重新匯入時不依即時流量捨棄
+    def __init__(
+        self,
+        archive: bool = True,
+        shard: int = 0,
+        shards: int = 1,
+        load_shedding: bool = True,
+    ) -> None:
         self.config = ConfigUtil().read_config()
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        ingest_config = self.config.get("ingest", {})
+        self.shard = shard
+        self.shards = shards
+        # 多個接收 process 時，檔案與 staging 合併依 process 區分
+        shard_name = f"shard-{shard}" if shards > 1 else None
+        # 訂閱主題分析與重複訊息過濾
+        self.topic_planner_service = TopicPlannerService()
+        # 原始封包保存，可於解碼程式修正後重新解析
+        self.packet_archive_service = (
+            PacketArchiveService(shard_name)
+            if archive and ingest_config.get("archive", {}).get("enabled", False)
+            else None
+        )
+        # 頻道金鑰（設定檔變更時重新載入）與解密失敗的負向快取
+        self.channel_key_service = ChannelKeyService()
+        # 跨 gateway 重複封包快取
+        self.packet_dedup_service = PacketDedupService()
+        # 最後寫入位置的快取，位置沒有明顯變化時不寫入
+        self.position_filter_service = PositionFilterService()
+        # 最後寫入遙測資料的快取，同一小時內變化在容許範圍內時不寫入
+        self.telemetry_filter_service = TelemetryFilterService()
+        # 已知節點登錄表，避免每個封包都查詢 node 資料表
+        self.node_registry_service = NodeRegistryService()
+        # 依交易寫入的資料表決定 commit 是否等待 WAL 寫入磁碟
+        self.durability_service = DurabilityService()
+        # 最後聽到時間的合併寫入，避免每個封包都更新 node 資料表
+        self.node_presence_service = NodePresenceService()
+        # 以 asyncpg 直接寫入（不經過 ORM），未啟用時使用 SQLAlchemy session
+        self.ingest_repository = (
+            IngestRepository(self.node_registry_service, self.durability_service)
+            if ingest_config.get("nativeWriter", {}).get("enabled", False)
+            else None
+        )
+        # 批次寫入模式（write-behind），未啟用時維持逐筆寫入
+        self.write_behind_service = (
+            WriteBehindService(
+                self.node_registry_service,
+                self.durability_service,
+                self.ingest_repository,
+            )
+            if ingest_config.get("writeBehind", {}).get("enabled", False)
+            else None
+        )
+        # 遙測資料以 COPY 寫入 staging 資料表，定時合併至正式資料表（優先於批次寫入模式）
+        self.telemetry_staging_service = (
+            TelemetryStagingService(
+                self.node_registry_service,
+                self.durability_service,
+                # staging 資料表由所有 process 共用，只由第一個 process 合併
+                merge=shard == 0,
+            )
+            if ingest_config.get("telemetryStaging", {}).get("enabled", False)
+            else None
+        )
+        # 寫入佇列，依節點 ID 分配給多個 worker 並行寫入，未啟用時於接收迴圈中直接寫入
+        self.ingest_queue_service = (
+            IngestQueueService(self.store_message)
+            if ingest_config.get("queue", {}).get("enabled", True)
+            else None
+        )
+        # 依優先等級與節點、訊息類型的流量捨棄訊息，避免單一節點或低優先的訊息佔滿佇列
+        self.load_shed_service = (
+            LoadShedService(
+                self.ingest_queue_service.load
+                if self.ingest_queue_service is not None
+                else None
+            )
+            if load_shedding
+            else None
+        )
+        # 資料庫無法連線或寫入佇列超過高水位時，已解碼的訊息先寫入本機 spool
+        self.spool_service = (
+            SpoolService(
+                self.enqueue_message,
+                (
+                    self.ingest_queue_service.load
+                    if self.ingest_queue_service is not None
+                    else None
+                ),
+                shard_name,
+                self.flush_writes,
+            )
+            if ingest_config.get("spool", {}).get("enabled", False)
+            else None
+        )
+        # 批次寫入與 staging 寫入失敗時，緩衝中的資料改寫入 spool，
+        # 捨棄時清除過濾服務的紀錄
+        for service in (self.write_behind_service, self.telemetry_staging_service):
+            if service is not None:
+                service.spool_service = self.spool_service
+                service.on_dropped = self.forget_filtered
+        # 以多個 process 解析與解密 ServiceEnvelope，未啟用時於接收迴圈中解碼
+        self.packet_decode_service = (
+            PacketDecodeService(self.on_decoded, self.channel_key_service)
+            if ingest_config.get("decodePool", {}).get("enabled", False)
+            else None
+        )
+        # 沒有對應資料表的遙測 variant 收到的次數
+        self.unregistered_telemetry = {}
+        # 統計資訊輸出間隔，單位為 second，0 表示不輸出
+        self.stats_interval = float(ingest_config.get("statsInterval", 60))
+        self.stats_task = None
 
     async def start(self):
-        tasks = []
-        # 讀取設定檔
-        for mqtt_client in self.config["mqtt"]["client"]:
-            tasks.append(self.handle_client(mqtt_client))
-        await asyncio.gather(*tasks)
+        await self.start_pipeline()
+        try:
+            tasks = []
+            # 讀取設定檔
+            for mqtt_client in self.config["mqtt"]["client"]:
+                tasks.append(self.handle_client(mqtt_client))
+            await asyncio.gather(*tasks)
+        finally:
+            await self.stop_pipeline()
+
+    # 啟動解碼與寫入相關的服務
+    async def start_pipeline(self):
+        try:
+            await self.node_registry_service.load()
+        except Exception as e:
+            # 載入失敗時以空的登錄表啟動，節點會在收到封包時補建
+            self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+        await self.node_presence_service.start()
+        if self.ingest_repository is not None:
+            await self.ingest_repository.start()
+        if self.write_behind_service is not None:
+            await self.write_behind_service.start()
+        if self.telemetry_staging_service is not None:
+            await self.telemetry_staging_service.start()
+        if self.ingest_queue_service is not None:
+            await self.ingest_queue_service.start()
+        if self.spool_service is not None:
+            await self.spool_service.start()
+        if self.packet_decode_service is not None:
+            await self.packet_decode_service.start()
+        if self.packet_archive_service is not None:
+            await self.packet_archive_service.start()
+        if self.stats_interval > 0:
+            self.stats_task = asyncio.create_task(self.report_stats_periodically())
+
+    # 停止解碼與寫入相關的服務
+    async def stop_pipeline(self):
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+            self.stats_task = None
+        # 關閉時先處理完解碼與佇列中的訊息，再將緩衝中的資料寫入
+        if self.packet_archive_service is not None:
+            await self.packet_archive_service.stop()
+        if self.packet_decode_service is not None:
+            await self.packet_decode_service.stop()
+        if self.ingest_queue_service is not None:
+            await self.ingest_queue_service.stop()
+        if self.spool_service is not None:
+            await self.spool_service.stop()
+        if self.write_behind_service is not None:
+            await self.write_behind_service.stop()
+        if self.telemetry_staging_service is not None:
+            await self.telemetry_staging_service.stop()
+        if self.ingest_repository is not None:
+            await self.ingest_repository.stop()
+        await self.node_presence_service.stop()
+
+    # 定時輸出統計資訊
+    async def report_stats_periodically(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self.logger.info(f"統計資訊: {self.collect_stats()}")
+
+    def collect_stats(self) -> dict:
+        stats = {
+            "shard": f"{self.shard + 1}/{self.shards}",
+            "topics": self.topic_planner_service.stats(),
+            "dedup": self.packet_dedup_service.stats(),
+            "channelKeys": self.channel_key_service.stats(),
+            "positionFilter": self.position_filter_service.stats(),
+            "telemetryFilter": self.telemetry_filter_service.stats(),
+            "durability": self.durability_service.stats(),
+            "unregisteredTelemetry": dict(self.unregistered_telemetry),
+        }
+        if self.load_shed_service is not None:
+            stats["loadShedding"] = self.load_shed_service.stats()
+        if self.packet_archive_service is not None:
+            stats["archive"] = self.packet_archive_service.stats()
+        if self.packet_decode_service is not None:
+            stats["decodePool"] = self.packet_decode_service.stats()
+        if self.ingest_queue_service is not None:
+            stats["queue"] = self.ingest_queue_service.stats()
+        if self.spool_service is not None:
+            stats["spool"] = self.spool_service.stats()
+        if self.write_behind_service is not None:
+            stats["writeBehind"] = self.write_behind_service.stats()
+        if self.telemetry_staging_service is not None:
+            stats["telemetryStaging"] = self.telemetry_staging_service.stats()
+        return stats
 
     async def handle_client(self, client_config):
+        # 移除重複或被其他主題涵蓋的訂閱主題
+        client_config = {
+            **client_config,
+            "topics": self.topic_planner_service.plan(
+                client_config["identifier"], client_config["topics"]
+            ),
+        }
+        # 多個接收 process 時，只訂閱分配給此 process 的主題
+        client_config = self.assign_shard(client_config)
+        if client_config is None:
+            return
         tasks = []
         for host in client_config["hosts"]:
             tasks.append(self.subscribe_to_host(client_config, host))
         await asyncio.gather(*tasks)
 
+    # 依 shards 與 shardMode 取得此 process 負責的連線設定，沒有分配時回傳 None
+    # topics: 將訂閱主題分配給各 process，互相重疊的主題由同一個 process 訂閱
+    # shared: 各 process 以 MQTT v5 共享訂閱相同的主題，由 broker 分配訊息
+    def assign_shard(self, client_config: dict):
+        shards = int(client_config.get("shards", 1))
+        if shards <= 1:
+            # 未分片的 broker 由第一個 process 接收
+            return client_config if self.shard == 0 else None
+        if self.shard >= shards:
+            return None
+        protocol = None
+        if client_config.get("shardMode", "topics") == "shared":
+            group = client_config.get("shareGroup", client_config["identifier"])
+            topics = [
+                MqttTopicUtil.shared_filter(group, topic)
+                for topic in client_config["topics"]
+            ]
+            protocol = aiomqtt.ProtocolVersion.V5
+        else:
+            topics = MqttTopicUtil.partition_filters(client_config["topics"], shards)[
+                self.shard
+            ]
+            if not topics:
+                self.logger.warning(
+                    f"{client_config['identifier']}: 訂閱主題互相重疊，"
+                    f"沒有可分配給第 {self.shard + 1} 個 process 的主題，"
+                    f"可改用 shardMode: shared"
+                )
+                return None
+        return {
+            **client_config,
+            "topics": topics,
+            # 同一個 broker 的連線 identifier 不可重複
+            "identifier": f"{client_config['identifier']}-{self.shard}",
+            "protocol": protocol,
+        }
+
     async def subscribe_to_host(self, client_config, host):
         while True:
             try:
@@ -69,13 +319,14 @@ class MqttListenerService:
                     identifier=client_config["identifier"],
                     username=client_config["username"],
                     password=client_config["password"],
+                    protocol=client_config.get("protocol"),
                 ) as client:
                     # 訂閱多個主題
                     for topic in client_config["topics"]:
                         await client.subscribe(topic)
                     self.logger.info(f"已訂閱 {host} 的主題: {client_config['topics']}")
                     async for message in client.messages:
-                        await self.on_message(client, None, message)
+                        await self.receive(host, message.topic.value, message.payload)
             except Exception as e:
                 if client_config["showErrorLog"]:
                     self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
@@ -83,270 +334,306 @@ class MqttListenerService:
                 await asyncio.sleep(client_config["retryTime"])  # 等待一段時間後重試
                 continue  # 繼續嘗試訂閱該主機
 
-    async def on_message(self, client, userdata, message):
+    # 處理由 broker（或 replay）收到的訊息
+    # received_at 為收到的時間，replay 時為原始收到的時間，未指定時為當下
+    async def receive(
+        self, host: str, topic: str, payload: bytes, received_at: float = None
+    ):
+        # 略過因訂閱重疊或經由多個 broker 重複收到的相同訊息
+        if self.topic_planner_service.is_repeat(topic, payload):
+            return
+        if received_at is None:
+            received_at = time.time()
+        if self.packet_archive_service is not None:
+            await self.packet_archive_service.append(
+                host, topic, payload, received_at
+            )
+        await self.on_message(topic, payload, received_at)
+
+    async def on_message(self, topic: str, payload: bytes, received_at: float):
         try:
-            # 處理訊息邏輯
-            topic: str = message.topic.value
-            # 排除含以下內容的 topic
-            if "#" in topic:
-                self.logger.error(f"Ignoring invalid topic with #: {topic}")
+            # PKI 為點對點加密，無法解密，不需解析 protobuf
+            if MeshtasticDecodeUtil.is_pki_topic(topic):
                 return
-            elif "/2/stat/" in topic:
-                # Meshtastic Firmware 2.4.1.394e0e1 開始棄用
+            if (
+                self.packet_decode_service is not None
+                and "#" not in topic
+                and ("/2/e/" in topic or "/2/map" in topic)
+            ):
+                # 交由 process pool 解析與解密，解碼後依收到順序呼叫 on_decoded
+                await self.packet_decode_service.put(topic, payload, received_at)
+                return
+            record = self.decode_message(topic, payload)
+            if record is None:
                 return
+            record.received_at = received_at
+            await self.dispatch_message(record)
+        except Exception as e:
+            self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+            return
 
-            # 解析訊息
-            message_json = {}
-            if "/2/json/" in topic:
-                try:
-                    message_json = json.loads(
-                        message.payload.decode("utf-8")
-                    )  # 嘗試使用 UTF-8 解碼
-                except UnicodeDecodeError:
-                    logging.error(
-                        f"Failed to decode message payload as UTF-8: {message.payload}"
-                    )
-                    return
-                message_json["topic"] = topic
-                if message_json.get("type") == "nodeinfo":
-                    # raise Exception(f"NODEINFO 收 {message_json['payload']}")
-                    # 將收到的 nodeinfo 資料轉換為 NodeInfo
-                    # 資料範例: {'hardware': 255, 'id': '!b1231321', 'longname': 'Mydevuce', 'role': 0, 'shortname': 'devs'}
-                    payload = message_json["payload"]
-                    node_info = mesh_pb2.User()
-                    node_info.id = payload.get("id")
-                    # node_info.long_name = payload.get("longname", None) # 解析 emoji 會有問題
-                    # node_info.short_name = payload.get("shortname", None) # 解析 emoji 會有問題
-                    if payload.get("hardware", None) is not None:
-                        node_info.hw_model = payload.get("hardware")
-                    if payload.get("role", None) is not None:
-                        node_info.role = payload.get("role")
-                    data = json.loads(
-                        MessageToJson(
-                            node_info,
-                            preserving_proto_field_name=True,
-                            ensure_ascii=False,
-                        )
-                    )
-                    message_json["payload"] = data
-            elif "/2/e/" in topic or "/2/map" in topic:
-                mp = mesh_pb2.MeshPacket()
-                try:
-                    se = mqtt_pb2.ServiceEnvelope()
-                    se.ParseFromString(message.payload)
-                    mp = se.packet
-                except Exception as _:
-                    pass
+    # process pool 解碼後的訊息，於此判斷是否為其他 gateway 重複收到的封包
+    async def on_decoded(self, record: PacketRecord):
+        duplicate = self.packet_dedup_service.lookup(
+            record.from_id, record.id, record.portnum
+        )
+        if duplicate is not None:
+            record = self.packet_dedup_service.record_topic(duplicate, record.topic)
+            if record is None:
+                return
+        else:
+            self.packet_dedup_service.remember(record)
+        await self.dispatch_message(record)
+
+    async def dispatch_message(self, record: PacketRecord):
+        # 負載過高時先捨棄低優先等級的訊息，再限制單一節點與訊息類型的流量
+        if self.load_shed_service is not None and not self.load_shed_service.admit(
+            record
+        ):
+            return
+        if self.spool_service is not None and self.spool_service.should_divert():
+            self.spool_service.append(record)
+            return
+        await self.enqueue_message(record)
+
+    async def enqueue_message(self, record: PacketRecord):
+        if self.ingest_queue_service is not None:
+            # 依節點 ID 放入佇列，由對應的 worker 依序寫入資料庫
+            await self.ingest_queue_service.put(record.from_id, record)
+        else:
+            await self.store_message(record)
+
+    # 等待已放入寫入佇列的訊息寫入，並將緩衝寫入資料庫（寫入失敗時已改寫入 spool）
+    async def flush_writes(self):
+        if self.ingest_queue_service is not None:
+            await self.ingest_queue_service.flush()
+        if self.write_behind_service is not None:
+            await self.write_behind_service.flush()
+        if self.telemetry_staging_service is not None:
+            await self.telemetry_staging_service.flush()
+
+    # 批次或 staging 寫入失敗而捨棄的資料，清除過濾服務中最後寫入的紀錄
+    def forget_filtered(self, tables: dict) -> None:
+        for model, rows in tables.items():
+            for row in rows:
+                if model is NodePosition:
+                    self.position_filter_service.forget(row["node_id"], row["topic"])
+                elif "node_id" in row:
+                    # 沒有設定容許變化量的資料表沒有紀錄，不影響
+                    self.telemetry_filter_service.forget(
+                        row["node_id"], model.__tablename__
+                    )
+
+    def decode_message(self, topic: str, payload: bytes) -> PacketRecord:
+        # 處理訊息邏輯
+        # 排除含以下內容的 topic
+        if "#" in topic:
+            self.logger.error(f"Ignoring invalid topic with #: {topic}")
+            return None
+        elif "/2/stat/" in topic:
+            # Meshtastic Firmware 2.4.1.394e0e1 開始棄用
+            return None
 
-                # 檢查是否為加密封包
-                if mp.HasField("encrypted") and not mp.HasField("decoded"):
-                    mp = self.decode_encrypted(topic, mp)
-                    if mp is None:
-                        return
-                message_json["id"] = getattr(mp, "id")
-                message_json["channel"] = getattr(mp, "channel")
-                message_json["from"] = getattr(mp, "from")
-                message_json["payload"] = {}
-                message_json["sender"] = (
-                    f"!{MeshtasticUtil.convert_node_id_from_int_to_hex(getattr(mp, 'from'))}"
+        # 解析訊息
+        record = None
+        if "/2/json/" in topic:
+            try:
+                message_json = MeshtasticDecodeUtil.loads_json(payload)
+            except ValueError:
+                logging.error(
+                    f"Failed to decode message payload as UTF-8: {payload}"
                 )
-                message_json["timestamp"] = mp.rx_time
-                message_json["to"] = getattr(mp, "to")
-                message_json["type"] = "unknown"
-                message_json["topic"] = topic
-                # meshtastic protobuf 定義 https://github.com/meshtastic/protobufs
-                if mp.decoded.portnum == portnums_pb2.MAP_REPORT_APP:
-                    mapreport = mqtt_pb2.MapReport()
-                    mapreport.ParseFromString(mp.decoded.payload)
-                    data = json.loads(
-                        MessageToJson(
-                            mapreport,
-                            preserving_proto_field_name=True,
-                            ensure_ascii=False,
-                        )
-                    )
-                    message_json["type"] = "mapreport"
-                    message_json["payload"] = data
-                elif mp.decoded.portnum == portnums_pb2.NEIGHBORINFO_APP:
-                    neighbor_info = mesh_pb2.NeighborInfo()
-                    neighbor_info.ParseFromString(mp.decoded.payload)
-                    data = json.loads(
-                        MessageToJson(
-                            neighbor_info,
-                            preserving_proto_field_name=True,
-                            ensure_ascii=False,
-                        )
-                    )
-                    message_json["type"] = "neighborinfo"
-                    message_json["payload"] = data
-                elif mp.decoded.portnum == portnums_pb2.NODEINFO_APP:
-                    node_info = mesh_pb2.User()
-                    node_info.ParseFromString(mp.decoded.payload)
-                    data = json.loads(
-                        MessageToJson(
-                            node_info,
-                            preserving_proto_field_name=True,
-                            ensure_ascii=False,
-                        )
-                    )
-                    message_json["type"] = "nodeinfo"
-                    message_json["payload"] = data
-                elif mp.decoded.portnum == portnums_pb2.POSITION_APP:
-                    position = mesh_pb2.Position()
-                    position.ParseFromString(mp.decoded.payload)
-                    data = json.loads(
-                        MessageToJson(position, preserving_proto_field_name=True)
-                    )
-                    message_json["type"] = "position"
-                    message_json["payload"] = data
-                elif mp.decoded.portnum == portnums_pb2.TELEMETRY_APP:
-                    telemetry = telemetry_pb2.Telemetry()
-                    telemetry.ParseFromString(mp.decoded.payload)
-                    data = json.loads(
-                        MessageToJson(
-                            telemetry,
-                            preserving_proto_field_name=True,
-                            ensure_ascii=False,
-                        )
-                    )
-                    message_json["type"] = "telemetry"
-                    message_json["payload"] = data
-                else:
-                    message_json["type"] = f"unknown({mp.decoded.portnum})"
-                    message_json["payload"] = {}
-
-            # print(f"message_json: {message_json}")
+                return None
             if "type" not in message_json:
-                return
-
-            # 更新最後聽到的時間
-            if not await self.check_node_exist(message_json.get("from")):
-                await self.create_node(
-                    Node(
-                        id=message_json.get("from"),
-                        last_heard_at=datetime.now(timezone.utc),
+                return None
+            message_json["topic"] = topic
+            if message_json.get("type") == "nodeinfo":
+                # 將收到的 nodeinfo 資料轉換為 NodeInfo 欄位
+                message_json["payload"] = (
+                    MeshtasticDecodeUtil.json_nodeinfo_to_payload(
+                        message_json["payload"]
                     )
                 )
+            record = PacketRecord.from_json(message_json)
+        elif "/2/e/" in topic or "/2/map" in topic:
+            mp = MeshtasticDecodeUtil.parse_envelope(payload)
+
+            # 同一封包經由多個 gateway 或 broker 收到時，不再解碼與解密
+            duplicate = self.packet_dedup_service.lookup(
+                getattr(mp, "from"),
+                getattr(mp, "id"),
+                mp.decoded.portnum if mp.HasField("decoded") else None,
+            )
+            if duplicate is not None:
+                record = self.packet_dedup_service.record_topic(duplicate, topic)
+                if record is None:
+                    return None
             else:
-                await self.update_node_last_heard_at(message_json.get("from"))
+                record, decrypt_result, key = MeshtasticDecodeUtil.decode_mesh_packet(
+                    topic,
+                    mp,
+                    self.channel_key_service.keys(),
+                    self.channel_key_service.skip_keys(),
+                )
+                self.channel_key_service.record(key, decrypt_result)
+                if record is None:
+                    return None
+                self.packet_dedup_service.remember(record)
 
-            # 確保訊息內容
-            # 時間為 None 或是 0 時，將時間設為當下
-            if "timestamp" not in message_json or message_json["timestamp"] == 0:
-                message_json["timestamp"] = datetime.now(timezone.utc).timestamp()
+        return record
 
-            # 如果時間來自未來，則跳過
-            if datetime.fromtimestamp(
-                message_json["timestamp"], tz=timezone.utc
-            ) > datetime.now(timezone.utc):
+    async def store_message(self, record: PacketRecord):
+        try:
+            await self.write_message(record)
+        except Exception as e:
+            # 過濾服務已記錄為最後寫入的資料並未寫入，清除後之後收到的資料才不會被略過
+            self.position_filter_service.forget(record.from_id, record.topic)
+            self.telemetry_filter_service.forget(record.from_id)
+            # 資料庫無法連線時，整個交易已 rollback，改寫入 spool 待恢復後重新寫入
+            if self.spool_service is not None and (
+                self.spool_service.is_unavailable_error(e)
+            ):
+                self.spool_service.mark_unavailable(e)
+                self.spool_service.append(record)
                 return
+            raise e
 
-            # 開始處理
-            if message_json["type"] == "mapreport":
-                await self.handle_mapreport_app(message_json)
-            elif message_json["type"] == "neighborinfo":
-                await self.handle_neighborinfo_app(message_json)
-            elif message_json["type"] == "nodeinfo":
-                await self.handle_nodeinfo_app(message_json)
-            elif message_json["type"] == "position":
-                await self.handle_position_app(message_json)
-            elif message_json["type"] == "telemetry":
-                await self.handle_telemetry_app(message_json)
-            else:
-                # print(f"未定義處理: {message_json['type']} \n{message_json}")
-                return
-            pass
-        except Exception as e:
-            self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+    async def write_message(self, record: PacketRecord):
+        if self.ingest_repository is not None:
+            # 以 asyncpg 連線取代 session，同樣每個封包一個交易
+            async with self.ingest_repository.transaction() as connection:
+                await self.process_message(connection, record)
             return
+        # 每個封包使用單一 session 與交易，所有處理共用並只 commit 一次
+        async for session in get_db_connection_async():
+            try:
+                await self.process_message(session, record)
+                tables = self.durability_service.pop_written(session)
+                if session.info.get(NodeRegistryService.PENDING_KEY):
+                    tables.add(Node.__tablename__)
+                await self.durability_service.apply_session(session, tables)
+                await session.commit()
+                self.node_registry_service.confirm(session)
+            except Exception as e:
+                await session.rollback()
+                raise e
+            finally:
+                await session.close()
 
-    def decode_encrypted(self, topic: str, mp):
-        public_key = "1PG7OiApB1nwvP+rz05pAQ=="
-        try:
-            # 讀取解密金鑰
-            key_list = ConfigUtil().get_config("meshtastic.channels", [])
-            # 解析 topic 獲取 channel
-            channel = topic.split("/")[-2]
-            # 如果 channel 為 PKI，則不進行解密，因為是點對點加密
-            if channel == "PKI":
-                return None
-            # 取得 channel 對應的金鑰
-            key = next(
-                (item["key"] for item in key_list if item["name"] == channel), None
-            )
-            if key is None:
-                self.logger.debug(f"找不到 '{channel}' 的金鑰，使用公開金鑰 '{public_key}' 嘗試解密")
-                key = public_key
-            # 轉換金鑰為 base64
-            key_bytes = base64.b64decode(key.encode("ascii"))
+    # 封包寫入時參照的節點 ID
+    def packet_node_ids(self, record: PacketRecord) -> list[int]:
+        node_ids = [record.from_id]
+        if record.type == "neighborinfo":
+            node_ids += [record.node_id, record.last_sent_by_id]
+            node_ids += [edge_node_id for edge_node_id, _ in record.neighbors or []]
+        elif record.type == "nodeinfo" and record.user_id is not None:
+            try:
+                node_ids.append(
+                    MeshtasticUtil.convert_node_id_from_hex_to_int(record.user_id)
+                )
+            except ValueError:
+                # 無效的節點 ID 由 handle_nodeinfo_app 處理
+                pass
+        return node_ids
+
+    # gateway 收到訊息的時間，未記錄時為當下
+    def received_time(self, record: PacketRecord) -> datetime:
+        if record.received_at:
+            return datetime.fromtimestamp(record.received_at, tz=timezone.utc)
+        return datetime.now(timezone.utc)
+
+    async def process_message(self, session: AsyncSession, record: PacketRecord):
+        # 更新最後聽到的時間，使用 gateway 收到訊息的時間，replay 時不會更新為當下
+        received_at = self.received_time(record)
+        heard_at = received_at
+        if self.write_behind_service is not None:
+            if not self.node_registry_service.is_known(record.from_id):
+                await self.write_behind_service.add(
+                    Node(id=record.from_id, last_heard_at=heard_at)
+                )
+        else:
+            # 封包參照的節點全部在交易的第一個 INSERT 中依 ID 排序建立，之後的寫入
+            # 不再建立節點，多個 worker 同時建立節點時鎖定順序一致，避免死結
+            node_ids = self.packet_node_ids(record)
+            if self.ingest_repository is not None:
+                await self.ingest_repository.ensure_nodes(
+                    session, node_ids, last_heard_at=heard_at
+                )
+            else:
+                await self.node_registry_service.ensure_nodes(
+                    session, node_ids, last_heard_at=heard_at
+                )
+        self.node_presence_service.touch(record.from_id, heard_at)
 
-            # 隨機數
-            nonce_packet_id = getattr(mp, "id").to_bytes(8, "little")
-            nonce_from_node = getattr(mp, "from").to_bytes(8, "little")
-            nonce = nonce_packet_id + nonce_from_node
+        # 確保訊息內容
+        # 時間為 None 或是 0 時，將時間設為收到的時間
+        if not record.timestamp:
+            record.timestamp = received_at.timestamp()
 
-            # 建立解密器
-            cipher = Cipher(
-                algorithms.AES(key_bytes),
-                modes.CTR(nonce),
-                backend=default_backend(),
-            )
-            decryptor = cipher.decryptor()
-            decrypted_bytes = (
-                decryptor.update(getattr(mp, "encrypted")) + decryptor.finalize()
-            )
+        # 如果時間來自未來，則跳過
+        if datetime.fromtimestamp(
+            record.timestamp, tz=timezone.utc
+        ) > datetime.now(timezone.utc):
+            return
 
-            data = mesh_pb2.Data()
-            data.ParseFromString(decrypted_bytes)
-            mp.decoded.CopyFrom(data)  
-            # 回傳解密後的封包
-            return mp
-        except Exception as e:
-            self.logger.debug(f"解密失敗: {e}")
-            return None
+        # 開始處理
+        if record.type == "mapreport":
+            await self.handle_mapreport_app(session, record)
+        elif record.type == "neighborinfo":
+            await self.handle_neighborinfo_app(session, record)
+        elif record.type == "nodeinfo":
+            await self.handle_nodeinfo_app(session, record)
+        elif record.type == "position":
+            await self.handle_position_app(session, record)
+        elif record.type == "telemetry":
+            await self.handle_telemetry_app(session, record)
+        else:
+            # print(f"未定義處理: {record.type} \n{record.to_dict()}")
+            return
 
     #################################
     # 事件處理
     #################################
 
-    async def handle_mapreport_app(self, message_json: dict):
+    async def handle_mapreport_app(
+        self, session: AsyncSession, record: MapReportRecord
+    ):
         try:
             # TODO: 尚未被廣泛使用，待確認
-            payload = message_json.get("payload")
-            now = datetime.now(timezone.utc).replace(microsecond=0)
-            firmware_version = payload.get("firmware_version")
+            # 使用收到的時間，replay 時為原始收到的時間
+            now = self.received_time(record).replace(microsecond=0)
+            firmware_version = record.firmware_version
 
             # 來自這裡的提示: https://github.com/brianshea2/meshmap.net/blob/da626616b2fb1f52999d24d1b63c7f59af391f92/cmd/meshobserv/meshobserv.go#L136
             if not firmware_version or firmware_version.startswith("2.3.1."):
-                print(f"跳過 {message_json.get('from')} 的 mapreport \n{message_json}")
+                print(f"跳過 {record.from_id} 的 mapreport \n{record.to_dict()}")
                 return
 
             # 新增 NodeInfo
             node_info = await self.create_or_update_node_info(
+                session,
                 NodeInfo(
-                    node_id=message_json.get("from"),
-                    long_name=payload.get("long_name", None),
-                    short_name=payload.get("short_name", None),
-                    role=payload.get("role", None),
+                    node_id=record.from_id,
+                    long_name=record.long_name,
+                    short_name=record.short_name,
+                    role=record.role,
                     hw_model=(
-                        payload.get("hw_model", None)
-                        if isinstance(payload.get("hw_model"), str)
-                        else None
+                        record.hw_model if isinstance(record.hw_model, str) else None
                     ),
                     firmware_version=firmware_version,
-                    lora_region=payload.get("region", None),
-                    lora_modem_preset=payload.get("modem_preset", None),
-                    has_default_channel=payload.get("has_default_channel", None),
-                    num_online_local_nodes=payload.get("num_online_local_nodes", None),
+                    lora_region=record.region,
+                    lora_modem_preset=record.modem_preset,
+                    has_default_channel=record.has_default_channel,
+                    num_online_local_nodes=record.num_online_local_nodes,
                     update_at=now,
-                    topic=message_json.get("topic"),
+                    topic=record.topic,
                 )
             )
             # 新增 NodePosition
-            if "latitude_i" in payload and "longitude_i" in payload:
+            if record.latitude_i is not None and record.longitude_i is not None:
                 # 轉換經緯度
-                latitude = payload.get("latitude_i") / 1e7
-                longitude = payload.get("longitude_i") / 1e7
+                latitude = record.latitude_i / 1e7
+                longitude = record.longitude_i / 1e7
 
                 # 如果經緯度不合法，則跳過
                 if not (
@@ -362,17 +649,18 @@ class MqttListenerService:
                     return
 
                 node_position = await self.create_or_update_node_position(
+                    session,
                     NodePosition(
-                        node_id=message_json.get("from"),
+                        node_id=record.from_id,
                         latitude=latitude,
                         longitude=longitude,
-                        altitude=payload.get("altitude", None),
-                        precision_bits=payload.get("position_precision", None),
+                        altitude=record.altitude,
+                        precision_bits=record.position_precision,
                         create_at=now.replace(
                             minute=0, second=0, microsecond=0
                         ),  # 將時間精確度調整到小時
                         update_at=now,
-                        topic=message_json.get("topic"),
+                        topic=record.topic,
                     )
                 )
             pass
@@ -380,61 +668,60 @@ class MqttListenerService:
             self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
             raise e
 
-    async def handle_neighborinfo_app(self, message_json: dict):
+    async def handle_neighborinfo_app(
+        self, session: AsyncSession, record: NeighborInfoRecord
+    ):
         try:
-            payload = message_json.get("payload")
-
             # 新增 NodeNeighborInfo
             node_neighbor_info = await self.create_or_update_node_neighbor_info(
+                session,
                 NodeNeighborInfo(
-                    node_id=payload.get("node_id"),
-                    last_sent_by_id=payload.get("last_sent_by_id"),
-                    node_broadcast_interval_secs=payload.get(
-                        "node_broadcast_interval_secs"
-                    ),
+                    node_id=record.node_id,
+                    last_sent_by_id=record.last_sent_by_id,
+                    node_broadcast_interval_secs=record.node_broadcast_interval_secs,
                     update_at=datetime.fromtimestamp(
-                        message_json.get("timestamp"), tz=timezone.utc
+                        record.timestamp, tz=timezone.utc
                     ),
-                    topic=message_json.get("topic"),
+                    topic=record.topic,
                 )
             )
-            # 新增 NodeNeighborEdge
+            # 更新 NodeNeighborEdge
             node_neighbor_edges = []
-            for edge in payload.get("neighbors", []):
+            for edge_node_id, snr in record.neighbors or []:
                 node_neighbor_edges.append(
                     NodeNeighborEdge(
                         node_id=node_neighbor_info.node_id,
-                        edge_node_id=edge.get("node_id"),
-                        snr=edge.get("snr", None),
+                        edge_node_id=edge_node_id,
+                        snr=snr,
                     )
                 )
-            if len(node_neighbor_edges) > 0:
-                # 清空 NodeNeighborEdge
-                await self.clear_node_neighbor_edges(node_neighbor_info.node_id)
-                # 新增 NodeNeighborEdge
-                node_neighbor_edges = await self.create_node_neighbor_edges(
-                    node_neighbor_edges
+            if len(node_neighbor_edges) > 0 and self.write_behind_service is not None:
+                # 批次寫入模式下，於寫入時一併比對並更新
+                await self.write_behind_service.replace_neighbor_edges(
+                    node_neighbor_info.node_id, node_neighbor_edges
+                )
+            elif len(node_neighbor_edges) > 0:
+                await self.update_node_neighbor_edges(
+                    session, node_neighbor_info.node_id, node_neighbor_edges
                 )
         except Exception as e:
             self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
             raise e
 
-    async def handle_nodeinfo_app(self, message_json: dict):
+    async def handle_nodeinfo_app(self, session: AsyncSession, record: NodeInfoRecord):
         try:
-            payload = message_json.get("payload")
-
             if (
-                "id" not in payload
-                or "long_name" not in payload
-                or "short_name" not in payload
+                record.user_id is None
+                or record.long_name is None
+                or record.short_name is None
             ):
                 return
-            node_id = MeshtasticUtil.convert_node_id_from_hex_to_int(payload.get("id"))
+            node_id = MeshtasticUtil.convert_node_id_from_hex_to_int(record.user_id)
             
             # 如果 payload 中的 modem_preset 為 None，則嘗試從 topic 中提取出 channel 進行判斷
-            lora_modem_preset:str = payload.get("modem_preset", None)
+            lora_modem_preset:str = record.modem_preset
             if not lora_modem_preset:
-                topic = message_json.get("topic")
+                topic = record.topic
                 channel = MeshtasticUtil.get_channel_from_topic(topic)
                 if channel:
                     LORA_MODEM_PRESET_KEYWORDS = [
@@ -457,38 +744,35 @@ class MqttListenerService:
 
             # 新增 NodeInfo
             node_info = await self.create_or_update_node_info(
+                session,
                 NodeInfo(
                     node_id=node_id,
-                    long_name=payload.get("long_name"),
-                    short_name=payload.get("short_name"),
+                    long_name=record.long_name,
+                    short_name=record.short_name,
                     hw_model=(
-                        payload.get("hw_model", None)
-                        if isinstance(payload.get("hw_model"), str)
-                        else None
+                        record.hw_model if isinstance(record.hw_model, str) else None
                     ),
-                    is_licensed=payload.get("is_licensed", None),
-                    role=payload.get("role", None),
+                    is_licensed=record.is_licensed,
+                    role=record.role,
                     lora_modem_preset=lora_modem_preset,
                     update_at=datetime.fromtimestamp(
-                        message_json.get("timestamp"), tz=timezone.utc
+                        record.timestamp, tz=timezone.utc
                     ).replace(microsecond=0),
-                    topic=message_json.get("topic"),
+                    topic=record.topic,
                 )
             )
         except Exception as e:
             self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
             raise e
 
-    async def handle_position_app(self, message_json: dict):
+    async def handle_position_app(self, session: AsyncSession, record: PositionRecord):
         try:
-            payload = message_json.get("payload")
-
-            if "latitude_i" not in payload or "longitude_i" not in payload:
+            if record.latitude_i is None or record.longitude_i is None:
                 return
 
             # 轉換經緯度
-            latitude = payload.get("latitude_i") / 1e7
-            longitude = payload.get("longitude_i") / 1e7
+            latitude = record.latitude_i / 1e7
+            longitude = record.longitude_i / 1e7
 
             # 如果經緯度不合法，則跳過
             if not (
@@ -505,466 +789,174 @@ class MqttListenerService:
 
             # 新增 NodePosition
             node_position = await self.create_or_update_node_position(
+                session,
                 NodePosition(
-                    node_id=message_json.get("from"),
+                    node_id=record.from_id,
                     latitude=latitude,
                     longitude=longitude,
-                    altitude=payload.get("altitude", None),
-                    precision_bits=payload.get("precision_bits", None),
-                    sats_in_view=payload.get("sats_in_view", None),
+                    altitude=record.altitude,
+                    precision_bits=record.precision_bits,
+                    sats_in_view=record.sats_in_view,
                     create_at=datetime.fromtimestamp(
-                        message_json.get("timestamp"), tz=timezone.utc
+                        record.timestamp, tz=timezone.utc
                     ).replace(
                         minute=0, second=0, microsecond=0
                     ),  # 將時間精確度調整到小時
                     update_at=datetime.fromtimestamp(
-                        message_json.get("timestamp"), tz=timezone.utc
+                        record.timestamp, tz=timezone.utc
                     ),
-                    topic=message_json.get("topic"),
+                    topic=record.topic,
                 )
             )
         except Exception as e:
             self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
             raise e
 
-    async def handle_telemetry_app(self, message_json: dict):
+    async def handle_telemetry_app(
+        self, session: AsyncSession, record: TelemetryRecord
+    ):
         try:
-            payload = message_json.get("payload")
-
-            if "time" not in payload:
+            if record.time is None:
                 return
 
-            if datetime.fromtimestamp(payload.get("time")) > datetime.now():
-                payload["time"] = datetime.now().timestamp()
+            if datetime.fromtimestamp(record.time) > datetime.now():
+                record.time = datetime.now().timestamp()
 
-            air_quality_metrics = payload.get("air_quality_metrics", None)
-            if air_quality_metrics:
-                node_telemetry_air_quality = (
-                    await self.create_or_update_node_telemetry_air_quality(
-                        NodeTelemetryAirQuality(
-                            node_id=message_json.get("from"),
-                            pm10_standard=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "pm10_standard"
-                            ),
-                            pm25_standard=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "pm25_standard"
-                            ),
-                            pm100_standard=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "pm100_standard"
-                            ),
-                            pm10_environmental=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "pm10_environmental"
-                            ),
-                            pm25_environmental=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "pm25_environmental"
-                            ),
-                            pm100_environmental=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "pm100_environmental"
-                            ),
-                            particles_03um=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "particles_03um"
-                            ),
-                            particles_05um=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "particles_05um"
-                            ),
-                            particles_10um=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "particles_10um"
-                            ),
-                            particles_25um=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "particles_25um"
-                            ),
-                            particles_50um=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "particles_50um"
-                            ),
-                            particles_100um=self.get_telemetry_value_or_none(
-                                air_quality_metrics, "particles_100um"
-                            ),
-                            create_at=datetime.fromtimestamp(
-                                payload.get("time"), tz=timezone.utc
-                            ).replace(
-                                minute=0, second=0, microsecond=0
-                            ),  # 將時間精確度調整到小時
-                            update_at=datetime.fromtimestamp(
-                                payload.get("time"), tz=timezone.utc
-                            ),
-                            topic=message_json.get("topic"),
-                        )
-                    )
-                )
-            device_metrics = payload.get("device_metrics", None)
-            if device_metrics:
-                # 新增 NodeTelemetryDevice
-                node_telemetry_device = (
-                    await self.create_or_update_node_telemetry_device(
-                        NodeTelemetryDevice(
-                            node_id=message_json.get("from"),
-                            battery_level=device_metrics.get("battery_level", None),
-                            voltage=device_metrics.get("voltage", None),
-                            channel_utilization=device_metrics.get(
-                                "channel_utilization", None
-                            ),
-                            air_util_tx=device_metrics.get("air_util_tx", None),
-                            uptime_seconds=device_metrics.get("uptime_seconds", None),
-                            create_at=datetime.fromtimestamp(
-                                payload.get("time"), tz=timezone.utc
-                            ).replace(
-                                minute=0, second=0, microsecond=0
-                            ),  # 將時間精確度調整到小時
-                            update_at=datetime.fromtimestamp(
-                                payload.get("time"), tz=timezone.utc
-                            ),
-                            topic=message_json.get("topic"),
-                        )
-                    )
+            update_at = datetime.fromtimestamp(record.time, tz=timezone.utc)
+            # 沒有對應資料表的 variant 只計數
+            for variant in TelemetryRegistryUtil.unregistered_variants(record):
+                self.unregistered_telemetry[variant] = (
+                    self.unregistered_telemetry.get(variant, 0) + 1
                 )
-
-            environment_metrics = payload.get("environment_metrics", None)
-            if environment_metrics:
-                node_telemetry_environment = (
-                    await self.create_or_update_node_telemetry_environment(
-                        NodeTelemetryEnvironment(
-                            node_id=message_json.get("from"),
-                            temperature=self.get_telemetry_value_or_none(
-                                environment_metrics, "temperature"
-                            ),
-                            relative_humidity=self.get_telemetry_value_or_none(
-                                environment_metrics, "relative_humidity"
-                            ),
-                            barometric_pressure=environment_metrics.get(
-                                "barometric_pressure", None
-                            ),
-                            gas_resistance=environment_metrics.get(
-                                "gas_resistance", None
-                            ),
-                            voltage=environment_metrics.get("voltage", None),
-                            current=environment_metrics.get("current", None),
-                            iaq=environment_metrics.get("iaq", None),
-                            distance=environment_metrics.get("distance", None),
-                            lux=self.get_telemetry_value_or_none(
-                                environment_metrics, "lux"
-                            ),
-                            white_lux=self.get_telemetry_value_or_none(
-                                environment_metrics, "white_lux"
-                            ),
-                            ir_lux=self.get_telemetry_value_or_none(
-                                environment_metrics, "ir_lux"
-                            ),
-                            uv_lux=self.get_telemetry_value_or_none(
-                                environment_metrics, "uv_lux"
-                            ),
-                            wind_direction=environment_metrics.get(
-                                "wind_direction", None
-                            ),
-                            wind_speed=environment_metrics.get("wind_speed", None),
-                            weight=environment_metrics.get("weight", None),
-                            wind_gust=environment_metrics.get("wind_gust", None),
-                            wind_lull=environment_metrics.get("wind_lull", None),
-                            create_at=datetime.fromtimestamp(
-                                payload.get("time"), tz=timezone.utc
-                            ).replace(
-                                minute=0, second=0, microsecond=0
-                            ),  # 將時間精確度調整到小時
-                            update_at=datetime.fromtimestamp(
-                                payload.get("time"), tz=timezone.utc
-                            ),
-                            topic=message_json.get("topic"),
-                        )
-                    )
-                )
-            power_metrics = payload.get("power_metrics", None)
-            if power_metrics:
-                node_telemetry_power = await self.create_or_update_node_telemetry_power(
-                    NodeTelemetryPower(
-                        node_id=message_json.get("from"),
-                        ch1_voltage=power_metrics.get("ch1_voltage", None),
-                        ch1_current=power_metrics.get("ch1_current", None),
-                        ch2_voltage=power_metrics.get("ch2_voltage", None),
-                        ch2_current=power_metrics.get("ch2_current", None),
-                        ch3_voltage=power_metrics.get("ch3_voltage", None),
-                        ch3_current=power_metrics.get("ch3_current", None),
-                        create_at=datetime.fromtimestamp(
-                            payload.get("time"), tz=timezone.utc
-                        ).replace(
+            # 依登錄表將各 variant 寫入對應的資料表
+            for model, values in TelemetryRegistryUtil.extract(record):
+                await self.create_or_update_node_telemetry(
+                    session,
+                    model(
+                        node_id=record.from_id,
+                        **values,
+                        create_at=update_at.replace(
                             minute=0, second=0, microsecond=0
                         ),  # 將時間精確度調整到小時
-                        update_at=datetime.fromtimestamp(
-                            payload.get("time"), tz=timezone.utc
-                        ),
-                        topic=message_json.get("topic"),
-                    )
+                        update_at=update_at,
+                        topic=record.topic,
+                    ),
                 )
-
         except Exception as e:
             self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+            raise e
 
     #################################
     # 資料庫操作
     #################################
 
-    # 檢查 Node 是否已存在
-    async def check_node_exist(self, id: int) -> bool:
-        async for session in get_db_connection_async():
-            try:
-                result = await session.execute(select(Node).where(Node.id == id))
-                return result.scalar() is not None
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
-
-    # 新增 Node
-    async def create_node(self, node: Node):
-        async for session in get_db_connection_async():
-            try:
-                node = Node(
-                    id=node.id,
-                    id_hex=(
-                        node.id_hex
-                        if node.id_hex is not None
-                        else MeshtasticUtil.convert_node_id_from_int_to_hex(node.id)
-                    ),
-                    last_heard_at=node.last_heard_at,
-                )
-                session.add(node)
-                await session.commit()
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
-
-    # 更新 Node
-    async def update_node_last_heard_at(self, id: int):
-        async for session in get_db_connection_async():
-            try:
-                await session.execute(
-                    update(Node)
-                    .where(Node.id == id)
-                    .values(last_heard_at=datetime.now(timezone.utc))
-                )
-                await session.commit()
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
-
-    # 新增或更新 NodeInfo
-    async def create_or_update_node_info(self, node_info: NodeInfo) -> NodeInfo:
-        async for session in get_db_connection_async():
-            try:
-                # 一些傳入資料型態的檢查
-                if not isinstance(node_info.role, str):
-                    node_info.role = None
-                # 檢查 Node 是否存在
-                if not await self.check_node_exist(node_info.node_id):
-                    await self.create_node(
-                        Node(id=node_info.node_id, last_heard_at=node_info.update_at)
-                    )
-                # 檢查 NodeInfo 是否存在
-                result = await session.execute(
-                    select(NodeInfo).where(NodeInfo.node_id == node_info.node_id)
-                )
-                existing_node_info = result.scalar()
-                # 如果 NodeInfo 不存在，則新增
-                if existing_node_info is None:
-                    session.add(node_info)
-                    await session.commit()
-                    await session.refresh(node_info)
-                    return node_info
-                # 如果 NodeInfo 存在，但傳入比較舊，則直接回傳
-                if node_info.update_at < existing_node_info.update_at:
-                    return existing_node_info
-                # 更新 NodeInfo
-                await session.execute(
-                    update(NodeInfo)
-                    .where(NodeInfo.node_id == node_info.node_id)
-                    .values(
-                        long_name=(
-                            node_info.long_name
-                            if node_info.long_name is not None
-                            else existing_node_info.long_name
-                        ),
-                        short_name=(
-                            node_info.short_name
-                            if node_info.short_name is not None
-                            else existing_node_info.short_name
-                        ),
-                        hw_model=(
-                            node_info.hw_model
-                            if node_info.hw_model is not None
-                            else existing_node_info.hw_model
-                        ),
-                        is_licensed=(
-                            node_info.is_licensed
-                            if node_info.is_licensed is not None
-                            else existing_node_info.is_licensed
-                        ),
-                        role=(
-                            node_info.role
-                            if node_info.role is not None
-                            else existing_node_info.role
-                        ),
-                        firmware_version=(
-                            node_info.firmware_version
-                            if node_info.firmware_version is not None
-                            else existing_node_info.firmware_version
-                        ),
-                        lora_region=(
-                            node_info.lora_region
-                            if node_info.lora_region is not None
-                            else existing_node_info.lora_region
-                        ),
-                        lora_modem_preset=(
-                            node_info.lora_modem_preset
-                            if node_info.lora_modem_preset is not None
-                            else existing_node_info.lora_modem_preset
-                        ),
-                        has_default_channel=(
-                            node_info.has_default_channel
-                            if node_info.has_default_channel is not None
-                            else existing_node_info.has_default_channel
-                        ),
-                        num_online_local_nodes=(
-                            node_info.num_online_local_nodes
-                            if node_info.num_online_local_nodes is not None
-                            else existing_node_info.num_online_local_nodes
-                        ),
-                        update_at=node_info.update_at,
-                        topic=node_info.topic,
+    # 以單一 INSERT ... ON CONFLICT DO UPDATE ... RETURNING 新增或更新並回傳資料
+    # 空值欄位保留原值、資料庫中的資料較新時不更新（UpsertUtil.build_upsert）；
+    # 未更新時 RETURNING 不會回傳資料，才另外查詢現有資料
+    async def upsert_entity(self, session: AsyncSession, entity):
+        model = type(entity)
+        row = UpsertUtil.entity_to_row(entity)
+        self.durability_service.mark(session, model.__tablename__)
+        result = await session.scalars(
+            UpsertUtil.build_upsert(model, [row])
+            .returning(model)
+            .execution_options(populate_existing=True)
+        )
+        final_entity = result.first()
+        if final_entity is None:
+            final_entity = (
+                await session.scalars(
+                    select(model).where(
+                        *[
+                            getattr(model, key) == row[key]
+                            for key in UpsertUtil.CONFLICT_KEYS[model]
+                        ]
                     )
                 )
-                await session.commit()
-                await session.refresh(existing_node_info)
-                return existing_node_info
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
+            ).first()
+        return final_entity
 
-    # 清空 NodeNeighborEdge
-    async def clear_node_neighbor_edges(self, node_id: int) -> None:
-        async for session in get_db_connection_async():
-            try:
-                # 清空 NodeNeighborEdge
-                await session.execute(
-                    delete(NodeNeighborEdge).where(NodeNeighborEdge.node_id == node_id)
-                )
-                await session.commit()
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
-
-    # 新增 NodeNeighborEdge
-    async def create_node_neighbor_edges(
-        self, node_neighbor_edges: list[NodeNeighborEdge]
-    ) -> list[NodeNeighborEdge]:
-        async for session in get_db_connection_async():
-            try:
-                # 檢查 list[NodeNeighborEdge] 中各個 edge_node_id  是否存在
-                for node_neighbor_edge in node_neighbor_edges:
-                    if not await self.check_node_exist(node_neighbor_edge.edge_node_id):
-                        await self.create_node(
-                            Node(
-                                id=node_neighbor_edge.edge_node_id,
-                            )
-                        )
-                # 新增 NodeNeighborEdge
-                session.add_all(node_neighbor_edges)
-                await session.commit()
-                return node_neighbor_edges
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
+    # 新增或更新 NodeInfo
+    async def create_or_update_node_info(
+        self, session: AsyncSession, node_info: NodeInfo
+    ) -> NodeInfo:
+        # 一些傳入資料型態的檢查
+        if not isinstance(node_info.role, str):
+            node_info.role = None
+        if self.write_behind_service is not None:
+            await self.write_behind_service.add(node_info)
+            return node_info
+        if self.ingest_repository is not None:
+            return await self.ingest_repository.upsert(session, node_info)
+        # 檢查 Node 是否存在
+        await self.node_registry_service.ensure_node(
+            session, node_info.node_id, last_heard_at=node_info.update_at
+        )
+        return await self.upsert_entity(session, node_info)
+
+    # 以新的鄰居清單更新 NodeNeighborEdge
+    # 與現有資料比對，只更新 snr 有變動、新增新的鄰居、刪除已不存在的鄰居，
+    # 與封包的其他資料於同一個 transaction 中寫入
+    async def update_node_neighbor_edges(
+        self,
+        session: AsyncSession,
+        node_id: int,
+        node_neighbor_edges: list[NodeNeighborEdge],
+    ) -> dict:
+        edges = {
+            node_id: [
+                {
+                    "edge_node_id": node_neighbor_edge.edge_node_id,
+                    "snr": node_neighbor_edge.snr,
+                }
+                for node_neighbor_edge in node_neighbor_edges
+            ]
+        }
+        if self.ingest_repository is not None:
+            return await self.ingest_repository.sync_neighbor_edges(session, edges)
+        # 確保 list[NodeNeighborEdge] 中各個 edge_node_id 存在
+        await self.node_registry_service.ensure_nodes(
+            session,
+            [
+                node_neighbor_edge.edge_node_id
+                for node_neighbor_edge in node_neighbor_edges
+            ]
+        )
+        self.durability_service.mark(session, NodeNeighborEdge.__tablename__)
+        return await NeighborEdgeUtil.sync_edges(session, edges)
 
     # 新增或更新 NodeNeighborInfo
     async def create_or_update_node_neighbor_info(
-        self, node_neighbor_info: NodeNeighborInfo
+        self, session: AsyncSession, node_neighbor_info: NodeNeighborInfo
     ) -> NodeNeighborInfo:
-        async for session in get_db_connection_async():
-            try:
-                # 檢查 node_neighbor_info.node_id 是否存在
-                if not await self.check_node_exist(node_neighbor_info.node_id):
-                    await self.create_node(
-                        Node(
-                            id=node_neighbor_info.node_id,
-                            last_heard_at=node_neighbor_info.update_at,
-                        )
-                    )
-
-                # 檢查 node_neighbor_info.last_sent_by_id 是否存在
-                if not await self.check_node_exist(node_neighbor_info.last_sent_by_id):
-                    await self.create_node(
-                        Node(
-                            id=node_neighbor_info.last_sent_by_id,
-                            last_heard_at=node_neighbor_info.update_at,
-                        )
-                    )
-
-                # 檢查 NodeNeighborInfo 是否存在
-                existing_node_neighbor_info = (
-                    await session.execute(
-                        select(NodeNeighborInfo).where(
-                            NodeNeighborInfo.node_id == node_neighbor_info.node_id
-                        )
-                    )
-                ).scalar()
-
-                # 如果 NodeNeighborInfo 存在，但傳入比較舊，則直接回傳
-                if (
-                    existing_node_neighbor_info is not None
-                    and node_neighbor_info.update_at
-                    < existing_node_neighbor_info.update_at
-                ):
-                    return existing_node_neighbor_info
-
-                # 動態構建 set_ 字典，移除值為 None 的鍵
-                data = {
-                    "last_sent_by_id": node_neighbor_info.last_sent_by_id,
-                    "node_broadcast_interval_secs": node_neighbor_info.node_broadcast_interval_secs,
-                    "update_at": node_neighbor_info.update_at,
-                    "topic": node_neighbor_info.topic,
-                }
-                data = {k: v for k, v in data.items() if v is not None}
-
-                # 使用 ON CONFLICT 子句來新增或更新
-                stmt = (
-                    insert(NodeNeighborInfo)
-                    .values(
-                        node_id=node_neighbor_info.node_id,
-                        **data,
-                    )
-                    .on_conflict_do_update(
-                        index_elements=["node_id"],
-                        set_=data,
-                    )
-                )
-                await session.execute(stmt)
-                await session.commit()
-                finanl_node_neighbor_info = (
-                    await session.execute(
-                        select(NodeNeighborInfo).where(
-                            NodeNeighborInfo.node_id == node_neighbor_info.node_id
-                        )
-                    )
-                ).scalar()
-                return finanl_node_neighbor_info
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
+        if self.write_behind_service is not None:
+            await self.write_behind_service.add(node_neighbor_info)
+            return node_neighbor_info
+        if self.ingest_repository is not None:
+            return await self.ingest_repository.upsert(session, node_neighbor_info)
+        # 確保 node_neighbor_info.node_id 與 last_sent_by_id 存在
+        await self.node_registry_service.ensure_nodes(
+            session,
+            [node_neighbor_info.node_id, node_neighbor_info.last_sent_by_id],
+            last_heard_at=node_neighbor_info.update_at,
+        )
+        return await self.upsert_entity(session, node_neighbor_info)
 
     # 新增或更新 NodePosition
     async def create_or_update_node_position(
-        self, node_position: NodePosition
+        self, session: AsyncSession, node_position: NodePosition
     ) -> NodePosition:
+        # 與最後寫入的位置比較，沒有明顯變化時不寫入
+        if not self.position_filter_service.should_write(
+            node_position.node_id,
+            node_position.topic,
+            node_position.latitude,
+            node_position.longitude,
+            node_position.precision_bits,
+            node_position.create_at,
+            node_position.update_at,
+        ):
+            return node_position
         # 檢查精度是否符合限制，如果沒有則進行模糊處理
         if (
             node_position.precision_bits is None
@@ -984,439 +976,33 @@ class MqttListenerService:
                 "maxPrecisionBits"
             ]
 
-        async for session in get_db_connection_async():
-            try:
-                # 檢查 Node 是否存在
-                if not await self.check_node_exist(node_position.node_id):
-                    await self.create_node(
-                        Node(
-                            id=node_position.node_id,
-                            last_heard_at=node_position.update_at,
-                        )
-                    )
-
-                # 檢查 NodePosition 是否存在
-                existing_node_position = (
-                    await session.execute(
-                        select(NodePosition)
-                        .where(NodePosition.node_id == node_position.node_id)
-                        .where(NodePosition.create_at == node_position.create_at)
-                        .where(NodePosition.topic == node_position.topic)
-                    )
-                ).scalar()
-
-                # 如果 NodePosition 存在，但傳入比較舊，則直接回傳
-                if (
-                    existing_node_position is not None
-                    and node_position.update_at < existing_node_position.update_at
-                ):
-                    return existing_node_position
-
-                # 動態構建 set_ 字典，移除值為 None 的鍵
-                data = {
-                    "latitude": node_position.latitude,
-                    "longitude": node_position.longitude,
-                    "altitude": node_position.altitude,
-                    "precision_bits": node_position.precision_bits,
-                    "sats_in_view": node_position.sats_in_view,
-                    "update_at": node_position.update_at,
-                }
-                data = {k: v for k, v in data.items() if v is not None}
-
-                # 使用 ON CONFLICT 子句來新增或更新
-                stmt = (
-                    insert(NodePosition)
-                    .values(
-                        node_id=node_position.node_id,
-                        create_at=node_position.create_at,
-                        topic=node_position.topic,
-                        **data,
-                    )
-                    .on_conflict_do_update(
-                        index_elements=["node_id", "create_at", "topic"],
-                        set_=data,
-                    )
-                )
-                await session.execute(stmt)
-                await session.commit()
-                final_node_position = (
-                    await session.execute(
-                        select(NodePosition)
-                        .where(NodePosition.node_id == node_position.node_id)
-                        .where(NodePosition.create_at == node_position.create_at)
-                        .where(NodePosition.topic == node_position.topic)
-                    )
-                ).scalar()
-                return final_node_position
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
-
-    # 新增或更新 NodeTelemetryAirQuality
-    async def create_or_update_node_telemetry_air_quality(
-        self, node_telemetry_air_quality: NodeTelemetryAirQuality
-    ) -> NodeTelemetryAirQuality:
-        async for session in get_db_connection_async():
-            try:
-                # 檢查 Node 是否存在
-                if not await self.check_node_exist(node_telemetry_air_quality.node_id):
-                    await self.create_node(
-                        Node(
-                            id=node_telemetry_air_quality.node_id,
-                            last_heard_at=node_telemetry_air_quality.update_at,
-                        )
-                    )
-
-                # 檢查 NodeTelemetryAirQuality 是否存在
-                existing_node_telemetry_air_quality = (
-                    await session.execute(
-                        select(NodeTelemetryAirQuality)
-                        .where(
-                            NodeTelemetryAirQuality.node_id
-                            == node_telemetry_air_quality.node_id
-                        )
-                        .where(
-                            NodeTelemetryAirQuality.create_at
-                            == node_telemetry_air_quality.create_at
-                        )
-                    )
-                ).scalar()
-
-                # 如果 NodeTelemetryAirQuality 存在，但傳入比較舊，則直接回傳
-                if (
-                    existing_node_telemetry_air_quality is not None
-                    and node_telemetry_air_quality.update_at
-                    < existing_node_telemetry_air_quality.update_at
-                ):
-                    return existing_node_telemetry_air_quality
-
-                # 動態構建 set_ 字典，移除值為 None 的鍵
-                data = {
-                    "pm10_standard": node_telemetry_air_quality.pm10_standard,
-                    "pm25_standard": node_telemetry_air_quality.pm25_standard,
-                    "pm100_standard": node_telemetry_air_quality.pm100_standard,
-                    "pm10_environmental": node_telemetry_air_quality.pm10_environmental,
-                    "pm25_environmental": node_telemetry_air_quality.pm25_environmental,
-                    "pm100_environmental": node_telemetry_air_quality.pm100_environmental,
-                    "particles_03um": node_telemetry_air_quality.particles_03um,
-                    "particles_05um": node_telemetry_air_quality.particles_05um,
-                    "particles_10um": node_telemetry_air_quality.particles_10um,
-                    "particles_25um": node_telemetry_air_quality.particles_25um,
-                    "particles_50um": node_telemetry_air_quality.particles_50um,
-                    "particles_100um": node_telemetry_air_quality.particles_100um,
-                    "update_at": node_telemetry_air_quality.update_at,
-                    "topic": node_telemetry_air_quality.topic,
-                }
-                data = {k: v for k, v in data.items() if v is not None}
-
-                # 使用 ON CONFLICT 子句來新增或更新
-                stmt = (
-                    insert(NodeTelemetryAirQuality)
-                    .values(
-                        node_id=node_telemetry_air_quality.node_id,
-                        create_at=node_telemetry_air_quality.create_at,
-                        **data,
-                    )
-                    .on_conflict_do_update(
-                        index_elements=["node_id", "create_at"],
-                        set_=data,
-                    )
-                )
-                await session.execute(stmt)
-                await session.commit()
-                final_node_telemetry_air_quality = (
-                    await session.execute(
-                        select(NodeTelemetryAirQuality)
-                        .where(
-                            NodeTelemetryAirQuality.node_id
-                            == node_telemetry_air_quality.node_id
-                        )
-                        .where(
-                            NodeTelemetryAirQuality.create_at
-                            == node_telemetry_air_quality.create_at
-                        )
-                    )
-                ).scalar()
-                return final_node_telemetry_air_quality
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
-
-    # 新增或更新 NodeTelemetryDevice
-    async def create_or_update_node_telemetry_device(
-        self, node_telemetry_device: NodeTelemetryDevice
-    ) -> NodeTelemetryDevice:
-        async for session in get_db_connection_async():
-            try:
-                # 檢查 Node 是否存在
-                if not await self.check_node_exist(node_telemetry_device.node_id):
-                    await self.create_node(
-                        Node(
-                            id=node_telemetry_device.node_id,
-                            last_heard_at=node_telemetry_device.update_at,
-                        )
-                    )
-
-                # 檢查 NodeTelemetryDevice 是否存在
-                existing_node_telemetry_device = (
-                    await session.execute(
-                        select(NodeTelemetryDevice)
-                        .where(
-                            NodeTelemetryDevice.node_id == node_telemetry_device.node_id
-                        )
-                        .where(
-                            NodeTelemetryDevice.create_at
-                            == node_telemetry_device.create_at
-                        )
-                    )
-                ).scalar()
-
-                # 如果 NodeTelemetryDevice 存在，但傳入比較舊，則直接回傳
-                if (
-                    existing_node_telemetry_device is not None
-                    and node_telemetry_device.update_at
-                    < existing_node_telemetry_device.update_at
-                ):
-                    return existing_node_telemetry_device
-
-                # 動態構建 set_ 字典，移除值為 None 的鍵
-                data = {
-                    "battery_level": node_telemetry_device.battery_level,
-                    "voltage": node_telemetry_device.voltage,
-                    "channel_utilization": node_telemetry_device.channel_utilization,
-                    "air_util_tx": node_telemetry_device.air_util_tx,
-                    "uptime_seconds": node_telemetry_device.uptime_seconds,
-                    "update_at": node_telemetry_device.update_at,
-                    "topic": node_telemetry_device.topic,
-                }
-                data = {k: v for k, v in data.items() if v is not None}
-
-                # 使用 ON CONFLICT 子句來新增或更新
-                stmt = (
-                    insert(NodeTelemetryDevice)
-                    .values(
-                        node_id=node_telemetry_device.node_id,
-                        create_at=node_telemetry_device.create_at,
-                        **data,
-                    )
-                    .on_conflict_do_update(
-                        index_elements=["node_id", "create_at"],
-                        set_=data,
-                    )
-                )
-                await session.execute(stmt)
-                await session.commit()
-                final_node_telemetry_device = (
-                    await session.execute(
-                        select(NodeTelemetryDevice)
-                        .where(
-                            NodeTelemetryDevice.node_id == node_telemetry_device.node_id
-                        )
-                        .where(
-                            NodeTelemetryDevice.create_at
-                            == node_telemetry_device.create_at
-                        )
-                    )
-                ).scalar()
-                return final_node_telemetry_device
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
-
-    # 新增或更新 NodeTelemetryEnvironment
-    async def create_or_update_node_telemetry_environment(
-        self, node_telemetry_environment: NodeTelemetryEnvironment
-    ) -> NodeTelemetryEnvironment:
-        async for session in get_db_connection_async():
-            try:
-                # 檢查 Node 是否存在
-                if not await self.check_node_exist(node_telemetry_environment.node_id):
-                    await self.create_node(
-                        Node(
-                            id=node_telemetry_environment.node_id,
-                            last_heard_at=node_telemetry_environment.update_at,
-                        )
-                    )
-
-                # 檢查 NodeTelemetryEnvironment 是否存在
-                existing_node_telemetry_environment = (
-                    await session.execute(
-                        select(NodeTelemetryEnvironment)
-                        .where(
-                            NodeTelemetryEnvironment.node_id
-                            == node_telemetry_environment.node_id
-                        )
-                        .where(
-                            NodeTelemetryEnvironment.create_at
-                            == node_telemetry_environment.create_at
-                        )
-                    )
-                ).scalar()
-
-                # 如果 NodeTelemetryEnvironment 存在，但傳入比較舊，則直接回傳
-                if (
-                    existing_node_telemetry_environment is not None
-                    and node_telemetry_environment.update_at
-                    < existing_node_telemetry_environment.update_at
-                ):
-                    return existing_node_telemetry_environment
-
-                # 動態構建 set_ 字典，移除值為 None 的鍵
-                data = {
-                    "temperature": node_telemetry_environment.temperature,
-                    "relative_humidity": node_telemetry_environment.relative_humidity,
-                    "barometric_pressure": node_telemetry_environment.barometric_pressure,
-                    "gas_resistance": node_telemetry_environment.gas_resistance,
-                    "voltage": node_telemetry_environment.voltage,
-                    "current": node_telemetry_environment.current,
-                    "iaq": node_telemetry_environment.iaq,
-                    "distance": node_telemetry_environment.distance,
-                    "lux": node_telemetry_environment.lux,
-                    "white_lux": node_telemetry_environment.white_lux,
-                    "ir_lux": node_telemetry_environment.ir_lux,
-                    "uv_lux": node_telemetry_environment.uv_lux,
-                    "wind_direction": node_telemetry_environment.wind_direction,
-                    "wind_speed": node_telemetry_environment.wind_speed,
-                    "weight": node_telemetry_environment.weight,
-                    "wind_gust": node_telemetry_environment.wind_gust,
-                    "wind_lull": node_telemetry_environment.wind_lull,
-                    "update_at": node_telemetry_environment.update_at,
-                    "topic": node_telemetry_environment.topic,
-                }
-                data = {k: v for k, v in data.items() if v is not None}
-
-                # 使用 ON CONFLICT 子句來新增或更新
-                stmt = (
-                    insert(NodeTelemetryEnvironment)
-                    .values(
-                        node_id=node_telemetry_environment.node_id,
-                        create_at=node_telemetry_environment.create_at,
-                        **data,
-                    )
-                    .on_conflict_do_update(
-                        index_elements=["node_id", "create_at"],
-                        set_=data,
-                    )
-                )
-                await session.execute(stmt)
-                await session.commit()
-                final_node_telemetry_environment = (
-                    await session.execute(
-                        select(NodeTelemetryEnvironment)
-                        .where(
-                            NodeTelemetryEnvironment.node_id
-                            == node_telemetry_environment.node_id
-                        )
-                        .where(
-                            NodeTelemetryEnvironment.create_at
-                            == node_telemetry_environment.create_at
-                        )
-                    )
-                ).scalar()
-                return final_node_telemetry_environment
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
-
-    # 新增或更新 NodeTelemetryPower
-    async def create_or_update_node_telemetry_power(
-        self, node_telemetry_power: NodeTelemetryPower
-    ) -> NodeTelemetryPower:
-        async for session in get_db_connection_async():
-            try:
-                # 檢查 Node 是否存在
-                if not await self.check_node_exist(node_telemetry_power.node_id):
-                    await self.create_node(
-                        Node(
-                            id=node_telemetry_power.node_id,
-                            last_heard_at=node_telemetry_power.update_at,
-                        )
-                    )
-
-                # 檢查 NodeTelemetryPower 是否存在
-                existing_node_telemetry_power = (
-                    await session.execute(
-                        select(NodeTelemetryPower)
-                        .where(
-                            NodeTelemetryPower.node_id == node_telemetry_power.node_id
-                        )
-                        .where(
-                            NodeTelemetryPower.create_at
-                            == node_telemetry_power.create_at
-                        )
-                    )
-                ).scalar()
-
-                # 如果 NodeTelemetryPower 存在，但傳入比較舊，則直接回傳
-                if (
-                    existing_node_telemetry_power is not None
-                    and node_telemetry_power.update_at
-                    < existing_node_telemetry_power.update_at
-                ):
-                    return existing_node_telemetry_power
-
-                # 動態構建 set_ 字典，移除值為 None 的鍵
-                data = {
-                    "ch1_voltage": node_telemetry_power.ch1_voltage,
-                    "ch1_current": node_telemetry_power.ch1_current,
-                    "ch2_voltage": node_telemetry_power.ch2_voltage,
-                    "ch2_current": node_telemetry_power.ch2_current,
-                    "ch3_voltage": node_telemetry_power.ch3_voltage,
-                    "ch3_current": node_telemetry_power.ch3_current,
-                    "update_at": node_telemetry_power.update_at,
-                    "topic": node_telemetry_power.topic,
-                }
-                data = {k: v for k, v in data.items() if v is not None}
-
-                # 使用 ON CONFLICT 子句來新增或更新
-                stmt = (
-                    insert(NodeTelemetryPower)
-                    .values(
-                        node_id=node_telemetry_power.node_id,
-                        create_at=node_telemetry_power.create_at,
-                        **data,
-                    )
-                    .on_conflict_do_update(
-                        index_elements=["node_id", "create_at"],
-                        set_=data,
-                    )
-                )
-                await session.execute(stmt)
-                await session.commit()
-                final_node_telemetry_power = (
-                    await session.execute(
-                        select(NodeTelemetryPower)
-                        .where(
-                            NodeTelemetryPower.node_id == node_telemetry_power.node_id
-                        )
-                        .where(
-                            NodeTelemetryPower.create_at
-                            == node_telemetry_power.create_at
-                        )
-                    )
-                ).scalar()
-                return final_node_telemetry_power
-            except Exception as e:
-                await session.rollback()
-                raise e
-            finally:
-                await session.close()
-
-    # 取得資料
-    def get_telemetry_value_or_none(self, metrics, key):
-        value = metrics.get(key, None)
-        if value == "NaN" or (
-            isinstance(value, float)
-            and math.isnan(value)
-            and isinstance(value, numbers.Number)
-        ):
-            return None
-        return value
+        if self.write_behind_service is not None:
+            await self.write_behind_service.add(node_position)
+            return node_position
+        if self.ingest_repository is not None:
+            return await self.ingest_repository.upsert(session, node_position)
+
+        # 確保 Node 存在
+        await self.node_registry_service.ensure_node(
+            session, node_position.node_id, last_heard_at=node_position.update_at
+        )
+        return await self.upsert_entity(session, node_position)
+
+    # 新增或更新遙測資料（TelemetryRegistryUtil 登錄的資料表）
+    async def create_or_update_node_telemetry(self, session: AsyncSession, entity):
+        # 變化在容許範圍內時不寫入
+        if not self.telemetry_filter_service.should_write(entity):
+            return entity
+        if self.telemetry_staging_service is not None:
+            await self.telemetry_staging_service.add(entity)
+            return entity
+        if self.write_behind_service is not None:
+            await self.write_behind_service.add(entity)
+            return entity
+        if self.ingest_repository is not None:
+            return await self.ingest_repository.upsert(session, entity)
+        # 確保 Node 存在
+        await self.node_registry_service.ensure_node(
+            session, entity.node_id, last_heard_at=entity.update_at
+        )
+        return await self.upsert_entity(session, entity)
@@ -0,0 +1,92 @@
+import asyncio
+import inspect
+import logging
+from datetime import datetime
+from app.configs.Database import get_db_connection_async
+from app.models.NodeModel import Node
+from sqlalchemy import BigInteger, DateTime, column, func, update, values
+from app.utils.ConfigUtil import ConfigUtil
+
+
+class NodePresenceService:
+    # 每個 VALUES 語句最多包含的節點數（每個節點 2 個參數）
+    MAX_ROWS_PER_STATEMENT = 15000
+
+    def __init__(self) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        self.flush_interval = float(
+            self.config.get("ingest", {}).get("presence", {}).get("flushInterval", 10)
+        )
+        # 節點 ID 對應最後聽到的時間（只保留最大值）
+        self.last_heard: dict[int, datetime] = {}
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+
+    # 啟動定時寫入
+    async def start(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_periodically())
+
+    # 停止定時寫入，並將尚未寫入的時間全部寫入
+    async def stop(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush()
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # 記錄節點被聽到的時間
+    def touch(self, node_id: int, heard_at: datetime) -> None:
+        if node_id is None:
+            return
+        previous = self.last_heard.get(node_id)
+        if previous is None or heard_at > previous:
+            self.last_heard[node_id] = heard_at
+
+    # 以 UPDATE ... FROM (VALUES ...) 一次更新所有節點的 last_heard_at
+    async def flush(self) -> None:
+        async with self.flush_lock:
+            if not self.last_heard:
+                return
+            last_heard, self.last_heard = self.last_heard, {}
+            rows = list(last_heard.items())
+            async for session in get_db_connection_async():
+                try:
+                    for i in range(0, len(rows), self.MAX_ROWS_PER_STATEMENT):
+                        heard = (
+                            values(
+                                column("id", BigInteger),
+                                column("last_heard_at", DateTime(timezone=True)),
+                                name="heard",
+                            )
+                            .data(rows[i : i + self.MAX_ROWS_PER_STATEMENT])
+                        )
+                        await session.execute(
+                            update(Node)
+                            .where(Node.id == heard.c.id)
+                            .values(
+                                last_heard_at=func.greatest(
+                                    Node.last_heard_at, heard.c.last_heard_at
+                                )
+                            )
+                        )
+                    await session.commit()
+                    self.logger.debug(f"已更新 {len(rows)} 個節點的最後聽到時間")
+                except Exception as e:
+                    await session.rollback()
+                    self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+                    # 寫入失敗時放回，下次一併寫入
+                    for node_id, heard_at in last_heard.items():
+                        self.touch(node_id, heard_at)
+                finally:
+                    await session.close()
@@ -0,0 +1,94 @@
+import logging
+from datetime import datetime, timezone
+from app.configs.Database import get_db_connection_async
+from app.models.NodeModel import Node
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.MeshtasticUtil import MeshtasticUtil
+
+
+class NodeRegistryService:
+    # session.info 中暫存尚未 commit 的節點 ID
+    PENDING_KEY = "pending_node_ids"
+
+    def __init__(self) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        # 已確認存在於 node 資料表的節點 ID
+        self.known_node_ids: set[int] = set()
+
+    # 從 node 資料表載入已知節點
+    async def load(self) -> None:
+        async for session in get_db_connection_async():
+            try:
+                result = await session.execute(select(Node.id))
+                self.known_node_ids = set(result.scalars().all())
+                self.logger.info(f"已載入 {len(self.known_node_ids)} 個已知節點")
+            except Exception as e:
+                await session.rollback()
+                raise e
+            finally:
+                await session.close()
+
+    def is_known(self, node_id: int) -> bool:
+        return node_id in self.known_node_ids
+
+    def mark_known(self, node_ids) -> None:
+        self.known_node_ids.update(node_ids)
+
+    # 確保節點存在，回傳是否為本次新建立
+    async def ensure_node(
+        self, session: AsyncSession, node_id: int, last_heard_at: datetime = None
+    ) -> bool:
+        created = await self.ensure_nodes(session, [node_id], last_heard_at)
+        return node_id in created
+
+    # 確保多個節點存在，回傳本次新建立的節點 ID
+    # 於呼叫端的交易中寫入，交易 commit 後需呼叫 confirm 才會記入已知節點
+    async def ensure_nodes(
+        self,
+        session: AsyncSession,
+        node_ids: list[int],
+        last_heard_at: datetime = None,
+    ) -> set[int]:
+        pending_node_ids = session.info.setdefault(self.PENDING_KEY, set())
+        # 依 ID 排序寫入，只有同一次呼叫中的節點鎖定順序一致；
+        # 交易中之後再建立其他節點仍可能與其他 worker 死結，呼叫端需一次傳入所有節點
+        unknown_node_ids = sorted(
+            node_id
+            for node_id in set(node_ids)
+            if node_id is not None
+            and node_id not in self.known_node_ids
+            and node_id not in pending_node_ids
+        )
+        if not unknown_node_ids:
+            return set()
+        if last_heard_at is None:
+            last_heard_at = datetime.now(timezone.utc)
+        # 以 INSERT ... ON CONFLICT DO NOTHING 建立節點，回傳實際新增的節點 ID
+        result = await session.execute(
+            insert(Node)
+            .values(
+                [
+                    {
+                        "id": node_id,
+                        "id_hex": MeshtasticUtil.convert_node_id_from_int_to_hex(
+                            node_id
+                        ),
+                        "last_heard_at": last_heard_at,
+                    }
+                    for node_id in unknown_node_ids
+                ]
+            )
+            .on_conflict_do_nothing(index_elements=["id"])
+            .returning(Node.id)
+        )
+        pending_node_ids.update(unknown_node_ids)
+        return set(result.scalars().all())
+
+    # 交易 commit 後，將該 session 建立的節點記入已知節點
+    def confirm(self, session: AsyncSession) -> None:
+        self.known_node_ids.update(session.info.pop(self.PENDING_KEY, ()))
@@ -0,0 +1,150 @@
+import asyncio
+import inspect
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.PacketArchiveUtil import PacketArchiveUtil
+
+
+class PacketArchiveService:
+    # shard: 多個接收 process 時加在 segment 檔名後，避免同時寫入相同的檔案
+    def __init__(self, shard: str = None) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        archive_config = self.config.get("ingest", {}).get("archive", {})
+        self.path = archive_config.get("path", "archive")
+        self.segment_size = int(archive_config.get("segmentSize", 268435456))
+        self.block_size = int(archive_config.get("blockSize", 262144))
+        self.flush_interval = float(archive_config.get("flushInterval", 5))
+        self.compress_level = int(archive_config.get("compressLevel", 6))
+        self.shard = shard
+        # 尚未寫入的紀錄，達到 blockSize 或 flushInterval 時壓縮為一個區塊寫入
+        self.buffer = bytearray()
+        self.buffer_count = 0
+        self.buffer_first_at = None
+        self.buffer_last_at = None
+        # 目前寫入中的 segment 與其索引檔
+        self.segment_file = None
+        self.index_file = None
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+        self.records = 0
+        self.blocks = 0
+        self.segments = 0
+        self.bytes_written = 0
+        self.dropped = 0
+
+    async def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_periodically())
+
+    # 停止寫入，並將緩衝中的紀錄全部寫入
+    async def stop(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush()
+        await asyncio.to_thread(self.close_segment)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # 記錄收到的原始訊息，received_at 為收到的時間，未指定時為當下
+    async def append(
+        self, broker: str, topic: str, payload: bytes, received_at: float = None
+    ) -> None:
+        if received_at is None:
+            received_at = time.time()
+        self.buffer += PacketArchiveUtil.encode_record(
+            received_at, broker, topic, payload
+        )
+        if self.buffer_first_at is None:
+            self.buffer_first_at = received_at
+        self.buffer_last_at = received_at
+        self.buffer_count += 1
+        if len(self.buffer) >= self.block_size and not self.flush_lock.locked():
+            await self.flush()
+
+    # 將緩衝壓縮為一個區塊寫入，壓縮與檔案寫入於 thread 中執行
+    async def flush(self) -> None:
+        async with self.flush_lock:
+            if not self.buffer:
+                return
+            block = (
+                bytes(self.buffer),
+                self.buffer_count,
+                self.buffer_first_at,
+                self.buffer_last_at,
+            )
+            self.buffer = bytearray()
+            self.buffer_count = 0
+            self.buffer_first_at = None
+            self.buffer_last_at = None
+            write = asyncio.ensure_future(asyncio.to_thread(self.write_block, *block))
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # 取消時仍等待寫入完成，避免與下一次寫入同時操作檔案
+                await asyncio.gather(write, return_exceptions=True)
+                raise
+            except Exception as e:
+                self.dropped += block[1]
+                self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+
+    def write_block(self, data: bytes, count: int, first_at: float, last_at: float):
+        if self.segment_file is None or self.segment_file.tell() >= self.segment_size:
+            self.rotate_segment()
+        offset = self.segment_file.tell()
+        block = PacketArchiveUtil.encode_block(
+            data, count, first_at, last_at, self.compress_level
+        )
+        self.segment_file.write(block)
+        self.segment_file.flush()
+        # 區塊寫入後才寫入索引，讀取時可由區塊標頭補齊缺少的索引
+        self.index_file.write(
+            PacketArchiveUtil.INDEX_ENTRY.pack(first_at, last_at, offset)
+        )
+        self.index_file.flush()
+        self.records += count
+        self.blocks += 1
+        self.bytes_written += len(block)
+
+    # 建立新的 segment，檔名為建立時間
+    def rotate_segment(self) -> None:
+        self.close_segment()
+        name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        if self.shard:
+            name += f"-{self.shard}"
+        segment_path = os.path.join(self.path, name + PacketArchiveUtil.SEGMENT_SUFFIX)
+        self.segment_file = open(segment_path, "ab")
+        self.index_file = open(PacketArchiveUtil.index_path(segment_path), "ab")
+        self.segments += 1
+        self.logger.info(f"開始寫入原始封包 segment: {segment_path}")
+
+    def close_segment(self) -> None:
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+        if self.index_file is not None:
+            self.index_file.close()
+            self.index_file = None
+
+    def stats(self) -> dict:
+        return {
+            "records": self.records,
+            "blocks": self.blocks,
+            "segments": self.segments,
+            "bytesWritten": self.bytes_written,
+            "buffered": self.buffer_count,
+            "dropped": self.dropped,
+        }
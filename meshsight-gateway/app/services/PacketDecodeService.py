@@ -0,0 +1,140 @@
+import asyncio
+import functools
+import inspect
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.MeshtasticDecodeUtil import MeshtasticDecodeUtil
+
+
+class PacketDecodeService:
+    def __init__(self, handler, channel_key_service) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        pool_config = self.config.get("ingest", {}).get("decodePool", {})
+        self.processes = max(1, int(pool_config.get("processes", 2)))
+        self.batch_size = max(1, int(pool_config.get("batchSize", 64)))
+        self.batch_interval = float(pool_config.get("batchInterval", 0.01))
+        self.max_pending = max(1, int(pool_config.get("maxPending", 2000)))
+        self.drain_timeout = float(pool_config.get("drainTimeout", 10))
+        # 處理函數，依收到的順序處理解碼後的訊息
+        self.handler = handler
+        # 頻道金鑰與解密失敗的負向快取，於主 process 維護並隨批次送出
+        self.channel_key_service = channel_key_service
+        self.executor = None
+        # 依收到順序排列的 (解碼結果 future, 收到的時間)，已滿時暫停接收
+        self.results = asyncio.Queue(maxsize=self.max_pending)
+        # 尚未送出的 (topic, payload, future)
+        self.pending = []
+        self.submit_handle = None
+        self.worker = None
+        self.batches = 0
+        self.decoded = 0
+        self.failed = 0
+        self.backpressure = 0
+
+    async def start(self):
+        if self.executor is None:
+            # 於已有多個 thread 的 asyncio process 中 fork 可能複製到已鎖定的鎖，
+            # 與 IngestShardService 相同以 spawn 建立 process
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        if self.worker is None:
+            self.worker = asyncio.create_task(self.work())
+
+    # 停止解碼，停止前盡量處理完已收到的訊息
+    async def stop(self):
+        self.submit()
+        try:
+            await asyncio.wait_for(self.results.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            self.logger.error(f"等待解碼逾時，剩餘 {self.results.qsize()} 筆訊息未處理")
+        if self.worker is not None:
+            self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
+            self.worker = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    # 放入待解碼的 ServiceEnvelope，湊滿一批或等待 batchInterval 後送出
+    async def put(self, topic: str, payload: bytes, received_at: float) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.results.full():
+            self.backpressure += 1
+        await self.results.put((future, received_at))
+        self.pending.append((topic, payload, future))
+        if len(self.pending) >= self.batch_size:
+            self.submit()
+        elif self.submit_handle is None:
+            self.submit_handle = loop.call_later(self.batch_interval, self.submit)
+
+    # 將目前的批次送至 process pool
+    def submit(self) -> None:
+        if self.submit_handle is not None:
+            self.submit_handle.cancel()
+            self.submit_handle = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            task = asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                MeshtasticDecodeUtil.decode_envelope_batch,
+                [(topic, payload) for topic, payload, _ in batch],
+                self.channel_key_service.keys(),
+                self.channel_key_service.skip_keys(),
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        task.add_done_callback(functools.partial(self.resolve, batch))
+
+    # 將批次結果分配給各訊息的 future
+    def resolve(self, batch: list, task: asyncio.Future) -> None:
+        exception = (
+            RuntimeError("解碼已取消") if task.cancelled() else task.exception()
+        )
+        results = (
+            task.result() if exception is None else [(None, None, None)] * len(batch)
+        )
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    async def work(self):
+        while True:
+            future, received_at = await self.results.get()
+            try:
+                record, decrypt_result, key = await future
+                self.channel_key_service.record(key, decrypt_result)
+                if record is not None:
+                    record.received_at = received_at
+                    self.decoded += 1
+                    await self.handler(record)
+            except Exception as e:
+                self.failed += 1
+                self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+            finally:
+                self.results.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "processes": self.processes,
+            "inFlight": self.results.qsize(),
+            "batches": self.batches,
+            "decoded": self.decoded,
+            "failed": self.failed,
+            "backpressure": self.backpressure,
+        }
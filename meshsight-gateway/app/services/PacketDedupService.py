@@ -0,0 +1,77 @@
+import logging
+import time
+from collections import OrderedDict
+from app.schemas.packet.PacketSchema import PacketRecord
+from app.utils.ConfigUtil import ConfigUtil
+
+
+class PacketDedupService:
+    # 資料表以 topic 區分 gateway 的訊息類型，重複封包仍需以新的 topic 記錄
+    RECORD_TOPIC_TYPES = {"position"}
+
+    def __init__(self) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        dedup_config = self.config.get("ingest", {}).get("dedup", {})
+        self.enabled = bool(dedup_config.get("enabled", False))
+        self.ttl = float(dedup_config.get("ttl", 600))
+        self.max_entries = int(dedup_config.get("maxEntries", 100000))
+        # (from, id) 對應已解碼的封包，依加入順序排列以便淘汰
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # 查詢封包是否已處理過；portnum 未知（加密封包）時只比對 (from, id)
+    def lookup(self, from_id: int, packet_id: int, portnum: int = None):
+        if not self.enabled or not packet_id:
+            return None
+        self.evict_expired()
+        entry = self.entries.get((from_id, packet_id))
+        if entry is None or (portnum is not None and entry["portnum"] != portnum):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    # 記錄已解碼的封包
+    def remember(self, record: PacketRecord) -> None:
+        if not self.enabled or not record.id:
+            return
+        key = (record.from_id, record.id)
+        self.entries.pop(key, None)
+        self.entries[key] = {
+            "expire_at": time.monotonic() + self.ttl,
+            "portnum": record.portnum,
+            "record": record,
+            "topics": {record.topic},
+        }
+        # 超過上限時淘汰最舊的紀錄
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    # 記錄重複封包的 gateway topic，需要寫入時回傳以新 topic 組成的訊息
+    def record_topic(self, entry: dict, topic: str):
+        if topic in entry["topics"]:
+            return None
+        entry["topics"].add(topic)
+        if entry["record"].type not in self.RECORD_TOPIC_TYPES:
+            return None
+        return entry["record"].with_topic(topic)
+
+    def evict_expired(self) -> None:
+        now = time.monotonic()
+        while self.entries:
+            entry = next(iter(self.entries.values()))
+            if entry["expire_at"] > now:
+                break
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / total, 4) if total else 0,
+        }
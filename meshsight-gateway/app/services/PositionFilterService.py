@@ -0,0 +1,81 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.MeshtasticUtil import MeshtasticUtil
+
+
+class PositionFilterService:
+    def __init__(self) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        filter_config = self.config.get("ingest", {}).get("positionFilter", {})
+        self.enabled = bool(filter_config.get("enabled", False))
+        self.min_distance = float(filter_config.get("minDistance", 10))
+        self.heartbeat = float(filter_config.get("heartbeat", 900))
+        self.max_entries = int(filter_config.get("maxEntries", 100000))
+        # (node_id, topic) 對應最後寫入的位置（模糊處理前），依使用順序排列以便淘汰
+        self.entries: OrderedDict = OrderedDict()
+        self.written = 0
+        self.suppressed = 0
+
+    # 判斷位置是否需要寫入，需要時記錄為最後寫入的位置
+    # 以下情況才寫入：沒有紀錄、進入新的小時（資料表以小時為單位）、精度改變、
+    # 移動超過 minDistance、距離上次寫入超過 heartbeat
+    def should_write(
+        self,
+        node_id: int,
+        topic: str,
+        latitude: float,
+        longitude: float,
+        precision_bits: int,
+        create_at: datetime,
+        update_at: datetime,
+    ) -> bool:
+        if not self.enabled:
+            return True
+        key = (node_id, topic)
+        entry = self.entries.get(key)
+        if entry is not None and (
+            entry["create_at"] == create_at
+            # 重送的相同資料（例如寫入失敗後由 spool 重新寫入）仍寫入
+            and update_at != entry["update_at"]
+            and entry["precision_bits"] == precision_bits
+            and (update_at - entry["update_at"]).total_seconds() < self.heartbeat
+            and MeshtasticUtil.calculate_distance_in_meters(
+                entry["latitude"], entry["longitude"], latitude, longitude
+            )
+            <= self.min_distance
+        ):
+            self.entries.move_to_end(key)
+            self.suppressed += 1
+            return False
+        if entry is None or update_at >= entry["update_at"]:
+            # 較舊（順序錯亂）的位置不取代最後寫入的紀錄
+            self.entries.pop(key, None)
+            self.entries[key] = {
+                "latitude": latitude,
+                "longitude": longitude,
+                "precision_bits": precision_bits,
+                "create_at": create_at,
+                "update_at": update_at,
+            }
+            # 超過上限時淘汰最久未使用的紀錄
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        self.written += 1
+        return True
+
+    # 寫入失敗時清除最後寫入的紀錄，之後收到的位置不會因未寫入的紀錄而略過
+    def forget(self, node_id: int, topic: str) -> None:
+        self.entries.pop((node_id, topic), None)
+
+    def stats(self) -> dict:
+        total = self.written + self.suppressed
+        return {
+            "entries": len(self.entries),
+            "written": self.written,
+            "suppressed": self.suppressed,
+            "suppressRate": round(self.suppressed / total, 4) if total else 0,
+        }
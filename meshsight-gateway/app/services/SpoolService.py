@@ -0,0 +1,334 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from app.configs.Database import get_db_connection_async
+from app.schemas.packet.PacketSchema import PacketRecord
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.NeighborEdgeUtil import NeighborEdgeUtil
+from app.utils.UpsertUtil import UpsertUtil
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class SpoolService:
+    SEGMENT_SUFFIX = ".jsonl"
+    # 視為資料庫無法連線的錯誤
+    UNAVAILABLE_ERRORS = (
+        OSError,
+        asyncpg.exceptions.PostgresConnectionError,
+        asyncpg.exceptions.OperatorInterventionError,
+        asyncpg.exceptions.TooManyConnectionsError,
+    )
+
+    # handler: 重新寫入一筆已解碼訊息的函數
+    # queue_load: 回傳寫入佇列使用比例（0-1）的函數，未使用佇列時為 None
+    # shard: 多個接收 process 時各自使用 path 下的子目錄，只重新寫入自己的 spool
+    # confirm: 等待已交給 handler 的訊息寫入資料庫（或寫入失敗時再寫回 spool）的函數，
+    # 確認後才刪除 segment，未提供時 handler 回傳即視為已寫入
+    def __init__(
+        self, handler, queue_load=None, shard: str = None, confirm=None
+    ) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        spool_config = self.config.get("ingest", {}).get("spool", {})
+        self.path = spool_config.get("path", "spool")
+        if shard:
+            self.path = os.path.join(self.path, shard)
+        self.segment_size = int(spool_config.get("segmentSize", 67108864))
+        self.high_water_mark = float(spool_config.get("highWaterMark", 0.8))
+        self.low_water_mark = float(spool_config.get("lowWaterMark", 0.5))
+        self.drain_interval = float(spool_config.get("drainInterval", 5))
+        self.drain_batch_size = int(spool_config.get("drainBatchSize", 500))
+        self.handler = handler
+        self.queue_load = queue_load
+        self.confirm = confirm
+        # 資料庫是否可寫入，寫入失敗時設為 False，由 drainer 確認恢復
+        self.available = True
+        # 目前寫入中的 segment
+        self.segment_file = None
+        self.segment_path = None
+        self.drain_task = None
+        self.spooled = 0
+        self.spooled_rows = 0
+        self.drained = 0
+        self.corrupted = 0
+        self.failed = 0
+        self.drain_rate = 0.0
+
+    async def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        if self.drain_task is None:
+            self.drain_task = asyncio.create_task(self.drain_periodically())
+
+    # 停止 drainer，尚未重新寫入的紀錄保留於 spool，下次啟動時繼續
+    async def stop(self):
+        if self.drain_task is not None:
+            self.drain_task.cancel()
+            try:
+                await self.drain_task
+            except asyncio.CancelledError:
+                pass
+            self.drain_task = None
+        self.close_segment()
+
+    # 資料庫無法連線或寫入佇列超過高水位時，改寫入 spool
+    def should_divert(self) -> bool:
+        if not self.available:
+            return True
+        return (
+            self.queue_load is not None and self.queue_load() >= self.high_water_mark
+        )
+
+    # 判斷錯誤是否為資料庫無法連線（而非資料本身的錯誤）
+    def is_unavailable_error(self, error: BaseException) -> bool:
+        while error is not None:
+            if isinstance(error, self.UNAVAILABLE_ERRORS):
+                return True
+            if isinstance(error, DBAPIError) and error.connection_invalidated:
+                return True
+            error = getattr(error, "orig", None) or error.__cause__
+        return False
+
+    # 寫入失敗且為無法連線時，標記資料庫無法使用並改寫入 spool
+    def mark_unavailable(self, error: BaseException) -> None:
+        if self.available:
+            self.logger.error(f"資料庫無法寫入，改寫入 spool: {error}")
+        self.available = False
+
+    # 將一筆已解碼的訊息附加至 spool
+    def append(self, record: PacketRecord) -> None:
+        self.write_line(record.to_dict())
+        self.spooled += 1
+
+    # 將批次寫入或 staging 寫入失敗的資料附加至 spool
+    # tables: {model: [row, ...]}，neighbor_edges: {node_id: [edge, ...]}
+    def append_batch(self, tables: dict, neighbor_edges: dict = None) -> None:
+        neighbor_edges = neighbor_edges or {}
+        self.write_line(
+            {
+                "tables": {
+                    model.__tablename__: [UpsertUtil.row_to_json(row) for row in rows]
+                    for model, rows in tables.items()
+                    if rows
+                },
+                # JSON 的 key 只能是字串，以 [node_id, edges] 保存
+                "neighborEdges": [
+                    [node_id, edges] for node_id, edges in neighbor_edges.items()
+                ],
+            }
+        )
+        self.spooled_rows += sum(len(rows) for rows in tables.values())
+
+    def write_line(self, data: dict) -> None:
+        if self.segment_file is None or self.segment_file.tell() >= self.segment_size:
+            self.rotate_segment()
+        if orjson is not None:
+            line = orjson.dumps(data) + b"\n"
+        else:
+            line = json.dumps(data).encode("utf-8") + b"\n"
+        self.segment_file.write(line)
+        self.segment_file.flush()
+
+    def rotate_segment(self) -> None:
+        self.close_segment()
+        os.makedirs(self.path, exist_ok=True)
+        name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self.segment_path = os.path.join(self.path, name + self.SEGMENT_SUFFIX)
+        self.segment_file = open(self.segment_path, "ab")
+
+    def close_segment(self) -> None:
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+            self.segment_path = None
+
+    # 依檔名（建立時間）排序的 segment 檔案
+    def list_segments(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        return [
+            os.path.join(self.path, name)
+            for name in sorted(os.listdir(self.path))
+            if name.endswith(self.SEGMENT_SUFFIX)
+        ]
+
+    async def drain_periodically(self):
+        while True:
+            await asyncio.sleep(self.drain_interval)
+            try:
+                if not self.available:
+                    await self.check_available()
+                if self.available:
+                    await self.drain()
+            except Exception as e:
+                self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+
+    # 確認資料庫是否恢復
+    async def check_available(self) -> None:
+        try:
+            async for session in get_db_connection_async():
+                await session.execute(text("SELECT 1"))
+            self.available = True
+            self.logger.info("資料庫已恢復，開始重新寫入 spool")
+        except Exception as e:
+            self.logger.debug(f"資料庫仍無法連線: {e}")
+
+    # 依序重新寫入 spool 中的紀錄，每個 segment 確認全部寫入資料庫後才刪除
+    # 重新寫入時資料庫再次無法連線，失敗的紀錄會由 handler 再寫回 spool
+    async def drain(self) -> None:
+        for segment_path in self.list_segments():
+            if segment_path == self.segment_path:
+                # 寫入中的 segment 先關閉，之後的紀錄寫入新的 segment
+                self.close_segment()
+            if not await self.drain_segment(segment_path):
+                return
+
+    # 重新寫入一個 segment，全部確認寫入後刪除並回傳 True；
+    # 資料庫無法連線時保留尚未寫入的部分並回傳 False，程式中斷時整個 segment 保留
+    async def drain_segment(self, segment_path: str) -> bool:
+        started_at = time.monotonic()
+        count = 0
+        # 已交給 handler、已寫入或已略過的位置，之後的部分保留於 segment
+        offset = 0
+        with open(segment_path, "rb") as file:
+            for line in file:
+                if not self.available:
+                    break
+                drained = await self.drain_line(line)
+                if not drained and not self.available:
+                    # 因資料庫無法連線而寫入失敗的一行保留於 segment
+                    break
+                offset += len(line)
+                if not drained:
+                    continue
+                count += 1
+                self.drained += 1
+                if count % self.drain_batch_size == 0:
+                    await self.wait_for_queue()
+                    await self.confirm_written()
+        # 等待已交給 handler 的紀錄寫入資料庫，寫入失敗的紀錄已由寫入流程再寫回 spool，
+        # 因此 offset 之前的紀錄只會存在於資料庫或新的 segment 其中一處
+        await self.confirm_written()
+        if not self.available:
+            self.truncate_confirmed(segment_path, offset)
+            return False
+        os.remove(segment_path)
+        elapsed = time.monotonic() - started_at
+        self.drain_rate = count / elapsed if elapsed > 0 else 0.0
+        self.logger.info(
+            f"已重新寫入 spool {segment_path}: {count} 筆，"
+            f"{self.drain_rate:.1f} 筆/秒"
+        )
+        return True
+
+    # 重新寫入一行，回傳是否已交給 handler 或已寫入
+    async def drain_line(self, line: bytes) -> bool:
+        try:
+            data = (
+                orjson.loads(line)
+                if orjson is not None
+                else json.loads(line.decode("utf-8"))
+            )
+        except ValueError:
+            # 寫入中斷的最後一行
+            self.corrupted += 1
+            return False
+        try:
+            if "tables" in data:
+                await self.write_batch(data)
+            else:
+                # 舊版 spool 的 message_json 也可還原
+                await self.handler(PacketRecord.from_json(data))
+            return True
+        except Exception as e:
+            if self.is_unavailable_error(e):
+                # 保留於 segment，資料庫恢復後重新寫入
+                self.mark_unavailable(e)
+                return False
+            # 資料本身的錯誤，略過此筆避免重複失敗
+            self.failed += 1
+            self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+            return False
+
+    # 等待已交給 handler 的紀錄寫入資料庫
+    async def confirm_written(self) -> None:
+        if self.confirm is not None:
+            await self.confirm()
+
+    # 重新寫入 append_batch 的批次，與批次寫入相同依衝突鍵的順序於同一個交易中寫入
+    async def write_batch(self, data: dict) -> None:
+        async for session in get_db_connection_async():
+            try:
+                for model in UpsertUtil.CONFLICT_KEYS:
+                    rows = data["tables"].get(model.__tablename__)
+                    if rows:
+                        await UpsertUtil.upsert_rows(
+                            session,
+                            model,
+                            [UpsertUtil.row_from_json(model, row) for row in rows],
+                        )
+                if data.get("neighborEdges"):
+                    await NeighborEdgeUtil.sync_edges(
+                        session,
+                        {node_id: edges for node_id, edges in data["neighborEdges"]},
+                    )
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise e
+            finally:
+                await session.close()
+
+    # 寫入佇列降至低水位以下才繼續，避免即時收到的訊息被擠入 spool
+    async def wait_for_queue(self) -> None:
+        await asyncio.sleep(0)
+        while (
+            self.available
+            and self.queue_load is not None
+            and self.queue_load() > self.low_water_mark
+        ):
+            await asyncio.sleep(0.1)
+
+    # 刪除 segment 中已寫入（或已再寫回 spool）的部分
+    def truncate_confirmed(self, segment_path: str, confirmed: int) -> None:
+        if confirmed == 0:
+            return
+        temporary_path = segment_path + ".tmp"
+        with open(segment_path, "rb") as file:
+            file.seek(confirmed)
+            with open(temporary_path, "wb") as temporary_file:
+                temporary_file.write(file.read())
+        os.replace(temporary_path, segment_path)
+
+    def size(self) -> int:
+        total = 0
+        for segment_path in self.list_segments():
+            try:
+                total += os.path.getsize(segment_path)
+            except OSError:
+                pass
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "available": self.available,
+            "bytes": self.size(),
+            "segments": len(self.list_segments()),
+            "spooled": self.spooled,
+            "spooledRows": self.spooled_rows,
+            "drained": self.drained,
+            "corrupted": self.corrupted,
+            "failed": self.failed,
+            "drainRate": round(self.drain_rate, 1),
+        }
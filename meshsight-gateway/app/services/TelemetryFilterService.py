@@ -0,0 +1,89 @@
+import logging
+from collections import OrderedDict
+from app.utils.ConfigUtil import ConfigUtil
+
+
+class TelemetryFilterService:
+    def __init__(self) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        filter_config = self.config.get("ingest", {}).get("telemetryFilter", {})
+        self.enabled = bool(filter_config.get("enabled", False))
+        self.heartbeat = float(filter_config.get("heartbeat", 1800))
+        self.max_entries = int(filter_config.get("maxEntries", 100000))
+        # 資料表名稱對應各欄位的容許變化量，未列出的欄位不列入判斷
+        self.tolerances = {
+            table: {column: float(value) for column, value in (columns or {}).items()}
+            for table, columns in filter_config.get("tolerances", {}).items()
+        }
+        # (資料表名稱, node_id) 對應最後寫入的資料，依使用順序排列以便淘汰
+        self.entries: OrderedDict = OrderedDict()
+        self.written = {}
+        self.suppressed = {}
+
+    # 判斷遙測資料是否需要寫入，需要時記錄為最後寫入的資料
+    # 資料表以小時為單位只保留最後一筆，因此每個小時的第一筆一定寫入，
+    # 同一小時內所有欄位的變化都在容許範圍內、且距離上次寫入未超過 heartbeat 時略過
+    def should_write(self, entity) -> bool:
+        table = entity.__tablename__
+        tolerances = self.tolerances.get(table)
+        if not self.enabled or not tolerances:
+            return True
+        key = (table, entity.node_id)
+        entry = self.entries.get(key)
+        values = {column: getattr(entity, column) for column in tolerances}
+        if (
+            entry is not None
+            and entry["create_at"] == entity.create_at
+            # 重送的相同資料（例如寫入失敗後由 spool 重新寫入）仍寫入
+            and entity.update_at != entry["update_at"]
+            and (entity.update_at - entry["update_at"]).total_seconds()
+            < self.heartbeat
+            and all(
+                self.within_tolerance(
+                    entry["values"].get(column), value, tolerances[column]
+                )
+                for column, value in values.items()
+            )
+        ):
+            self.entries.move_to_end(key)
+            self.suppressed[table] = self.suppressed.get(table, 0) + 1
+            return False
+        if entry is None or entity.update_at >= entry["update_at"]:
+            # 較舊（順序錯亂）的資料不取代最後寫入的紀錄
+            self.entries.pop(key, None)
+            self.entries[key] = {
+                "create_at": entity.create_at,
+                "update_at": entity.update_at,
+                "values": values,
+            }
+            # 超過上限時淘汰最久未使用的紀錄
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        self.written[table] = self.written.get(table, 0) + 1
+        return True
+
+    # 寫入失敗時清除最後寫入的紀錄，之後收到的資料不會因未寫入的紀錄而略過
+    # 未指定資料表時清除節點所有資料表的紀錄
+    def forget(self, node_id: int, table: str = None) -> None:
+        for key_table in (table,) if table is not None else self.tolerances:
+            self.entries.pop((key_table, node_id), None)
+
+    # 有值與空值之間的變化一律視為超出範圍
+    def within_tolerance(self, previous, value, tolerance: float) -> bool:
+        if previous is None or value is None:
+            return previous is None and value is None
+        return abs(value - previous) <= tolerance
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "tables": {
+                table: {
+                    "written": self.written.get(table, 0),
+                    "suppressed": self.suppressed.get(table, 0),
+                }
+                for table in self.tolerances
+            },
+        }
@@ -0,0 +1,269 @@
+import asyncio
+import inspect
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from sqlalchemy import text
+from app.configs.Database import get_db_connection_async
+from app.models.NodeModel import Node
+from app.models.NodeTelemetryAirQualityModel import NodeTelemetryAirQuality
+from app.models.NodeTelemetryDeviceModel import NodeTelemetryDevice
+from app.models.NodeTelemetryEnvironmentModel import NodeTelemetryEnvironment
+from app.models.NodeTelemetryHealthModel import NodeTelemetryHealth
+from app.models.NodeTelemetryLocalStatsModel import NodeTelemetryLocalStats
+from app.models.NodeTelemetryPowerModel import NodeTelemetryPower
+from app.services.DurabilityService import DurabilityService
+from app.services.NodeRegistryService import NodeRegistryService
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.MeshtasticUtil import MeshtasticUtil
+from app.utils.UpsertUtil import UpsertUtil
+
+
+class TelemetryStagingService:
+    # 以 COPY 寫入的遙測資料表，staging 資料表由 alembic 建立（UNLOGGED、無限制條件）
+    MODELS = [
+        NodeTelemetryAirQuality,
+        NodeTelemetryDevice,
+        NodeTelemetryEnvironment,
+        NodeTelemetryHealth,
+        NodeTelemetryLocalStats,
+        NodeTelemetryPower,
+    ]
+    STAGING_SUFFIX = "_staging"
+
+    def __init__(
+        self,
+        node_registry_service: NodeRegistryService,
+        durability_service: DurabilityService,
+        merge: bool = True,
+    ) -> None:
+        self.config = ConfigUtil().read_config()
+        self.node_registry_service = node_registry_service
+        self.durability_service = durability_service
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        staging_config = self.config.get("ingest", {}).get("telemetryStaging", {})
+        self.batch_size = int(staging_config.get("batchSize", 2000))
+        self.flush_interval = float(staging_config.get("flushInterval", 1))
+        self.merge_interval = float(staging_config.get("mergeInterval", 10))
+        self.max_buffer_size = int(staging_config.get("maxBufferSize", 50000))
+        # 是否定時合併至正式資料表，多個接收 process 時只由其中一個合併
+        self.merge_enabled = merge
+        self.columns = {
+            model: [column.name for column in model.__table__.columns]
+            for model in self.MODELS
+        }
+        self.merge_statements = {
+            model: UpsertUtil.build_staging_merge(
+                model, model.__tablename__ + self.STAGING_SUFFIX
+            )
+            for model in self.MODELS
+        }
+        self.buffers = {model: {} for model in self.MODELS}
+        self.size = 0
+        self.dropped = 0
+        # 寫入失敗時改寫入的 SpoolService，未設定時捨棄
+        self.spool_service = None
+        # 寫入失敗而捨棄資料時呼叫，傳入 {model: [row, ...]}
+        self.on_dropped = None
+        self.flush_lock = asyncio.Lock()
+        self.merge_lock = asyncio.Lock()
+        self.flush_task = None
+        # 各資料表的統計：COPY 至 staging 的筆數、合併的筆數、最近一次合併的每秒筆數
+        self.staged = {model: 0 for model in self.MODELS}
+        self.merged = {model: 0 for model in self.MODELS}
+        self.rates = {model: 0.0 for model in self.MODELS}
+        self.merged_at = time.monotonic()
+
+    async def start(self):
+        if self.flush_task is None:
+            self.merged_at = time.monotonic()
+            self.flush_task = asyncio.create_task(self.flush_periodically())
+
+    # 停止定時寫入，並將緩衝與 staging 中的資料全部合併
+    async def stop(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush()
+        if self.merge_enabled:
+            await self.merge()
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if (
+                self.merge_enabled
+                and time.monotonic() - self.merged_at >= self.merge_interval
+            ):
+                await self.merge()
+
+    # 加入一筆遙測資料至緩衝
+    async def add(self, entity) -> None:
+        # 緩衝已滿時，等待寫入完成再繼續（背壓）
+        if self.size >= self.max_buffer_size:
+            await self.flush()
+        model = type(entity)
+        row = UpsertUtil.entity_to_row(entity)
+        row["uuid"] = uuid.uuid4()
+        row.setdefault("update_at", datetime.now(timezone.utc))
+        buffer = self.buffers[model]
+        key = tuple(row[k] for k in UpsertUtil.CONFLICT_KEYS[model])
+        existing = buffer.get(key)
+        if existing is None:
+            self.size += 1
+        elif row["update_at"] < existing["update_at"]:
+            # 同一衝突鍵以較新的資料為準，較舊的資料補足空值
+            row = {**row, **existing}
+        else:
+            row = {**existing, **row}
+        buffer[key] = row
+        if self.size >= self.batch_size and not self.flush_lock.locked():
+            await self.flush()
+
+    # 將緩衝以 COPY 寫入 staging 資料表
+    async def flush(self) -> None:
+        async with self.flush_lock:
+            if self.size == 0:
+                return
+            buffers, size = self.buffers, self.size
+            self.buffers = {model: {} for model in self.MODELS}
+            self.size = 0
+            try:
+                await self.copy(buffers)
+                for model, buffer in buffers.items():
+                    self.staged[model] += len(buffer)
+            except Exception as e:
+                self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+                if self.spool_service is not None:
+                    # 改寫入 spool，重新寫入時直接 upsert 至正式資料表
+                    if self.spool_service.is_unavailable_error(e):
+                        self.spool_service.mark_unavailable(e)
+                    self.spool_service.append_batch(self.spool_tables(buffers))
+                    return
+                self.dropped += size
+                self.logger.error(f"寫入 staging 失敗，已捨棄 {size} 筆資料")
+                if self.on_dropped is not None:
+                    self.on_dropped(
+                        {
+                            model: list(buffer.values())
+                            for model, buffer in buffers.items()
+                        }
+                    )
+
+    # 將緩衝轉為 SpoolService.append_batch 的格式，並加入參照的節點
+    def spool_tables(self, buffers: dict) -> dict:
+        node_ids = {
+            row["node_id"] for buffer in buffers.values() for row in buffer.values()
+        }
+        return {
+            Node: [
+                {
+                    "id": node_id,
+                    "id_hex": MeshtasticUtil.convert_node_id_from_int_to_hex(node_id),
+                }
+                for node_id in sorted(node_ids)
+            ],
+            **{model: list(buffer.values()) for model, buffer in buffers.items()},
+        }
+
+    async def copy(self, buffers: dict) -> None:
+        async for session in get_db_connection_async():
+            try:
+                # staging 資料表沒有外鍵，於同一個交易中先確保節點存在，合併時才不會失敗
+                await self.node_registry_service.ensure_nodes(
+                    session,
+                    [
+                        row["node_id"]
+                        for buffer in buffers.values()
+                        for row in buffer.values()
+                    ],
+                )
+                tables = {
+                    model.__tablename__ for model, buffer in buffers.items() if buffer
+                }
+                if session.info.get(NodeRegistryService.PENDING_KEY):
+                    tables.add(Node.__tablename__)
+                await self.durability_service.apply_session(session, tables)
+                # asyncpg 的交易於第一個 SQL 執行時才開始，COPY 不經過 SQLAlchemy，
+                # 節點皆已存在時先執行查詢開始交易，確保 COPY 於同一個交易中寫入
+                await session.execute(text("SELECT 1"))
+                connection = await session.connection()
+                raw_connection = await connection.get_raw_connection()
+                for model, buffer in buffers.items():
+                    if not buffer:
+                        continue
+                    columns = self.columns[model]
+                    await raw_connection.driver_connection.copy_records_to_table(
+                        model.__tablename__ + self.STAGING_SUFFIX,
+                        records=[
+                            tuple(row.get(column) for column in columns)
+                            for row in buffer.values()
+                        ],
+                        columns=columns,
+                    )
+                await session.commit()
+                self.node_registry_service.confirm(session)
+            except Exception as e:
+                await session.rollback()
+                raise e
+            finally:
+                await session.close()
+
+    # 將 staging 資料表合併至正式資料表，每張表一個 INSERT ... SELECT ... ON CONFLICT
+    # 合併失敗時資料仍保留於 staging，於下一次合併時重試
+    async def merge(self) -> None:
+        async with self.merge_lock:
+            started_at = time.monotonic()
+            elapsed = max(started_at - self.merged_at, 1e-6)
+            self.merged_at = started_at
+            for model in self.MODELS:
+                try:
+                    count = await self.merge_table(model)
+                    self.merged[model] += count
+                    self.rates[model] = count / elapsed
+                except Exception as e:
+                    self.logger.error(
+                        f"{inspect.currentframe().f_code.co_name}: "
+                        f"{model.__tablename__}: {e}"
+                    )
+            self.logger.debug(
+                f"已合併 staging 資料，耗時 {time.monotonic() - started_at:.3f} 秒"
+            )
+
+    async def merge_table(self, model) -> int:
+        count = 0
+        async for session in get_db_connection_async():
+            try:
+                result = await session.execute(self.merge_statements[model])
+                await self.durability_service.apply_session(
+                    session, {model.__tablename__}
+                )
+                await session.commit()
+                count = result.rowcount
+            except Exception as e:
+                await session.rollback()
+                raise e
+            finally:
+                await session.close()
+        return count
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self.size,
+            "dropped": self.dropped,
+            "tables": {
+                model.__tablename__: {
+                    "staged": self.staged[model],
+                    "merged": self.merged[model],
+                    "rowsPerSecond": round(self.rates[model], 1),
+                }
+                for model in self.MODELS
+            },
+        }
@@ -0,0 +1,69 @@
+import logging
+import time
+from collections import OrderedDict
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.MqttTopicUtil import MqttTopicUtil
+
+
+class TopicPlannerService:
+    def __init__(self) -> None:
+        self.config = ConfigUtil().read_config()
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        planner_config = self.config.get("ingest", {}).get("topicPlanner", {})
+        self.enabled = bool(planner_config.get("enabled", False))
+        self.window = float(planner_config.get("window", 60))
+        self.max_entries = int(planner_config.get("maxEntries", 100000))
+        # (topic, payload) 雜湊對應到期時間，依收到順序排列以便淘汰
+        self.recent: OrderedDict = OrderedDict()
+        self.filters_removed = 0
+        self.overlapping_pairs = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    # 分析訂閱的主題，移除重複或被其他主題涵蓋的主題
+    def plan(self, name: str, filters: list) -> list:
+        if not self.enabled:
+            return list(filters)
+        kept, removed = MqttTopicUtil.plan_filters(filters)
+        overlapping_pairs = MqttTopicUtil.overlapping_pairs(kept)
+        self.filters_removed += len(filters) - len(kept)
+        self.overlapping_pairs += len(overlapping_pairs)
+        self.logger.info(
+            f"{name}: 訂閱 {len(filters)} 個主題，"
+            f"移除 {len(filters) - len(kept)} 個重複或已涵蓋的主題 {removed}，"
+            f"仍有 {len(overlapping_pairs)} 組主題重疊，重疊的訊息於接收時略過"
+        )
+        return kept
+
+    # 是否為短時間內收到的相同訊息（訂閱重疊或經由多個 broker 收到）
+    def is_repeat(self, topic: str, payload: bytes) -> bool:
+        if not self.enabled:
+            return False
+        self.delivered += 1
+        now = time.monotonic()
+        while self.recent:
+            expire_at = next(iter(self.recent.values()))
+            if expire_at > now:
+                break
+            self.recent.popitem(last=False)
+        key = hash((topic, bytes(payload)))
+        if key in self.recent:
+            self.dropped += 1
+            return True
+        self.recent[key] = now + self.window
+        # 超過上限時淘汰最舊的紀錄
+        while len(self.recent) > self.max_entries:
+            self.recent.popitem(last=False)
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "filtersRemoved": self.filters_removed,
+            "overlappingPairs": self.overlapping_pairs,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "dropRate": (
+                round(self.dropped / self.delivered, 4) if self.delivered else 0
+            ),
+        }
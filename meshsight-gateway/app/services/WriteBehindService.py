@@ -0,0 +1,280 @@
+import asyncio
+import inspect
+import logging
+import time
+from app.configs.Database import get_db_connection_async
+from app.models.NodeModel import Node
+from app.models.NodeNeighborEdgeModel import NodeNeighborEdge
+from app.repositories.IngestRepository import IngestRepository
+from app.services.DurabilityService import DurabilityService
+from app.services.NodeRegistryService import NodeRegistryService
+from app.utils.ConfigUtil import ConfigUtil
+from app.utils.MeshtasticUtil import MeshtasticUtil
+from app.utils.NeighborEdgeUtil import NeighborEdgeUtil
+from app.utils.UpsertUtil import UpsertUtil
+
+
+class WriteBehindService:
+    # 各資料表的衝突鍵，依寫入順序排列（node 必須最先寫入以滿足外鍵）
+    CONFLICT_KEYS = UpsertUtil.CONFLICT_KEYS
+
+    def __init__(
+        self,
+        node_registry_service: NodeRegistryService,
+        durability_service: DurabilityService,
+        ingest_repository: IngestRepository = None,
+    ) -> None:
+        self.config = ConfigUtil().read_config()
+        self.node_registry_service = node_registry_service
+        self.durability_service = durability_service
+        # 以 asyncpg 直接寫入批次（executemany），未啟用時使用 SQLAlchemy session
+        self.ingest_repository = ingest_repository
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(self.config.get("log", {}).get("level", "INFO").upper())
+        write_behind_config = self.config.get("ingest", {}).get("writeBehind", {})
+        self.batch_size = int(write_behind_config.get("batchSize", 500))
+        self.flush_interval = float(write_behind_config.get("flushInterval", 1))
+        self.max_buffer_size = int(write_behind_config.get("maxBufferSize", 10000))
+        self.max_retry_delay = float(write_behind_config.get("maxRetryDelay", 30))
+        self.buffers = {model: {} for model in self.CONFLICT_KEYS}
+        self.neighbor_edges = {}
+        self.size = 0
+        self.dropped = 0
+        # 寫入失敗時改寫入的 SpoolService，未設定時放回緩衝重試
+        self.spool_service = None
+        # 寫入失敗而捨棄資料時呼叫，傳入 {model: [row, ...]}
+        self.on_dropped = None
+        # 寫入失敗後的重試間隔（每次失敗加倍），以及下次可重試的時間
+        self.retry_delay = 0.0
+        self.retry_at = 0.0
+        self.failed = 0
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+
+    # 啟動定時寫入
+    async def start(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_periodically())
+
+    # 停止定時寫入，並將緩衝內容全部寫入
+    async def stop(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush(force=True)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # 加入一筆資料至緩衝
+    async def add(self, entity) -> None:
+        await self.wait_for_space()
+        model = type(entity)
+        row = UpsertUtil.entity_to_row(entity)
+        if model is Node:
+            row.setdefault(
+                "id_hex", MeshtasticUtil.convert_node_id_from_int_to_hex(row["id"])
+            )
+        else:
+            # 確保外鍵參照的 Node 存在
+            for column in model.__table__.columns:
+                if column.name in row and any(
+                    fk.target_fullname == "node.id" for fk in column.foreign_keys
+                ):
+                    self.ensure_node(row[column.name])
+        self.put(model, row)
+        if self.size >= self.batch_size and not self.flush_lock.locked():
+            await self.flush()
+
+    # 以新的鄰居清單取代某節點的 NodeNeighborEdge
+    async def replace_neighbor_edges(
+        self, node_id: int, node_neighbor_edges: list[NodeNeighborEdge]
+    ) -> None:
+        await self.wait_for_space()
+        self.ensure_node(node_id)
+        for node_neighbor_edge in node_neighbor_edges:
+            self.ensure_node(node_neighbor_edge.edge_node_id)
+        previous = self.neighbor_edges.get(node_id)
+        self.size += len(node_neighbor_edges) - (len(previous) if previous else 0)
+        self.neighbor_edges[node_id] = [
+            {
+                "node_id": node_id,
+                "edge_node_id": node_neighbor_edge.edge_node_id,
+                "snr": node_neighbor_edge.snr,
+            }
+            for node_neighbor_edge in node_neighbor_edges
+        ]
+        if self.size >= self.batch_size and not self.flush_lock.locked():
+            await self.flush()
+
+    # 緩衝已滿時，等待寫入完成再繼續（背壓），寫入失敗時等待重試間隔後再寫入
+    async def wait_for_space(self) -> None:
+        while self.size >= self.max_buffer_size:
+            await asyncio.sleep(max(0.0, self.retry_at - time.monotonic()))
+            await self.flush()
+
+    def ensure_node(self, node_id: int) -> None:
+        if (
+            node_id is None
+            or self.node_registry_service.is_known(node_id)
+            or (node_id,) in self.buffers[Node]
+        ):
+            return
+        self.put(
+            Node,
+            {
+                "id": node_id,
+                "id_hex": MeshtasticUtil.convert_node_id_from_int_to_hex(node_id),
+            },
+        )
+
+    def put(self, model, row: dict) -> None:
+        buffer = self.buffers[model]
+        key = tuple(row[k] for k in self.CONFLICT_KEYS[model])
+        existing = buffer.get(key)
+        if existing is None:
+            buffer[key] = row
+            self.size += 1
+            return
+        # 同一衝突鍵合併：較新的非空值優先，較舊的資料補足空值
+        if (
+            "update_at" in row
+            and "update_at" in existing
+            and row["update_at"] < existing["update_at"]
+        ):
+            merged = {**row, **existing}
+        else:
+            merged = {**existing, **row}
+        if "last_heard_at" in row and "last_heard_at" in existing:
+            merged["last_heard_at"] = max(
+                row["last_heard_at"], existing["last_heard_at"]
+            )
+        buffer[key] = merged
+
+    # 將緩衝內容寫入資料庫，每張表一次多筆 upsert
+    # 寫入失敗後的重試間隔內不寫入，停止時（force）不等待
+    async def flush(self, force: bool = False) -> None:
+        async with self.flush_lock:
+            if self.size == 0:
+                return
+            if not force and time.monotonic() < self.retry_at:
+                return
+            buffers, neighbor_edges, size = (
+                self.buffers,
+                self.neighbor_edges,
+                self.size,
+            )
+            self.buffers = {model: {} for model in self.CONFLICT_KEYS}
+            self.neighbor_edges = {}
+            self.size = 0
+            try:
+                await self.write(buffers, neighbor_edges)
+                self.node_registry_service.mark_known(
+                    key[0] for key in buffers[Node]
+                )
+                self.retry_delay = 0.0
+                self.retry_at = 0.0
+                self.logger.debug(f"已批次寫入 {size} 筆資料")
+            except Exception as e:
+                self.failed += 1
+                self.logger.error(f"{inspect.currentframe().f_code.co_name}: {e}")
+                if self.spool_service is not None:
+                    # 改寫入 spool，待資料庫恢復後重新寫入
+                    if self.spool_service.is_unavailable_error(e):
+                        self.spool_service.mark_unavailable(e)
+                    self.spool_service.append_batch(
+                        {
+                            model: list(buffer.values())
+                            for model, buffer in buffers.items()
+                        },
+                        neighbor_edges,
+                    )
+                    return
+                self.restore(buffers, neighbor_edges, size)
+
+    # 將寫入失敗的批次放回緩衝，等待重試間隔後再寫入
+    # 放回後超過 maxBufferSize 時捨棄此批次
+    def restore(self, buffers: dict, neighbor_edges: dict, size: int) -> None:
+        self.retry_delay = min(
+            self.max_retry_delay, max(self.flush_interval, self.retry_delay * 2)
+        )
+        self.retry_at = time.monotonic() + self.retry_delay
+        if self.size and self.size + size > self.max_buffer_size:
+            self.dropped += size
+            self.logger.error(f"批次寫入失敗且緩衝已滿，已捨棄 {size} 筆資料")
+            if self.on_dropped is not None:
+                self.on_dropped(
+                    {model: list(buffer.values()) for model, buffer in buffers.items()}
+                )
+            return
+        for model, buffer in buffers.items():
+            current = self.buffers[model]
+            for key, row in buffer.items():
+                existing = current.get(key)
+                if existing is None:
+                    current[key] = row
+                    self.size += 1
+                else:
+                    # 失敗批次之後加入的資料較新，只補足空值
+                    current[key] = {**row, **existing}
+        for node_id, edges in neighbor_edges.items():
+            if node_id not in self.neighbor_edges:
+                self.neighbor_edges[node_id] = edges
+                self.size += len(edges)
+        self.logger.error(
+            f"批次寫入失敗，{size} 筆資料已放回緩衝，{self.retry_delay} 秒後重試"
+        )
+
+    async def write(self, buffers: dict, neighbor_edges: dict) -> None:
+        if self.ingest_repository is not None:
+            await self.write_native(buffers, neighbor_edges)
+            return
+        async for session in get_db_connection_async():
+            try:
+                for model, buffer in buffers.items():
+                    if buffer:
+                        await UpsertUtil.upsert_rows(
+                            session, model, list(buffer.values())
+                        )
+                if neighbor_edges:
+                    # 與現有資料比對，只寫入有差異的鄰居
+                    await NeighborEdgeUtil.sync_edges(session, neighbor_edges)
+                tables = {
+                    model.__tablename__ for model, buffer in buffers.items() if buffer
+                }
+                if neighbor_edges:
+                    tables.add(NodeNeighborEdge.__tablename__)
+                await self.durability_service.apply_session(session, tables)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise e
+            finally:
+                await session.close()
+
+    # 以 IngestRepository 在同一個交易中寫入，每種欄位組合一次 executemany
+    async def write_native(self, buffers: dict, neighbor_edges: dict) -> None:
+        async with self.ingest_repository.transaction() as connection:
+            for model, buffer in buffers.items():
+                if buffer:
+                    await self.ingest_repository.upsert_rows(
+                        connection, model, list(buffer.values())
+                    )
+            if neighbor_edges:
+                await self.ingest_repository.sync_neighbor_edges(
+                    connection, neighbor_edges
+                )
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self.size,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "retryDelay": self.retry_delay,
+        }
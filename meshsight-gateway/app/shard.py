@@ -0,0 +1,37 @@
+import asyncio
+import logging
+import signal
+from app.services.MqttListenerService import MqttListenerService
+from app.utils.ConfigUtil import ConfigUtil
+
+# 設定檔讀取
+config = ConfigUtil().read_config()
+
+logger = logging.getLogger(__name__)
+logger.setLevel(config.get("log", {}).get("level", "INFO").upper())
+
+
+# 接收 process 的進入點，由 IngestShardService 以 spawn 啟動
+def run_shard(shard: int, shards: int):
+    # spawn 啟動的 process 不會繼承主 process 的日誌設定
+    logging.basicConfig(
+        level=config.get("log", {}).get("level", "INFO").upper(),
+        format=f"%(asctime)s - shard-{shard} - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler()],
+    )
+    try:
+        asyncio.run(shard_main(shard, shards))
+    except KeyboardInterrupt:
+        pass
+
+
+async def shard_main(shard: int, shards: int):
+    # 收到 SIGTERM 時取消主任務，讓子服務有機會完成收尾（例如寫入緩衝資料）
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
+    logger.info(f"接收 process {shard + 1}/{shards} 正在啟動...")
+    try:
+        await MqttListenerService(shard=shard, shards=shards).start()
+    except asyncio.CancelledError:
+        logger.info(f"接收 process {shard + 1}/{shards} 已停止")
@@ -0,0 +1,237 @@
+import base64
+import json
+import logging
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from meshtastic.protobuf import mesh_pb2, mqtt_pb2, portnums_pb2
+except ImportError:
+    from meshtastic import mesh_pb2, mqtt_pb2, portnums_pb2
+
+from app.schemas.packet.PacketSchema import (
+    MapReportRecord,
+    NeighborInfoRecord,
+    NodeInfoRecord,
+    PacketRecord,
+    PositionRecord,
+    TelemetryRecord,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MeshtasticDecodeUtil:
+    # 預設頻道的公開金鑰（aka AQ==），找不到頻道金鑰時使用
+    PUBLIC_KEY = "1PG7OiApB1nwvP+rz05pAQ=="
+    PUBLIC_KEY_BYTES = base64.b64decode(PUBLIC_KEY)
+    # decode_mesh_packet 的解密結果
+    DECRYPT_OK = "ok"
+    DECRYPT_FAILED = "failed"
+    DECRYPT_SKIPPED = "skipped"
+    DECRYPT_NO_KEY = "nokey"
+
+    # 各 portnum 對應的紀錄類別，未列出的 portnum 不解析 payload
+    PORT_RECORDS = {
+        portnums_pb2.MAP_REPORT_APP: MapReportRecord,
+        portnums_pb2.NEIGHBORINFO_APP: NeighborInfoRecord,
+        portnums_pb2.NODEINFO_APP: NodeInfoRecord,
+        portnums_pb2.POSITION_APP: PositionRecord,
+        portnums_pb2.TELEMETRY_APP: TelemetryRecord,
+    }
+
+    # enum 數值轉名稱，未知的數值保留原數值
+    def enum_name(field, value: int):
+        enum_value = field.enum_type.values_by_number.get(value)
+        return enum_value.name if enum_value is not None else value
+
+    # 依 portnum 將 Data.payload 直接解析為紀錄（只含已設定的欄位、enum 轉為名稱、
+    # NaN 視為未設定），不經過 dict；未支援的 portnum 回傳 None
+    def decode_port_record(portnum: int, payload: bytes):
+        record_class = MeshtasticDecodeUtil.PORT_RECORDS.get(portnum)
+        if record_class is None:
+            return None
+        return record_class.from_payload_bytes(payload)
+
+    # 解析 /2/json/ 主題的 JSON 內容，優先使用 orjson
+    def loads_json(payload: bytes) -> dict:
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(payload.decode("utf-8"))
+
+    # 將 /2/json/ 的 nodeinfo 轉為與 mesh_pb2.User 相同欄位名稱的 payload
+    # 資料範例: {'hardware': 255, 'id': '!b1231321', 'longname': 'Mydevuce', 'role': 0, 'shortname': 'devs'}
+    def json_nodeinfo_to_payload(payload: dict) -> dict:
+        fields = mesh_pb2.User.DESCRIPTOR.fields_by_name
+        data = {}
+        if payload.get("id"):
+            data["id"] = payload.get("id")
+        # long_name、short_name 解析 emoji 會有問題，因此不使用
+        if payload.get("hardware"):
+            data["hw_model"] = MeshtasticDecodeUtil.enum_name(
+                fields["hw_model"], payload.get("hardware")
+            )
+        if payload.get("role"):
+            data["role"] = MeshtasticDecodeUtil.enum_name(
+                fields["role"], payload.get("role")
+            )
+        return data
+
+    # 解析 ServiceEnvelope，解析失敗時回傳空的 MeshPacket
+    def parse_envelope(payload: bytes):
+        try:
+            se = mqtt_pb2.ServiceEnvelope()
+            se.ParseFromString(payload)
+            return se.packet
+        except Exception as _:
+            return mesh_pb2.MeshPacket()
+
+    # 將 meshtastic.channels 設定轉為以頻道名稱與頻道雜湊查詢的金鑰，無法解析的金鑰略過
+    # by_name: {頻道名稱: 金鑰 bytes}，by_hash: {頻道雜湊: [金鑰 bytes, ...]}
+    def compile_channel_keys(key_list: list) -> dict:
+        channel_keys = {"by_name": {}, "by_hash": {}}
+        for item in key_list or []:
+            try:
+                key_bytes = base64.b64decode(item["key"].encode("ascii"))
+            except Exception as e:
+                logger.error(f"無法解析頻道 '{item.get('name')}' 的金鑰: {e}")
+                continue
+            channel_keys["by_name"][item["name"]] = key_bytes
+            keys = channel_keys["by_hash"].setdefault(
+                MeshtasticDecodeUtil.channel_hash(item["name"], key_bytes), []
+            )
+            if key_bytes not in keys:
+                keys.append(key_bytes)
+        return channel_keys
+
+    # 頻道雜湊，與韌體相同: 頻道名稱與金鑰各自逐位元組 XOR 後再 XOR
+    # 加密封包的 MeshPacket.channel 即為此值
+    def channel_hash(name: str, key_bytes: bytes) -> int:
+        value = 0
+        for b in name.encode("utf-8") + key_bytes:
+            value ^= b
+        return value
+
+    # 依頻道雜湊找出可能的金鑰，沒有任何金鑰符合時回傳空 list
+    # topic 的頻道名稱優先（未設定時使用公開金鑰），其次為其他雜湊相同的頻道金鑰
+    def candidate_keys(channel: str, hash_value: int, channel_keys: dict) -> list:
+        candidates = []
+        key_bytes = channel_keys["by_name"].get(
+            channel, MeshtasticDecodeUtil.PUBLIC_KEY_BYTES
+        )
+        if MeshtasticDecodeUtil.channel_hash(channel, key_bytes) == hash_value:
+            candidates.append(key_bytes)
+        for key_bytes in channel_keys["by_hash"].get(hash_value, ()):
+            if key_bytes not in candidates:
+                candidates.append(key_bytes)
+        return candidates
+
+    # 解析 topic 獲取 channel，例如 msh/TW/2/e/LongFast/!abcd1234 為 LongFast
+    def topic_channel(topic: str) -> str:
+        return topic.split("/")[-2]
+
+    # PKI 為點對點加密，無法解密，可在解析 protobuf 之前略過
+    def is_pki_topic(topic: str) -> bool:
+        return "/2/e/" in topic and MeshtasticDecodeUtil.topic_channel(topic) == "PKI"
+
+    def is_encrypted(mp) -> bool:
+        return mp.HasField("encrypted") and not mp.HasField("decoded")
+
+    # 將 MeshPacket 轉為 PacketRecord，加密封包會先解密
+    # 回傳 (紀錄, 解密結果, 金鑰)，解密結果為 None（未加密）或 DECRYPT_* 其中之一；
+    # 金鑰為 (頻道名稱, 頻道雜湊)，同一組金鑰候選的識別，未加密時為 None；
+    # 無法解密或已略過時紀錄為 None。skip_keys 中的金鑰不嘗試解密
+    def decode_mesh_packet(
+        topic: str, mp, channel_keys: dict, skip_keys=frozenset()
+    ) -> tuple:
+        decrypt_result = None
+        key = None
+        # 檢查是否為加密封包
+        if MeshtasticDecodeUtil.is_encrypted(mp):
+            channel = MeshtasticDecodeUtil.topic_channel(topic)
+            key = (channel, mp.channel)
+            if key in skip_keys:
+                return None, MeshtasticDecodeUtil.DECRYPT_SKIPPED, key
+            # 以頻道雜湊篩選金鑰，沒有符合的金鑰時不需嘗試解密
+            key_list = MeshtasticDecodeUtil.candidate_keys(
+                channel, mp.channel, channel_keys
+            )
+            if not key_list:
+                return None, MeshtasticDecodeUtil.DECRYPT_NO_KEY, key
+            mp = MeshtasticDecodeUtil.decode_encrypted(topic, mp, key_list)
+            if mp is None:
+                return None, MeshtasticDecodeUtil.DECRYPT_FAILED, key
+            decrypt_result = MeshtasticDecodeUtil.DECRYPT_OK
+        # meshtastic protobuf 定義 https://github.com/meshtastic/protobufs
+        # 未支援的 portnum 不解析 payload
+        record = MeshtasticDecodeUtil.decode_port_record(
+            mp.decoded.portnum, mp.decoded.payload
+        )
+        if record is None:
+            record = PacketRecord(type=f"unknown({mp.decoded.portnum})")
+        record.id = getattr(mp, "id")
+        record.channel = getattr(mp, "channel")
+        record.from_id = getattr(mp, "from")
+        record.to = getattr(mp, "to")
+        record.portnum = mp.decoded.portnum
+        record.timestamp = mp.rx_time
+        record.topic = topic
+        return record, decrypt_result, key
+
+    # 依序以 key_list 中的金鑰（candidate_keys 的結果）嘗試解密，回傳第一個成功的結果
+    def decode_encrypted(topic: str, mp, key_list: list):
+        # 如果 channel 為 PKI，則不進行解密，因為是點對點加密
+        if MeshtasticDecodeUtil.topic_channel(topic) == "PKI":
+            return None
+        for key_bytes in key_list:
+            try:
+                # 隨機數
+                nonce_packet_id = getattr(mp, "id").to_bytes(8, "little")
+                nonce_from_node = getattr(mp, "from").to_bytes(8, "little")
+                nonce = nonce_packet_id + nonce_from_node
+
+                # 建立解密器
+                cipher = Cipher(
+                    algorithms.AES(key_bytes),
+                    modes.CTR(nonce),
+                    backend=default_backend(),
+                )
+                decryptor = cipher.decryptor()
+                decrypted_bytes = (
+                    decryptor.update(getattr(mp, "encrypted")) + decryptor.finalize()
+                )
+
+                data = mesh_pb2.Data()
+                data.ParseFromString(decrypted_bytes)
+                mp.decoded.CopyFrom(data)
+                # 回傳解密後的封包
+                return mp
+            except Exception as e:
+                logger.debug(f"解密失敗: {e}")
+        return None
+
+    # 批次解析 (topic, ServiceEnvelope payload)，供 process pool 在子 process 中執行
+    # 回傳 decode_mesh_packet 的結果，避免在 process 間傳遞 protobuf 物件
+    def decode_envelope_batch(
+        batch: list, channel_keys: dict, skip_keys=frozenset()
+    ) -> list:
+        results = []
+        for topic, payload in batch:
+            try:
+                results.append(
+                    MeshtasticDecodeUtil.decode_mesh_packet(
+                        topic,
+                        MeshtasticDecodeUtil.parse_envelope(payload),
+                        channel_keys,
+                        skip_keys,
+                    )
+                )
+            except Exception as e:
+                logger.debug(f"解析失敗: {e}")
+                results.append((None, None, None))
+        return results
@@ -0,0 +1,91 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MqttTopicUtil:
+
+    # topic_filter 是否涵蓋 other，即 other 能收到的主題 topic_filter 都能收到
+    def covers(topic_filter: str, other: str) -> bool:
+        levels = topic_filter.split("/")
+        other_levels = other.split("/")
+        for i, level in enumerate(levels):
+            # "#" 同時符合上一層，例如 msh/# 也符合 msh
+            if level == "#":
+                return True
+            if i >= len(other_levels) or other_levels[i] == "#":
+                return False
+            if level == "+":
+                continue
+            if other_levels[i] == "+" or level != other_levels[i]:
+                return False
+        return len(levels) == len(other_levels)
+
+    # 兩個 filter 是否可能收到相同的主題
+    def overlaps(topic_filter: str, other: str) -> bool:
+        levels = topic_filter.split("/")
+        other_levels = other.split("/")
+        for i in range(max(len(levels), len(other_levels))):
+            level = levels[i] if i < len(levels) else None
+            other_level = other_levels[i] if i < len(other_levels) else None
+            if level == "#" or other_level == "#":
+                return True
+            if level is None or other_level is None:
+                return False
+            if level != "+" and other_level != "+" and level != other_level:
+                return False
+        return True
+
+    # 移除重複或被其他 filter 涵蓋的 filter，保留原本的順序
+    # 回傳 (保留的 filter, {移除的 filter: 涵蓋它的 filter})
+    def plan_filters(filters: list) -> tuple:
+        unique = list(dict.fromkeys(filters))
+        kept = [
+            topic_filter
+            for topic_filter in unique
+            if not any(
+                other != topic_filter and MqttTopicUtil.covers(other, topic_filter)
+                for other in unique
+            )
+        ]
+        removed = {
+            topic_filter: next(
+                other for other in kept if MqttTopicUtil.covers(other, topic_filter)
+            )
+            for topic_filter in unique
+            if topic_filter not in kept
+        }
+        return kept, removed
+
+    # 仍會重疊（無法合併）的 filter 組合
+    def overlapping_pairs(filters: list) -> list:
+        return [
+            (topic_filter, other)
+            for i, topic_filter in enumerate(filters)
+            for other in filters[i + 1 :]
+            if MqttTopicUtil.overlaps(topic_filter, other)
+        ]
+
+    # 將 filter 分配為 count 組，互相重疊的 filter 分在同一組，
+    # 讓同一個主題的訊息只會由一組收到；各組依 filter 數量平均分配
+    def partition_filters(filters: list, count: int) -> list:
+        groups = []
+        for topic_filter in filters:
+            overlapping = [
+                group
+                for group in groups
+                if any(MqttTopicUtil.overlaps(topic_filter, other) for other in group)
+            ]
+            merged = [topic_filter]
+            for group in overlapping:
+                groups.remove(group)
+                merged = group + merged
+            groups.append(merged)
+        partitions = [[] for _ in range(max(1, count))]
+        for group in sorted(groups, key=len, reverse=True):
+            min(partitions, key=len).extend(group)
+        return [sorted(partition, key=filters.index) for partition in partitions]
+
+    # MQTT v5 共享訂閱的 filter，broker 將訊息分配給群組中的其中一個連線
+    def shared_filter(group: str, topic_filter: str) -> str:
+        return f"$share/{group}/{topic_filter}"
@@ -0,0 +1,83 @@
+import logging
+from app.models.NodeNeighborEdgeModel import NodeNeighborEdge
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+
+class NeighborEdgeUtil:
+    # 比對資料庫中現有的鄰居與新的鄰居清單
+    # existing: [(uuid, edge_node_id, snr), ...]，edges: [{"edge_node_id", "snr"}, ...]
+    # 回傳 (新增的 edges, 需更新 snr 的 [(uuid, snr), ...], 需刪除的 uuid)
+    def diff_edges(existing: list, edges: list[dict]) -> tuple:
+        # 同一個鄰居重複出現時以最後一筆為準
+        wanted = {edge["edge_node_id"]: edge for edge in edges}
+        inserts = []
+        updates = []
+        deletes = []
+        kept = set()
+        for edge_uuid, edge_node_id, snr in existing:
+            edge = wanted.get(edge_node_id)
+            if edge is None or edge_node_id in kept:
+                # 已不存在的鄰居，或資料庫中重複的資料
+                deletes.append(edge_uuid)
+                continue
+            kept.add(edge_node_id)
+            if edge.get("snr") != snr:
+                updates.append((edge_uuid, edge.get("snr")))
+        for edge_node_id, edge in wanted.items():
+            if edge_node_id not in kept:
+                inserts.append(edge)
+        return inserts, updates, deletes
+
+    # 以新的鄰居清單更新多個節點的 NodeNeighborEdge，只寫入有差異的資料
+    # neighbor_edges: {node_id: [{"node_id", "edge_node_id", "snr"}, ...]}
+    # 不會 commit，由呼叫端於同一個 transaction 中完成
+    async def sync_edges(session: AsyncSession, neighbor_edges: dict) -> dict:
+        table = NodeNeighborEdge.__table__
+        existing = {node_id: [] for node_id in neighbor_edges}
+        result = await session.execute(
+            select(table.c.node_id, table.c.uuid, table.c.edge_node_id, table.c.snr)
+            .where(table.c.node_id.in_(list(neighbor_edges.keys())))
+            .order_by(table.c.node_id, table.c.uuid)
+        )
+        for node_id, edge_uuid, edge_node_id, snr in result:
+            existing[node_id].append((edge_uuid, edge_node_id, snr))
+        inserts = []
+        updates = []
+        deletes = []
+        for node_id, edges in neighbor_edges.items():
+            node_inserts, node_updates, node_deletes = NeighborEdgeUtil.diff_edges(
+                existing[node_id], edges
+            )
+            inserts += [
+                {
+                    "node_id": node_id,
+                    "edge_node_id": edge["edge_node_id"],
+                    "snr": edge.get("snr"),
+                }
+                for edge in node_inserts
+            ]
+            updates += [
+                {"edge_uuid": edge_uuid, "edge_snr": snr}
+                for edge_uuid, snr in node_updates
+            ]
+            deletes += node_deletes
+        if deletes:
+            await session.execute(delete(table).where(table.c.uuid.in_(deletes)))
+        if updates:
+            await session.execute(
+                update(table)
+                .where(table.c.uuid == bindparam("edge_uuid"))
+                .values(snr=bindparam("edge_snr")),
+                updates,
+            )
+        if inserts:
+            # uuid 只有 Python 端的預設值，多筆新增時需以 executemany 逐筆產生
+            await session.execute(insert(table), inserts)
+        return {
+            "inserted": len(inserts),
+            "updated": len(updates),
+            "deleted": len(deletes),
+        }
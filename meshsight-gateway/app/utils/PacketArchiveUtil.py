@@ -0,0 +1,146 @@
+import bisect
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class PacketArchiveUtil:
+    # segment 檔案由多個區塊組成，每個區塊為 BLOCK_HEADER + zlib 壓縮的多筆紀錄
+    # 紀錄為 RECORD_HEADER + broker + topic + payload
+    # 每個 segment 另有同名的索引檔，每個區塊一筆 INDEX_ENTRY，用於依時間範圍查詢
+    SEGMENT_SUFFIX = ".seg"
+    INDEX_SUFFIX = ".idx"
+    # 收到時間 (unix timestamp)、broker 長度、topic 長度、payload 長度
+    RECORD_HEADER = struct.Struct("<dHHI")
+    # 壓縮後長度、紀錄筆數、第一筆與最後一筆的收到時間
+    BLOCK_HEADER = struct.Struct("<IIdd")
+    # 第一筆與最後一筆的收到時間、區塊在 segment 中的位置
+    INDEX_ENTRY = struct.Struct("<ddQ")
+
+    def encode_record(
+        received_at: float, broker: str, topic: str, payload: bytes
+    ) -> bytes:
+        broker_bytes = broker.encode("utf-8")
+        topic_bytes = topic.encode("utf-8")
+        payload = bytes(payload)
+        return (
+            PacketArchiveUtil.RECORD_HEADER.pack(
+                received_at, len(broker_bytes), len(topic_bytes), len(payload)
+            )
+            + broker_bytes
+            + topic_bytes
+            + payload
+        )
+
+    # 解析區塊解壓縮後的內容，依序回傳 (received_at, broker, topic, payload)
+    def decode_records(data: bytes):
+        header_size = PacketArchiveUtil.RECORD_HEADER.size
+        offset = 0
+        while offset + header_size <= len(data):
+            received_at, broker_length, topic_length, payload_length = (
+                PacketArchiveUtil.RECORD_HEADER.unpack_from(data, offset)
+            )
+            offset += header_size
+            broker = data[offset : offset + broker_length].decode("utf-8")
+            offset += broker_length
+            topic = data[offset : offset + topic_length].decode("utf-8")
+            offset += topic_length
+            payload = data[offset : offset + payload_length]
+            offset += payload_length
+            yield received_at, broker, topic, payload
+
+    def encode_block(
+        data: bytes, count: int, first_at: float, last_at: float, level: int
+    ) -> bytes:
+        compressed = zlib.compress(data, level)
+        header = PacketArchiveUtil.BLOCK_HEADER.pack(
+            len(compressed), count, first_at, last_at
+        )
+        return header + compressed
+
+    def index_path(segment_path: str) -> str:
+        return segment_path[: -len(PacketArchiveUtil.SEGMENT_SUFFIX)] + (
+            PacketArchiveUtil.INDEX_SUFFIX
+        )
+
+    # 依檔名（建立時間）排序的 segment 檔案
+    def list_segments(path: str) -> list:
+        if not os.path.isdir(path):
+            return []
+        return [
+            os.path.join(path, name)
+            for name in sorted(os.listdir(path))
+            if name.endswith(PacketArchiveUtil.SEGMENT_SUFFIX)
+        ]
+
+    # 讀取 segment 索引，回傳 [(first_at, last_at, offset), ...]
+    # 索引檔不存在或少於實際區塊（例如寫入中斷）時，由區塊標頭補齊
+    def read_index(segment_path: str, mm) -> list:
+        entry_size = PacketArchiveUtil.INDEX_ENTRY.size
+        header_size = PacketArchiveUtil.BLOCK_HEADER.size
+        entries = []
+        try:
+            with open(PacketArchiveUtil.index_path(segment_path), "rb") as file:
+                data = file.read()
+            entries = [
+                PacketArchiveUtil.INDEX_ENTRY.unpack_from(data, offset)
+                for offset in range(0, len(data) - entry_size + 1, entry_size)
+            ]
+        except FileNotFoundError:
+            pass
+        offset = 0
+        if entries:
+            offset = entries[-1][2]
+            offset += header_size + PacketArchiveUtil.BLOCK_HEADER.unpack_from(
+                mm, offset
+            )[0]
+        while offset + header_size <= len(mm):
+            length, _, first_at, last_at = PacketArchiveUtil.BLOCK_HEADER.unpack_from(
+                mm, offset
+            )
+            if offset + header_size + length > len(mm):
+                break
+            entries.append((first_at, last_at, offset))
+            offset += header_size + length
+        return entries
+
+    # 以 mmap 讀取 segment，依序回傳時間範圍內的 (received_at, broker, topic, payload)
+    def read_segment(segment_path: str, start: float = None, end: float = None):
+        with open(segment_path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                entries = PacketArchiveUtil.read_index(segment_path, mm)
+                # 區塊依時間寫入，以最後一筆時間二分搜尋第一個可能符合的區塊
+                first = (
+                    bisect.bisect_left([entry[1] for entry in entries], start)
+                    if start is not None
+                    else 0
+                )
+                header_size = PacketArchiveUtil.BLOCK_HEADER.size
+                for first_at, _, offset in entries[first:]:
+                    if end is not None and first_at > end:
+                        break
+                    length = PacketArchiveUtil.BLOCK_HEADER.unpack_from(mm, offset)[0]
+                    if offset + header_size + length > len(mm):
+                        # 最後一個區塊未寫入完整
+                        logger.error(f"{segment_path} 的區塊不完整: {offset}")
+                        break
+                    data = zlib.decompress(
+                        mm[offset + header_size : offset + header_size + length]
+                    )
+                    for record in PacketArchiveUtil.decode_records(data):
+                        if start is not None and record[0] < start:
+                            continue
+                        if end is not None and record[0] > end:
+                            return
+                        yield record
+
+    # 依序讀取目錄中所有 segment 在時間範圍內的紀錄
+    def read_archive(path: str, start: float = None, end: float = None):
+        for segment_path in PacketArchiveUtil.list_segments(path):
+            yield from PacketArchiveUtil.read_segment(segment_path, start, end)
@@ -0,0 +1,168 @@
+import ipaddress
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+
+class PcapUtil:
+    # libpcap 檔案的 magic number，對應 (位元組順序, 時間單位)
+    MAGIC_NUMBERS = {
+        b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+        b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+        b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+        b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+    }
+    LINKTYPE_ETHERNET = 1
+    LINKTYPE_RAW = 101
+    LINKTYPE_LINUX_SLL = 113
+    LINKTYPE_IPV4 = 228
+    LINKTYPE_IPV6 = 229
+    MQTT_PUBLISH = 3
+
+    # 讀取 pcap 中的 MQTT PUBLISH，依序回傳 (received_at, broker, topic, payload)
+    # 只支援 MQTT 3.1.1 與未加密的 TCP 連線，broker 為 port 符合的一端
+    def read_mqtt_publishes(path: str, port: int = 1883):
+        # 每個 TCP 單向連線的下一個序號與尚未解析的資料
+        streams = {}
+        for received_at, linktype, frame in PcapUtil.read_frames(path):
+            segment = PcapUtil.parse_tcp(linktype, frame)
+            if segment is None:
+                continue
+            src, sport, dst, dport, seq, data = segment
+            if port not in (sport, dport) or not data:
+                continue
+            key = (src, sport, dst, dport)
+            stream = streams.get(key)
+            delta = (
+                PcapUtil.seq_delta(seq, stream["next_seq"])
+                if stream is not None
+                else None
+            )
+            if stream is None or delta > 0:
+                # 新連線或遺失封包，從此處重新開始解析
+                if stream is not None:
+                    logger.debug(f"{key} 遺失 TCP 資料，重新同步")
+                stream = {"next_seq": seq, "buffer": bytearray()}
+                streams[key] = stream
+            elif delta < 0:
+                # 重送的封包，只取尚未收到的部分
+                data = data[-delta:]
+                if not data:
+                    continue
+                seq = stream["next_seq"]
+            stream["next_seq"] = (seq + len(data)) & 0xFFFFFFFF
+            stream["buffer"] += data
+            broker = f"{src}:{sport}" if sport == port else f"{dst}:{dport}"
+            for topic, payload in PcapUtil.parse_mqtt_publishes(stream["buffer"]):
+                yield received_at, broker, topic, payload
+
+    # TCP 序號的差（seq - next_seq），以 32 位元循環計算，序號溢位後仍能正確比較
+    def seq_delta(seq: int, next_seq: int) -> int:
+        delta = (seq - next_seq) & 0xFFFFFFFF
+        return delta - 0x100000000 if delta >= 0x80000000 else delta
+
+    # 依序回傳 pcap 中的 (時間, linktype, frame)
+    def read_frames(path: str):
+        with open(path, "rb") as file:
+            header = file.read(24)
+            if len(header) < 24 or header[:4] not in PcapUtil.MAGIC_NUMBERS:
+                raise ValueError(f"不支援的 pcap 檔案格式: {path}")
+            endian, unit = PcapUtil.MAGIC_NUMBERS[header[:4]]
+            linktype = struct.unpack(endian + "I", header[20:24])[0]
+            record_header = struct.Struct(endian + "IIII")
+            while True:
+                data = file.read(record_header.size)
+                if len(data) < record_header.size:
+                    return
+                seconds, fraction, captured_length, _ = record_header.unpack(data)
+                frame = file.read(captured_length)
+                if len(frame) < captured_length:
+                    return
+                yield seconds + fraction * unit, linktype, frame
+
+    # 解析 frame 中的 IPv4/IPv6 TCP 區段，回傳 (src, sport, dst, dport, seq, data)
+    def parse_tcp(linktype: int, frame: bytes):
+        if linktype == PcapUtil.LINKTYPE_ETHERNET:
+            ethertype = struct.unpack_from("!H", frame, 12)[0]
+            offset = 14
+            # VLAN 標籤
+            while ethertype in (0x8100, 0x88A8) and len(frame) >= offset + 4:
+                ethertype = struct.unpack_from("!H", frame, offset + 2)[0]
+                offset += 4
+        elif linktype == PcapUtil.LINKTYPE_LINUX_SLL:
+            ethertype = struct.unpack_from("!H", frame, 14)[0]
+            offset = 16
+        elif linktype in (
+            PcapUtil.LINKTYPE_RAW,
+            PcapUtil.LINKTYPE_IPV4,
+            PcapUtil.LINKTYPE_IPV6,
+        ):
+            ethertype = 0x0800 if frame and frame[0] >> 4 == 4 else 0x86DD
+            offset = 0
+        else:
+            return None
+        if ethertype == 0x0800:
+            if len(frame) < offset + 20:
+                return None
+            header_length = (frame[offset] & 0x0F) * 4
+            total_length = struct.unpack_from("!H", frame, offset + 2)[0]
+            if frame[offset + 9] != 6:
+                return None
+            src = ipaddress.IPv4Address(frame[offset + 12 : offset + 16])
+            dst = ipaddress.IPv4Address(frame[offset + 16 : offset + 20])
+            end = offset + total_length
+            offset += header_length
+        elif ethertype == 0x86DD:
+            if len(frame) < offset + 40:
+                return None
+            # 不處理 IPv6 擴充標頭
+            if frame[offset + 6] != 6:
+                return None
+            payload_length = struct.unpack_from("!H", frame, offset + 4)[0]
+            src = ipaddress.IPv6Address(frame[offset + 8 : offset + 24])
+            dst = ipaddress.IPv6Address(frame[offset + 24 : offset + 40])
+            end = offset + 40 + payload_length
+            offset += 40
+        else:
+            return None
+        if len(frame) < offset + 20:
+            return None
+        sport, dport, seq = struct.unpack_from("!HHI", frame, offset)
+        data_offset = (frame[offset + 12] >> 4) * 4
+        return str(src), sport, str(dst), dport, seq, frame[offset + data_offset : end]
+
+    # 由緩衝中取出完整的 MQTT 封包，回傳 PUBLISH 的 (topic, payload)，並移除已解析的資料
+    def parse_mqtt_publishes(buffer: bytearray):
+        offset = 0
+        while offset + 2 <= len(buffer):
+            packet_type = buffer[offset] >> 4
+            qos = (buffer[offset] >> 1) & 0x03
+            # remaining length 為 1 至 4 個位元組的可變長度整數
+            remaining_length = 0
+            position = offset + 1
+            for shift in range(0, 28, 7):
+                if position >= len(buffer):
+                    remaining_length = None
+                    break
+                byte = buffer[position]
+                position += 1
+                remaining_length |= (byte & 0x7F) << shift
+                if not byte & 0x80:
+                    break
+            else:
+                # 超過 4 個位元組，格式錯誤，捨棄緩衝
+                del buffer[:]
+                return
+            if remaining_length is None or position + remaining_length > len(buffer):
+                # 封包尚未完整
+                break
+            body = bytes(buffer[position : position + remaining_length])
+            offset = position + remaining_length
+            if packet_type != PcapUtil.MQTT_PUBLISH or len(body) < 2:
+                continue
+            topic_length = struct.unpack_from("!H", body, 0)[0]
+            topic = body[2 : 2 + topic_length].decode("utf-8", errors="replace")
+            payload_offset = 2 + topic_length + (2 if qos else 0)
+            yield topic, body[payload_offset:]
+        del buffer[:offset]
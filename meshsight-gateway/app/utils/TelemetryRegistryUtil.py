@@ -0,0 +1,135 @@
+import logging
+import math
+from app.models.NodeTelemetryAirQualityModel import NodeTelemetryAirQuality
+from app.models.NodeTelemetryDeviceModel import NodeTelemetryDevice
+from app.models.NodeTelemetryEnvironmentModel import NodeTelemetryEnvironment
+from app.models.NodeTelemetryHealthModel import NodeTelemetryHealth
+from app.models.NodeTelemetryLocalStatsModel import NodeTelemetryLocalStats
+from app.models.NodeTelemetryPowerModel import NodeTelemetryPower
+from app.schemas.packet.PacketSchema import TelemetryRecord
+
+logger = logging.getLogger(__name__)
+
+
+class TelemetryRegistryUtil:
+    # Telemetry oneof variant 對應的資料表與欄位，欄位名稱與 protobuf 欄位名稱相同，
+    # 名稱不同時（例如大小寫）以 (欄位名稱, protobuf 欄位名稱) 表示
+    # 新增 variant 時只需建立資料表與 model，並於此登錄
+    # 其他 variant（例如 host_metrics）尚未建立資料表，只計入 unregisteredTelemetry
+    REGISTRY = {
+        "air_quality_metrics": (
+            NodeTelemetryAirQuality,
+            [
+                "pm10_standard",
+                "pm25_standard",
+                "pm100_standard",
+                "pm10_environmental",
+                "pm25_environmental",
+                "pm100_environmental",
+                "particles_03um",
+                "particles_05um",
+                "particles_10um",
+                "particles_25um",
+                "particles_50um",
+                "particles_100um",
+            ],
+        ),
+        "device_metrics": (
+            NodeTelemetryDevice,
+            [
+                "battery_level",
+                "voltage",
+                "channel_utilization",
+                "air_util_tx",
+                "uptime_seconds",
+            ],
+        ),
+        "environment_metrics": (
+            NodeTelemetryEnvironment,
+            [
+                "temperature",
+                "relative_humidity",
+                "barometric_pressure",
+                "gas_resistance",
+                "voltage",
+                "current",
+                "iaq",
+                "distance",
+                "lux",
+                "white_lux",
+                "ir_lux",
+                "uv_lux",
+                "wind_direction",
+                "wind_speed",
+                "weight",
+                "wind_gust",
+                "wind_lull",
+            ],
+        ),
+        "health_metrics": (
+            NodeTelemetryHealth,
+            [
+                "heart_bpm",
+                ("spo2", "spO2"),
+                "temperature",
+            ],
+        ),
+        "local_stats": (
+            NodeTelemetryLocalStats,
+            [
+                "uptime_seconds",
+                "channel_utilization",
+                "air_util_tx",
+                "num_packets_tx",
+                "num_packets_rx",
+                "num_packets_rx_bad",
+                "num_online_nodes",
+                "num_total_nodes",
+                "num_rx_dupe",
+                "num_tx_relay",
+                "num_tx_relay_canceled",
+                "heap_total_bytes",
+                "heap_free_bytes",
+                "num_tx_dropped",
+                "noise_floor",
+            ],
+        ),
+        "power_metrics": (
+            NodeTelemetryPower,
+            [
+                "ch1_voltage",
+                "ch1_current",
+                "ch2_voltage",
+                "ch2_current",
+                "ch3_voltage",
+                "ch3_current",
+            ],
+        ),
+    }
+
+    # 取出紀錄中已登錄的 variant，回傳 [(model, {欄位: 值}), ...]
+    def extract(record: TelemetryRecord) -> list:
+        registered = TelemetryRegistryUtil.REGISTRY.get(record.variant)
+        if registered is None or not record.has_metrics():
+            return []
+        model, columns = registered
+        values = {}
+        for column in columns:
+            column, field = column if isinstance(column, tuple) else (column, column)
+            values[column] = TelemetryRegistryUtil.sanitize(record.metric(field))
+        return [(model, values)]
+
+    # 紀錄中沒有對應資料表的 variant
+    def unregistered_variants(record: TelemetryRecord) -> list:
+        if (
+            not record.has_metrics()
+            or record.variant in TelemetryRegistryUtil.REGISTRY
+        ):
+            return []
+        return [record.variant]
+
+    # NaN 視為未設定
+    def sanitize(value):
+        if value == "NaN" or (isinstance(value, float) and math.isnan(value)):
+            return None
+        return value
@@ -0,0 +1,124 @@
+import logging
+from datetime import datetime
+from app.models.NodeInfoModel import NodeInfo
+from app.models.NodeModel import Node
+from app.models.NodeNeighborInfoModel import NodeNeighborInfo
+from app.models.NodePositionModel import NodePosition
+from app.models.NodeTelemetryAirQualityModel import NodeTelemetryAirQuality
+from app.models.NodeTelemetryDeviceModel import NodeTelemetryDevice
+from app.models.NodeTelemetryEnvironmentModel import NodeTelemetryEnvironment
+from app.models.NodeTelemetryHealthModel import NodeTelemetryHealth
+from app.models.NodeTelemetryLocalStatsModel import NodeTelemetryLocalStats
+from app.models.NodeTelemetryPowerModel import NodeTelemetryPower
+from sqlalchemy import DateTime, func, text
+from sqlalchemy.dialects.postgresql import insert
+
+logger = logging.getLogger(__name__)
+
+
+class UpsertUtil:
+    # 各資料表的衝突鍵，依寫入順序排列（node 必須最先寫入以滿足外鍵）
+    CONFLICT_KEYS = {
+        Node: ["id"],
+        NodeInfo: ["node_id"],
+        NodeNeighborInfo: ["node_id"],
+        NodePosition: ["node_id", "create_at", "topic"],
+        NodeTelemetryAirQuality: ["node_id", "create_at"],
+        NodeTelemetryDevice: ["node_id", "create_at"],
+        NodeTelemetryEnvironment: ["node_id", "create_at"],
+        NodeTelemetryHealth: ["node_id", "create_at"],
+        NodeTelemetryLocalStats: ["node_id", "create_at"],
+        NodeTelemetryPower: ["node_id", "create_at"],
+    }
+
+    # 資料表名稱對應的 model
+    MODELS = {model.__tablename__: model for model in CONFLICT_KEYS}
+    # PostgreSQL 單一語句的參數上限
+    MAX_PARAMETERS = 30000
+
+    # 將 entity 轉為只含有值欄位的 dict（uuid 由預設值產生）
+    def entity_to_row(entity) -> dict:
+        return {
+            column.name: getattr(entity, column.name)
+            for column in type(entity).__table__.columns
+            if column.name != "uuid" and getattr(entity, column.name) is not None
+        }
+
+    # 建立 INSERT ... ON CONFLICT DO UPDATE，rows 的欄位組合需相同
+    # 只更新 rows 中有提供的欄位，未提供（空值）的欄位在新增時使用預設值、在更新時保留原值；
+    # 有 update_at 時，資料庫中的資料比較新則不更新
+    def build_upsert(model, rows: list[dict]):
+        keys = UpsertUtil.CONFLICT_KEYS[model]
+        table = model.__table__
+        stmt = insert(model).values(rows)
+        set_ = {
+            column: stmt.excluded[column] for column in rows[0] if column not in keys
+        }
+        if model is Node and "last_heard_at" in set_:
+            set_["last_heard_at"] = func.greatest(
+                table.c.last_heard_at, stmt.excluded.last_heard_at
+            )
+        if not set_:
+            return stmt.on_conflict_do_nothing(index_elements=keys)
+        if "update_at" in set_:
+            return stmt.on_conflict_do_update(
+                index_elements=keys,
+                set_=set_,
+                where=table.c.update_at <= stmt.excluded.update_at,
+            )
+        return stmt.on_conflict_do_update(index_elements=keys, set_=set_)
+
+    # 建立由 staging 資料表合併至正式資料表的語句
+    # 以 DELETE ... RETURNING 取出 staging 中已 commit 的資料，合併期間仍可繼續 COPY；
+    # 同一衝突鍵只取最新的一筆，空值欄位保留原值，資料庫中的資料較新則不更新
+    def build_staging_merge(model, staging_table: str):
+        keys = UpsertUtil.CONFLICT_KEYS[model]
+        columns = [column.name for column in model.__table__.columns]
+        column_list = ", ".join(columns)
+        key_list = ", ".join(keys)
+        set_list = ", ".join(
+            f"{column} = COALESCE(EXCLUDED.{column}, t.{column})"
+            for column in columns
+            if column not in keys and column != "uuid"
+        )
+        return text(
+            f"WITH moved AS (DELETE FROM {staging_table} RETURNING {column_list}) "
+            f"INSERT INTO {model.__tablename__} AS t ({column_list}) "
+            f"SELECT DISTINCT ON ({key_list}) {column_list} FROM moved "
+            f"ORDER BY {key_list}, update_at DESC "
+            f"ON CONFLICT ({key_list}) DO UPDATE SET {set_list} "
+            f"WHERE t.update_at <= EXCLUDED.update_at"
+        )
+
+    # 以多筆 upsert 寫入同一張表的資料，不會 commit，由呼叫端於同一個 transaction 中完成
+    # 依欄位組合分組：未提供的欄位在新增時使用預設值，在更新時保留原值
+    async def upsert_rows(session, model, rows: list[dict]) -> None:
+        shapes = {}
+        for row in rows:
+            shapes.setdefault(tuple(sorted(row)), []).append(row)
+        for columns, shape_rows in shapes.items():
+            chunk_size = max(1, UpsertUtil.MAX_PARAMETERS // max(1, len(columns)))
+            for i in range(0, len(shape_rows), chunk_size):
+                await session.execute(
+                    UpsertUtil.build_upsert(model, shape_rows[i : i + chunk_size])
+                )
+
+    # 將一筆資料轉為可寫入 JSON 的 dict：時間轉為 ISO 8601 字串，uuid 由預設值重新產生
+    def row_to_json(row: dict) -> dict:
+        return {
+            column: value.isoformat() if isinstance(value, datetime) else value
+            for column, value in row.items()
+            if column != "uuid"
+        }
+
+    # row_to_json 的反向轉換
+    def row_from_json(model, data: dict) -> dict:
+        columns = model.__table__.columns
+        return {
+            column: (
+                datetime.fromisoformat(value)
+                if value is not None and isinstance(columns[column].type, DateTime)
+                else value
+            )
+            for column, value in data.items()
+        }
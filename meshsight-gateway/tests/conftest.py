@@ -0,0 +1,12 @@
+import pytest
+from app.utils.ConfigUtil import ConfigUtil
+
+
+# 以測試用的設定取代 configs/config.yml，回傳的 dict 可在測試中修改
+@pytest.fixture
+def config(monkeypatch, tmp_path):
+    config = {"log": {"level": "INFO"}, "ingest": {}}
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ConfigUtil, "__init__", lambda self, *args, **kwargs: None)
+    monkeypatch.setattr(ConfigUtil, "read_config", lambda self: config)
+    return config
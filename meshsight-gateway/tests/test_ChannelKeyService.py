@@ -0,0 +1,69 @@
+import pytest
+from app.services.ChannelKeyService import ChannelKeyService
+from app.utils.MeshtasticDecodeUtil import MeshtasticDecodeUtil
+
+try:
+    from meshtastic.protobuf import mesh_pb2
+except ImportError:
+    from meshtastic import mesh_pb2
+
+TOPIC = "msh/TW/2/e/LongFast/!abcd1234"
+PUBLIC_HASH = MeshtasticDecodeUtil.channel_hash(
+    "LongFast", MeshtasticDecodeUtil.PUBLIC_KEY_BYTES
+)
+
+
+@pytest.fixture
+def service(config):
+    config["ingest"]["channelKeys"] = {"failureThreshold": 3, "negativeTtl": 600}
+    return ChannelKeyService()
+
+
+def fail(service, key, times):
+    for _ in range(times):
+        service.record(key, MeshtasticDecodeUtil.DECRYPT_FAILED)
+
+
+def test_skips_key_after_consecutive_failures(service):
+    key = ("LongFast", PUBLIC_HASH)
+    fail(service, key, 2)
+    assert service.skip_keys() == frozenset()
+    fail(service, key, 1)
+    assert service.skip_keys() == {key}
+    assert service.stats()["skippedKeys"] == [f"LongFast/{PUBLIC_HASH}"]
+
+
+def test_success_resets_failures(service):
+    key = ("LongFast", PUBLIC_HASH)
+    fail(service, key, 2)
+    service.record(key, MeshtasticDecodeUtil.DECRYPT_OK)
+    fail(service, key, 2)
+    assert service.skip_keys() == frozenset()
+
+
+def test_other_keys_on_same_channel_are_not_skipped(service):
+    bad_key = ("LongFast", PUBLIC_HASH ^ 1)
+    fail(service, bad_key, 3)
+    assert service.skip_keys() == {bad_key}
+
+    # 暫停的金鑰不嘗試解密，同一頻道的公開金鑰仍會解密
+    mp = mesh_pb2.MeshPacket(id=1, encrypted=b"\x00" * 8)
+    setattr(mp, "from", 2)
+    mp.channel = PUBLIC_HASH ^ 1
+    channel_keys = MeshtasticDecodeUtil.compile_channel_keys([])
+    assert MeshtasticDecodeUtil.decode_mesh_packet(
+        TOPIC, mp, channel_keys, service.skip_keys()
+    ) == (None, MeshtasticDecodeUtil.DECRYPT_SKIPPED, bad_key)
+    mp.channel = PUBLIC_HASH
+    _, decrypt_result, key = MeshtasticDecodeUtil.decode_mesh_packet(
+        TOPIC, mp, channel_keys, service.skip_keys()
+    )
+    assert key == ("LongFast", PUBLIC_HASH)
+    assert decrypt_result != MeshtasticDecodeUtil.DECRYPT_SKIPPED
+
+
+def test_skip_expires(service):
+    key = ("LongFast", PUBLIC_HASH)
+    fail(service, key, 3)
+    service.skip_until[key] = 0
+    assert service.skip_keys() == frozenset()
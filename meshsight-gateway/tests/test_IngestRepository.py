@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from app.repositories.IngestRepository import IngestRepository
+from app.services.DurabilityService import DurabilityService
+from app.services.NodeRegistryService import NodeRegistryService
+
+
+# 記錄執行過的 SQL 與交易狀態的 asyncpg 連線
+class FakeConnection:
+    def __init__(self, log: list) -> None:
+        self.log = log
+
+    def transaction(self):
+        return FakeTransaction(self.log)
+
+    async def executemany(self, sql, args):
+        self.log.append(sql.split()[0])
+
+
+class FakeTransaction:
+    def __init__(self, log: list) -> None:
+        self.log = log
+
+    async def start(self):
+        self.log.append("BEGIN")
+
+    async def commit(self):
+        self.log.append("COMMIT")
+
+    async def rollback(self):
+        self.log.append("ROLLBACK")
+
+
+class FakePool:
+    def __init__(self) -> None:
+        self.log = []
+        self.acquired = 0
+        self.released = 0
+
+    async def acquire(self):
+        self.acquired += 1
+        return FakeConnection(self.log)
+
+    async def release(self, connection):
+        self.released += 1
+
+
+@pytest.fixture
+def repository(config):
+    repository = IngestRepository(NodeRegistryService(), DurabilityService())
+    repository.pool = FakePool()
+    return repository
+
+
+def test_transaction_without_writes_takes_no_connection(repository):
+    async def run():
+        async with repository.transaction():
+            pass
+
+    asyncio.run(run())
+    assert repository.pool.acquired == 0
+    assert repository.pool.log == []
+
+
+def test_transaction_begins_on_first_write(repository):
+    async def run():
+        async with repository.transaction() as connection:
+            await repository.ensure_nodes(connection, [2, 1])
+
+    asyncio.run(run())
+    assert repository.pool.log == ["BEGIN", "INSERT", "COMMIT"]
+    assert repository.pool.released == 1
+    assert repository.node_registry_service.is_known(1)
+    assert repository.node_registry_service.is_known(2)
+
+
+def test_failed_transaction_rolls_back(repository):
+    async def run():
+        async with repository.transaction() as connection:
+            await repository.ensure_nodes(connection, [1])
+            raise RuntimeError("write failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+    assert repository.pool.log == ["BEGIN", "INSERT", "ROLLBACK"]
+    assert repository.pool.released == 1
+    assert not repository.node_registry_service.is_known(1)
@@ -0,0 +1,72 @@
+import pytest
+from app.schemas.packet.PacketSchema import (
+    PacketRecord,
+    PositionRecord,
+    TelemetryRecord,
+)
+from app.services.LoadShedService import LoadShedService
+
+
+@pytest.fixture
+def shed_config(config):
+    config["ingest"]["loadShedding"] = {
+        "enabled": True,
+        "nodeRate": 0,
+        "nodeBurst": 3,
+        "priorities": {"position": 1, "telemetry": 3},
+        "overloadThresholds": {3: 0.5},
+    }
+    return config["ingest"]["loadShedding"]
+
+
+def test_node_burst_is_limited_per_message_type(shed_config):
+    service = LoadShedService()
+    results = [service.admit(TelemetryRecord(from_id=1)) for _ in range(5)]
+    assert results == [True, True, True, False, False]
+    # 同一節點的其他訊息類型與其他節點不受影響
+    assert service.admit(PositionRecord(from_id=1))
+    assert service.admit(TelemetryRecord(from_id=2))
+    stats = service.stats()
+    assert stats["accepted"] == 5
+    assert stats["byClass"] == {3: {LoadShedService.REASON_NODE: 2}}
+    assert stats["topNodes"] == {"00000001": 2}
+
+
+def test_overload_sheds_low_priority_only(shed_config):
+    service = LoadShedService(lambda: 0.6)
+    assert not service.admit(TelemetryRecord(from_id=1))
+    assert service.admit(PositionRecord(from_id=1))
+    assert service.stats()["byClass"] == {3: {LoadShedService.REASON_OVERLOAD: 1}}
+
+
+def test_below_threshold_is_admitted(shed_config):
+    service = LoadShedService(lambda: 0.4)
+    assert service.admit(TelemetryRecord(from_id=1))
+
+
+def test_port_limit(shed_config):
+    shed_config["portLimits"] = {"position": {"rate": 0, "burst": 2}}
+    service = LoadShedService()
+    results = [service.admit(PositionRecord(from_id=node_id)) for node_id in range(4)]
+    assert results == [True, True, False, False]
+    assert service.stats()["byClass"] == {1: {LoadShedService.REASON_PORT: 2}}
+
+
+def test_disabled_admits_everything(shed_config):
+    shed_config["enabled"] = False
+    service = LoadShedService(lambda: 1.0)
+    assert all(service.admit(TelemetryRecord(from_id=1)) for _ in range(10))
+
+
+def test_overload_sheds_unlisted_types_first(shed_config):
+    shed_config["priorities"] = {"position": 0, "telemetry": 2}
+    shed_config["overloadThresholds"] = {2: 0.5, 1: 0.7}
+    service = LoadShedService(lambda: 0.6)
+    # 未列出的類型為最低等級（3），使用最低的門檻
+    assert not service.admit(PacketRecord(from_id=1, type="text"))
+    assert not service.admit(TelemetryRecord(from_id=1))
+    assert service.admit(PositionRecord(from_id=1))
+    assert service.stats()["byClass"] == {
+        2: {LoadShedService.REASON_OVERLOAD: 1},
+        3: {LoadShedService.REASON_OVERLOAD: 1},
+    }
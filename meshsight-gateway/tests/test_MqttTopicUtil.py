@@ -0,0 +1,63 @@
+import pytest
+from app.utils.MqttTopicUtil import MqttTopicUtil
+
+
+@pytest.mark.parametrize(
+    "topic_filter, other, expected",
+    [
+        ("msh/#", "msh/TW/2/e/LongFast/#", True),
+        ("msh/#", "msh", True),
+        ("msh/+/2/e/#", "msh/TW/2/e/LongFast/!1", True),
+        ("msh/TW/#", "msh/+/2/e/#", False),
+        ("msh/+/2/e", "msh/TW/2/e", True),
+        ("msh/+/2/e", "msh/TW/2/e/LongFast", False),
+        ("msh/TW/2/e/#", "msh/TW/#", False),
+    ],
+)
+def test_covers(topic_filter, other, expected):
+    assert MqttTopicUtil.covers(topic_filter, other) is expected
+
+
+@pytest.mark.parametrize(
+    "topic_filter, other, expected",
+    [
+        ("msh/TW/#", "msh/+/2/e/#", True),
+        ("msh/TW/#", "msh/JP/#", False),
+        ("msh/+/2/e/+", "msh/TW/2/map", False),
+        ("msh/+/2/json/#", "msh/TW/2/+/LongFast", True),
+        ("msh/TW/2/e", "msh/TW/2/e/LongFast", False),
+    ],
+)
+def test_overlaps(topic_filter, other, expected):
+    assert MqttTopicUtil.overlaps(topic_filter, other) is expected
+    assert MqttTopicUtil.overlaps(other, topic_filter) is expected
+
+
+def test_plan_filters_removes_covered():
+    kept, removed = MqttTopicUtil.plan_filters(
+        ["msh/TW/2/e/#", "msh/TW/#", "msh/JP/#", "msh/TW/#"]
+    )
+    assert kept == ["msh/TW/#", "msh/JP/#"]
+    assert removed == {"msh/TW/2/e/#": "msh/TW/#"}
+
+
+def test_partition_filters_keeps_overlapping_filters_together():
+    filters = ["msh/TW/#", "msh/JP/#", "msh/+/2/map", "msh/US/#", "msh/EU/#"]
+    partitions = MqttTopicUtil.partition_filters(filters, 3)
+    assert sorted(sum(partitions, [])) == sorted(filters)
+    # 互相重疊的 filter 分在同一組，不同組之間不會收到相同的主題
+    for i, partition in enumerate(partitions):
+        for other in partitions[i + 1 :]:
+            assert not any(
+                MqttTopicUtil.overlaps(a, b) for a in partition for b in other
+            )
+    # msh/+/2/map 與所有國家的 filter 重疊，全部分在同一組
+    assert partitions == [filters, [], []]
+    # 沒有重疊時依 filter 數量平均分配，並保留原本的順序
+    partitions = MqttTopicUtil.partition_filters(filters[:2] + filters[3:], 2)
+    assert partitions == [["msh/TW/#", "msh/US/#"], ["msh/JP/#", "msh/EU/#"]]
+
+
+def test_partition_filters_with_more_groups_than_filters():
+    partitions = MqttTopicUtil.partition_filters(["msh/TW/#"], 2)
+    assert partitions == [["msh/TW/#"], []]
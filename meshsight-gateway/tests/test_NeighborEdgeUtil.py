@@ -0,0 +1,36 @@
+from app.utils.NeighborEdgeUtil import NeighborEdgeUtil
+
+
+def test_unchanged_edges_write_nothing():
+    existing = [("a", 2, 6.25), ("b", 3, -7.0)]
+    edges = [{"edge_node_id": 3, "snr": -7.0}, {"edge_node_id": 2, "snr": 6.25}]
+    assert NeighborEdgeUtil.diff_edges(existing, edges) == ([], [], [])
+
+
+def test_diff_inserts_updates_and_deletes():
+    existing = [("a", 2, 6.25), ("b", 3, -7.0), ("c", 4, 1.0)]
+    edges = [
+        {"edge_node_id": 2, "snr": 6.25},
+        {"edge_node_id": 3, "snr": -5.5},
+        {"edge_node_id": 5, "snr": 2.0},
+    ]
+    inserts, updates, deletes = NeighborEdgeUtil.diff_edges(existing, edges)
+    assert inserts == [{"edge_node_id": 5, "snr": 2.0}]
+    assert updates == [("b", -5.5)]
+    assert deletes == ["c"]
+
+
+def test_duplicates_use_last_edge_and_remove_extra_rows():
+    existing = [("a", 2, 6.25), ("b", 2, 6.25)]
+    edges = [{"edge_node_id": 2, "snr": 1.0}, {"edge_node_id": 2, "snr": 3.0}]
+    inserts, updates, deletes = NeighborEdgeUtil.diff_edges(existing, edges)
+    assert inserts == []
+    assert updates == [("a", 3.0)]
+    assert deletes == ["b"]
+
+
+def test_empty_list_deletes_all_edges():
+    existing = [("a", 2, 6.25), ("b", 3, None)]
+    assert NeighborEdgeUtil.diff_edges(existing, []) == ([], [], ["a", "b"])
+    edges = [{"edge_node_id": 3}]
+    assert NeighborEdgeUtil.diff_edges([], edges) == (edges, [], [])
@@ -0,0 +1,66 @@
+import os
+import pytest
+from app.services.PacketArchiveService import PacketArchiveService
+from app.utils.PacketArchiveUtil import PacketArchiveUtil
+
+RECORDS = [
+    (1000.0 + i, "broker", f"msh/TW/2/e/LongFast/!{i:08x}", bytes([i]) * 20)
+    for i in range(6)
+]
+
+
+# 以 PacketArchiveService 寫入 segment 與索引，每個區塊 2 筆紀錄
+@pytest.fixture
+def segment_path(config):
+    config["ingest"]["archive"] = {"path": "archive"}
+    service = PacketArchiveService()
+    os.makedirs(service.path)
+    for i in range(0, len(RECORDS), 2):
+        block = RECORDS[i : i + 2]
+        service.write_block(
+            b"".join(PacketArchiveUtil.encode_record(*record) for record in block),
+            len(block),
+            block[0][0],
+            block[-1][0],
+        )
+    service.close_segment()
+    [segment_path] = PacketArchiveUtil.list_segments(service.path)
+    return segment_path
+
+
+def read_index(segment_path: str) -> list:
+    with open(segment_path, "rb") as file:
+        return PacketArchiveUtil.read_index(segment_path, file.read())
+
+
+def test_round_trip(segment_path):
+    path = os.path.dirname(segment_path)
+    assert list(PacketArchiveUtil.read_archive(path)) == RECORDS
+
+
+def test_time_range(segment_path):
+    records = list(PacketArchiveUtil.read_segment(segment_path, 1001.0, 1003.5))
+    assert records == RECORDS[1:4]
+
+
+def test_read_index_rebuilds_missing_entries(segment_path):
+    expected = read_index(segment_path)
+    assert [entry[:2] for entry in expected] == [
+        (1000.0, 1001.0),
+        (1002.0, 1003.0),
+        (1004.0, 1005.0),
+    ]
+    # 索引檔只有第一個區塊，或不存在時，由區塊標頭補齊
+    index_path = PacketArchiveUtil.index_path(segment_path)
+    with open(index_path, "r+b") as file:
+        file.truncate(PacketArchiveUtil.INDEX_ENTRY.size)
+    assert read_index(segment_path) == expected
+    os.remove(index_path)
+    assert read_index(segment_path) == expected
+
+
+def test_incomplete_last_block_is_skipped(segment_path):
+    os.remove(PacketArchiveUtil.index_path(segment_path))
+    with open(segment_path, "r+b") as file:
+        file.truncate(os.path.getsize(segment_path) - 5)
+    assert list(PacketArchiveUtil.read_segment(segment_path)) == RECORDS[:4]
@@ -0,0 +1,66 @@
+import pytest
+from app.schemas.packet.PacketSchema import PositionRecord, TelemetryRecord
+from app.services import PacketDedupService as dedup_module
+from app.services.PacketDedupService import PacketDedupService
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(dedup_module.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+@pytest.fixture
+def service(config, clock):
+    config["ingest"]["dedup"] = {"enabled": True, "ttl": 600, "maxEntries": 2}
+    return PacketDedupService()
+
+
+def test_lookup_matches_from_id_and_packet_id(service):
+    record = TelemetryRecord(id=7, from_id=1, portnum=67, topic="msh/a")
+    service.remember(record)
+    assert service.lookup(1, 7)["record"] is record
+    assert service.lookup(1, 7, 67)["record"] is record
+    # portnum 不同或未設定封包 ID 時不視為重複
+    assert service.lookup(1, 7, 3) is None
+    assert service.lookup(1, 0) is None
+    assert service.lookup(2, 7) is None
+
+
+def test_entries_expire_after_ttl(service, clock):
+    service.remember(TelemetryRecord(id=7, from_id=1, topic="msh/a"))
+    clock[0] += 599
+    assert service.lookup(1, 7) is not None
+    clock[0] += 1
+    assert service.lookup(1, 7) is None
+    assert service.stats()["entries"] == 0
+
+
+def test_oldest_entries_are_evicted(service):
+    for packet_id in (1, 2, 3):
+        service.remember(TelemetryRecord(id=packet_id, from_id=1, topic="msh/a"))
+    assert service.lookup(1, 1) is None
+    assert service.lookup(1, 3) is not None
+
+
+def test_record_topic_only_rewrites_position(service):
+    position = PositionRecord(id=7, from_id=1, topic="msh/a")
+    service.remember(position)
+    entry = service.lookup(1, 7)
+    # 相同 topic 重複收到時不再寫入，新的 gateway topic 以新 topic 寫入
+    assert service.record_topic(entry, "msh/a") is None
+    copied = service.record_topic(entry, "msh/b")
+    assert copied.topic == "msh/b" and position.topic == "msh/a"
+    assert service.record_topic(entry, "msh/b") is None
+
+    service.remember(TelemetryRecord(id=8, from_id=1, topic="msh/a"))
+    entry = service.lookup(1, 8)
+    assert service.record_topic(entry, "msh/b") is None
+    assert entry["topics"] == {"msh/a", "msh/b"}
+
+
+def test_disabled_remembers_nothing(service):
+    service.enabled = False
+    service.remember(TelemetryRecord(id=7, from_id=1, topic="msh/a"))
+    assert service.lookup(1, 7) is None
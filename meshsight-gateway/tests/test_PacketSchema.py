@@ -0,0 +1,54 @@
+import json
+from google.protobuf import json_format
+from app.schemas.packet.PacketSchema import (
+    NeighborInfoRecord,
+    PacketRecord,
+    PositionRecord,
+    TelemetryRecord,
+)
+
+try:
+    from meshtastic.protobuf import mesh_pb2, telemetry_pb2
+except ImportError:
+    from meshtastic import mesh_pb2, telemetry_pb2
+
+
+def test_float_fields_match_message_to_json():
+    telemetry = telemetry_pb2.Telemetry(time=1700000000)
+    telemetry.environment_metrics.temperature = 25.3
+    telemetry.environment_metrics.relative_humidity = 61.7
+    telemetry.environment_metrics.voltage = 3.9
+    record = TelemetryRecord.from_payload_bytes(telemetry.SerializeToString())
+    expected = json.loads(
+        json_format.MessageToJson(telemetry, preserving_proto_field_name=True)
+    )["environment_metrics"]
+    assert expected["temperature"] == 25.3
+    for name, value in expected.items():
+        assert record.metric(name) == value
+    assert record.metric("barometric_pressure") is None
+
+
+def test_nan_float_is_unset():
+    telemetry = telemetry_pb2.Telemetry()
+    telemetry.device_metrics.voltage = float("nan")
+    telemetry.device_metrics.battery_level = 80
+    record = TelemetryRecord.from_payload_bytes(telemetry.SerializeToString())
+    assert record.metric("voltage") is None
+    assert record.metric("battery_level") == 80
+
+
+def test_neighbor_snr_is_rounded():
+    neighbor_info = mesh_pb2.NeighborInfo(node_id=1)
+    neighbor_info.neighbors.add(node_id=2, snr=6.25)
+    neighbor_info.neighbors.add(node_id=3, snr=-7.3)
+    record = NeighborInfoRecord.from_payload_bytes(neighbor_info.SerializeToString())
+    assert record.neighbors == [(2, 6.25), (3, -7.3)]
+
+
+def test_received_at_survives_spool_round_trip():
+    record = PositionRecord(from_id=1, topic="msh/2/e/LongFast/!1", received_at=1.5)
+    record.latitude_i = 250000000
+    restored = PacketRecord.from_json(json.loads(json.dumps(record.to_dict())))
+    assert isinstance(restored, PositionRecord)
+    assert restored.received_at == 1.5
+    assert restored.latitude_i == 250000000
@@ -0,0 +1,98 @@
+import struct
+from app.utils.PcapUtil import PcapUtil
+
+BROKER = "10.0.0.1"
+CLIENT = "10.0.0.2"
+
+
+def mqtt_publish(topic: str, payload: bytes) -> bytes:
+    body = struct.pack("!H", len(topic)) + topic.encode() + payload
+    assert len(body) < 128
+    return bytes([PcapUtil.MQTT_PUBLISH << 4, len(body)]) + body
+
+
+def tcp_frame(seq: int, data: bytes) -> bytes:
+    tcp = struct.pack("!HHIIBBHHH", 1883, 50000, seq, 0, 5 << 4, 0x18, 0, 0, 0)
+    ip = struct.pack(
+        "!BBHHHBBH4s4s",
+        0x45,
+        0,
+        20 + len(tcp) + len(data),
+        0,
+        0,
+        64,
+        6,
+        0,
+        bytes(map(int, BROKER.split("."))),
+        bytes(map(int, CLIENT.split("."))),
+    )
+    return ip + tcp + data
+
+
+def write_pcap(path, segments: list) -> None:
+    with open(path, "wb") as file:
+        file.write(b"\xd4\xc3\xb2\xa1")
+        file.write(struct.pack("<HHiIII", 2, 4, 0, 0, 65535, PcapUtil.LINKTYPE_RAW))
+        for index, (seq, data) in enumerate(segments):
+            frame = tcp_frame(seq, data)
+            header = struct.pack("<IIII", 1700000000 + index, 0, len(frame), len(frame))
+            file.write(header + frame)
+
+
+def read(path) -> list:
+    return [
+        (broker, topic, payload)
+        for _, broker, topic, payload in PcapUtil.read_mqtt_publishes(str(path))
+    ]
+
+
+def test_seq_delta_wraps():
+    assert PcapUtil.seq_delta(5, 0xFFFFFFF0) == 21
+    assert PcapUtil.seq_delta(0xFFFFFFF0, 5) == -21
+    assert PcapUtil.seq_delta(100, 100) == 0
+
+
+def test_stream_across_sequence_wrap(tmp_path):
+    first = mqtt_publish("msh/TW/2/e/LongFast/!a", b"one")
+    second = mqtt_publish("msh/TW/2/e/LongFast/!b", b"two")
+    stream = first + second
+    start = 0xFFFFFFFF - 9
+    # 第一段跨越序號溢位，第二段為跨越溢位的重送，最後補上剩餘資料
+    segments = [
+        (start, stream[:20]),
+        ((start + 10) & 0xFFFFFFFF, stream[10:20]),
+        ((start + 20) & 0xFFFFFFFF, stream[20:]),
+    ]
+    write_pcap(tmp_path / "capture.pcap", segments)
+    assert read(tmp_path / "capture.pcap") == [
+        (f"{BROKER}:1883", "msh/TW/2/e/LongFast/!a", b"one"),
+        (f"{BROKER}:1883", "msh/TW/2/e/LongFast/!b", b"two"),
+    ]
+
+
+def test_retransmission_after_wrap_is_trimmed(tmp_path):
+    first = mqtt_publish("msh/TW/2/e/LongFast/!a", b"one")
+    second = mqtt_publish("msh/TW/2/e/LongFast/!b", b"two")
+    start = 0xFFFFFFFF - 4
+    end = (start + len(first)) & 0xFFFFFFFF
+    segments = [
+        (start, first),
+        # 溢位前的序號重送已收到的資料，不可視為遺失封包而重新同步
+        (start, first + second[:3]),
+        ((end + 3) & 0xFFFFFFFF, second[3:]),
+    ]
+    write_pcap(tmp_path / "capture.pcap", segments)
+    assert [topic for _, topic, _ in read(tmp_path / "capture.pcap")] == [
+        "msh/TW/2/e/LongFast/!a",
+        "msh/TW/2/e/LongFast/!b",
+    ]
+
+
+def test_gap_resynchronizes(tmp_path):
+    first = mqtt_publish("msh/TW/2/e/LongFast/!a", b"one")
+    second = mqtt_publish("msh/TW/2/e/LongFast/!b", b"two")
+    segments = [(1000, first[:5]), (1000 + len(first) + 100, second)]
+    write_pcap(tmp_path / "capture.pcap", segments)
+    assert [topic for _, topic, _ in read(tmp_path / "capture.pcap")] == [
+        "msh/TW/2/e/LongFast/!b"
+    ]
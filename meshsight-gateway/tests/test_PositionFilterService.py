@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.services.PositionFilterService import PositionFilterService
+
+HOUR = datetime(2026, 10, 17, 8, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def service(config):
+    config["ingest"]["positionFilter"] = {
+        "enabled": True,
+        "minDistance": 10,
+        "heartbeat": 900,
+    }
+    return PositionFilterService()
+
+
+def should_write(service, seconds, latitude=25.0):
+    return service.should_write(
+        1, "msh/TW", latitude, 121.5, 13, HOUR, HOUR + timedelta(seconds=seconds)
+    )
+
+
+def test_small_moves_within_the_hour_are_suppressed(service):
+    assert should_write(service, 0)
+    assert not should_write(service, 60, 25.00001)
+    # 移動超過 minDistance、超過 heartbeat 時寫入
+    assert should_write(service, 120, 25.001)
+    assert should_write(service, 1200, 25.001)
+    assert service.stats()["suppressed"] == 1
+
+
+def test_forget_after_failed_write(service):
+    assert should_write(service, 0)
+    # 寫入失敗，清除紀錄後相同位置的下一筆資料仍寫入
+    service.forget(1, "msh/TW")
+    assert should_write(service, 60)
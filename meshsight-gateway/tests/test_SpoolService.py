@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+import pytest
+from app.models.NodeTelemetryDeviceModel import NodeTelemetryDevice
+from app.schemas.packet.PacketSchema import PacketRecord, PositionRecord
+from app.services.SpoolService import SpoolService
+from app.utils.UpsertUtil import UpsertUtil
+
+
+@pytest.fixture
+def spool_config(config):
+    config["ingest"]["spool"] = {"path": "spool", "drainBatchSize": 2}
+    return config["ingest"]["spool"]
+
+
+def position(node_id: int) -> PositionRecord:
+    record = PositionRecord(id=node_id, from_id=node_id, topic="msh/TW/2/e/LongFast")
+    record.latitude_i = 250000000 + node_id
+    return record
+
+
+def spool_with(service: SpoolService, records: list) -> str:
+    for record in records:
+        service.append(record)
+    segment_path = service.segment_path
+    service.close_segment()
+    return segment_path
+
+
+def test_segment_deleted_after_confirm(spool_config):
+    handled = []
+    confirmed = []
+
+    async def handler(record):
+        handled.append(record)
+
+    async def confirm():
+        # 確認時已交給 handler 的紀錄仍保留於 segment
+        confirmed.append((len(handled), os.path.exists(segment_path)))
+
+    service = SpoolService(handler, confirm=confirm)
+    segment_path = spool_with(service, [position(node_id) for node_id in range(5)])
+    asyncio.run(service.drain())
+    assert [record.from_id for record in handled] == [0, 1, 2, 3, 4]
+    assert handled[1].latitude_i == 250000001
+    assert confirmed == [(2, True), (4, True), (5, True)]
+    assert not os.path.exists(segment_path)
+    assert service.stats()["drained"] == 5
+
+
+def read_segment(segment_path: str) -> list:
+    with open(segment_path, "rb") as file:
+        return [PacketRecord.from_json(json.loads(line)).from_id for line in file]
+
+
+def test_respooled_records_are_not_kept_twice(spool_config):
+    handled = []
+    respooled = []
+    confirmed = []
+
+    async def handler(record):
+        handled.append(record.from_id)
+        if record.from_id == 2:
+            # 第 3 筆寫入時資料庫無法連線，由寫入流程再寫回 spool
+            service.mark_unavailable(OSError("connection refused"))
+            respooled.append(record.from_id)
+
+    async def confirm():
+        confirmed.append(list(handled))
+
+    service = SpoolService(handler, confirm=confirm)
+    segment_path = spool_with(service, [position(node_id) for node_id in range(5)])
+    asyncio.run(service.drain())
+    assert handled == [0, 1, 2]
+    # 刪除前確認已交給 handler 的紀錄，已再寫回 spool 的紀錄不保留於原 segment
+    assert confirmed == [[0, 1], [0, 1, 2]]
+    assert respooled == [2]
+    assert read_segment(segment_path) == [3, 4]
+
+
+def test_failed_line_is_kept_when_unavailable(spool_config):
+    handled = []
+
+    async def handler(record):
+        if record.from_id == 2:
+            # handler 因資料庫無法連線而失敗，這一行保留於 segment
+            raise OSError("connection refused")
+        handled.append(record.from_id)
+
+    service = SpoolService(handler)
+    segment_path = spool_with(service, [position(node_id) for node_id in range(5)])
+    asyncio.run(service.drain())
+    assert handled == [0, 1]
+    assert not service.available
+    assert read_segment(segment_path) == [2, 3, 4]
+
+
+def test_corrupted_line_is_skipped(spool_config):
+    handled = []
+
+    async def handler(record):
+        handled.append(record.from_id)
+
+    service = SpoolService(handler)
+    segment_path = spool_with(service, [position(1)])
+    with open(segment_path, "ab") as file:
+        file.write(b'{"type": "posi')
+    asyncio.run(service.drain())
+    assert handled == [1]
+    assert service.stats()["corrupted"] == 1
+    assert not os.path.exists(segment_path)
+
+
+def test_batch_round_trip(spool_config, monkeypatch):
+    written = []
+
+    async def write_batch(data):
+        written.append(data)
+
+    async def handler(record):
+        pass
+
+    service = SpoolService(handler)
+    monkeypatch.setattr(service, "write_batch", write_batch)
+    create_at = datetime(2026, 1, 1, 8, tzinfo=timezone.utc)
+    row = {"node_id": 1, "create_at": create_at, "voltage": 3.9}
+    edge = {"node_id": 1, "edge_node_id": 2, "snr": 6.25}
+    service.append_batch({NodeTelemetryDevice: [row]}, {1: [edge]})
+    segment_path = service.segment_path
+    service.close_segment()
+    asyncio.run(service.drain())
+    assert not os.path.exists(segment_path)
+    [data] = written
+    [spooled_row] = data["tables"][NodeTelemetryDevice.__tablename__]
+    assert UpsertUtil.row_from_json(NodeTelemetryDevice, spooled_row) == row
+    assert data["neighborEdges"] == [[1, [edge]]]
+    assert service.stats()["spooledRows"] == 1
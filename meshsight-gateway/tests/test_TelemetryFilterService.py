@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.models.NodeTelemetryDeviceModel import NodeTelemetryDevice
+from app.services.TelemetryFilterService import TelemetryFilterService
+
+HOUR = datetime(2026, 10, 17, 8, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def service(config):
+    config["ingest"]["telemetryFilter"] = {
+        "enabled": True,
+        "heartbeat": 1800,
+        "tolerances": {"node_telemetry_device": {"battery_level": 1}},
+    }
+    return TelemetryFilterService()
+
+
+def device(seconds, battery_level):
+    return NodeTelemetryDevice(
+        node_id=1,
+        battery_level=battery_level,
+        create_at=HOUR,
+        update_at=HOUR + timedelta(seconds=seconds),
+    )
+
+
+def test_changes_within_tolerance_are_suppressed(service):
+    assert service.should_write(device(0, 80))
+    assert not service.should_write(device(60, 81))
+    assert service.should_write(device(120, 78))
+    # 未設定值與有值之間的變化一律寫入
+    assert service.should_write(device(180, None))
+
+
+def test_forget_after_failed_write(service):
+    assert service.should_write(device(0, 80))
+    # 寫入失敗，清除紀錄後變化在範圍內的下一筆資料仍寫入
+    service.forget(1)
+    assert service.should_write(device(60, 80))
+    service.forget(1, "node_telemetry_device")
+    assert service.should_write(device(120, 80))
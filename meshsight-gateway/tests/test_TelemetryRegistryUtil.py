@@ -0,0 +1,51 @@
+from app.models.NodeTelemetryHealthModel import NodeTelemetryHealth
+from app.models.NodeTelemetryLocalStatsModel import NodeTelemetryLocalStats
+from app.schemas.packet.PacketSchema import TelemetryRecord
+from app.utils.TelemetryRegistryUtil import TelemetryRegistryUtil
+
+try:
+    from meshtastic.protobuf import telemetry_pb2
+except ImportError:
+    from meshtastic import telemetry_pb2
+
+
+def decode(telemetry) -> TelemetryRecord:
+    return TelemetryRecord.from_payload_bytes(telemetry.SerializeToString())
+
+
+def test_registered_columns_exist():
+    for model, columns in TelemetryRegistryUtil.REGISTRY.values():
+        for column in columns:
+            column = column[0] if isinstance(column, tuple) else column
+            assert column in model.__table__.columns
+
+
+def test_local_stats():
+    telemetry = telemetry_pb2.Telemetry(time=1700000000)
+    telemetry.local_stats.num_packets_tx = 12
+    telemetry.local_stats.channel_utilization = 7.3
+    telemetry.local_stats.noise_floor = -110
+    [(model, values)] = TelemetryRegistryUtil.extract(decode(telemetry))
+    assert model is NodeTelemetryLocalStats
+    assert values["num_packets_tx"] == 12
+    assert values["channel_utilization"] == 7.3
+    assert values["noise_floor"] == -110
+    assert values["num_packets_rx"] is None
+
+
+def test_health_metrics_maps_field_names():
+    telemetry = telemetry_pb2.Telemetry(time=1700000000)
+    telemetry.health_metrics.heart_bpm = 72
+    telemetry.health_metrics.spO2 = 98
+    telemetry.health_metrics.temperature = 36.6
+    [(model, values)] = TelemetryRegistryUtil.extract(decode(telemetry))
+    assert model is NodeTelemetryHealth
+    assert values == {"heart_bpm": 72, "spo2": 98, "temperature": 36.6}
+
+
+def test_unregistered_variant():
+    telemetry = telemetry_pb2.Telemetry(time=1700000000)
+    telemetry.host_metrics.load1 = 5
+    record = decode(telemetry)
+    assert TelemetryRegistryUtil.extract(record) == []
+    assert TelemetryRegistryUtil.unregistered_variants(record) == ["host_metrics"]
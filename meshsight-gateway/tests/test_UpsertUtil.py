@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+from sqlalchemy.dialects import postgresql
+from app.models.NodeInfoModel import NodeInfo
+from app.models.NodeModel import Node
+from app.models.NodePositionModel import NodePosition
+from app.utils.UpsertUtil import UpsertUtil
+
+NOW = datetime(2026, 10, 17, 8, 30, tzinfo=timezone.utc)
+
+
+def compile_upsert(model, rows: list) -> str:
+    statement = UpsertUtil.build_upsert(model, rows)
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+def test_node_last_heard_at_uses_greatest():
+    sql = compile_upsert(Node, [{"id": 1, "last_heard_at": NOW}])
+    assert "ON CONFLICT (id) DO UPDATE SET" in sql
+    assert "last_heard_at = greatest(node.last_heard_at, excluded.last_heard_at)" in sql
+    assert "WHERE" not in sql
+
+
+def test_only_provided_columns_are_updated():
+    sql = compile_upsert(
+        NodeInfo, [{"node_id": 1, "long_name": "Node 1", "update_at": NOW}]
+    )
+    set_clause = sql.split("DO UPDATE SET")[1]
+    assert "ON CONFLICT (node_id)" in sql
+    assert "long_name = excluded.long_name" in set_clause
+    assert "update_at = excluded.update_at" in set_clause
+    # 未提供的欄位保留原值，衝突鍵不更新
+    assert "short_name" not in set_clause
+    assert "node_id =" not in set_clause
+    # 資料庫中的資料較新時不更新
+    assert set_clause.endswith("WHERE node_info.update_at <= excluded.update_at")
+
+
+def test_conflict_keys_without_other_columns_do_nothing():
+    sql = compile_upsert(Node, [{"id": 1}])
+    assert sql.endswith("ON CONFLICT (id) DO NOTHING")
+
+
+def test_position_conflicts_on_hour_and_topic():
+    row = {
+        "node_id": 1,
+        "create_at": NOW.replace(minute=0),
+        "topic": "msh/TW",
+        "latitude": 25.0,
+        "update_at": NOW,
+    }
+    sql = compile_upsert(NodePosition, [row])
+    assert "ON CONFLICT (node_id, create_at, topic) DO UPDATE SET" in sql
+    assert "latitude = excluded.latitude" in sql
+
+
+def test_entity_to_row_skips_empty_columns_and_uuid():
+    entity = NodeInfo(node_id=1, long_name="Node 1", short_name=None, update_at=NOW)
+    assert UpsertUtil.entity_to_row(entity) == {
+        "node_id": 1,
+        "long_name": "Node 1",
+        "update_at": NOW,
+    }